@@ -1,18 +1,62 @@
 import os
+import io
+import csv
+import gzip
+import json
 import hashlib
+import logging
 import secrets
+import sqlite3
+import sys
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, Response, g, request, jsonify, make_response, send_file
 
 # Importa as funções de banco de dados
+import ativos
 import banco
+import imagens
+import importar_produtos as importador
+import json_rapido
+import logs
+import metricas
+import rastreio_sql
+import senhas
 
+log = logging.getLogger("dyva.app")
+# Uma linha por requisição (método, caminho, status e latência)
+log_acesso = logging.getLogger("dyva.acesso")
 
-def hash_senha(senha: str) -> str:
-	"""Gera hash SHA-256 da senha (simples para demo)."""
-	return hashlib.sha256(senha.encode("utf-8")).hexdigest()
+# Paginação do histórico de pedidos
+PEDIDOS_POR_PAGINA = 50
+PEDIDOS_POR_PAGINA_MAX = 200
+
+# Paginação da vitrine (GET /api/produtos?limit=): toda resposta tem no máximo uma página
+PRODUTOS_POR_PAGINA = 48
+PRODUTOS_POR_PAGINA_MAX = 200
+
+# Resultados da busca textual (GET /api/produtos/busca?limit=)
+BUSCA_LIMITE_PADRAO = 20
+BUSCA_LIMITE_MAX = 50
+
+# Linhas aceitas por sincronização do carrinho (PUT /api/carrinho)
+CARRINHO_MAX_LINHAS = 100
+
+# Cache-Control das leituras: o catálogo pode ficar em caches compartilhados,
+# mas sempre revalidado (ETag -> 304); dados do usuário só no navegador dele
+CACHE_CONTROL_CATALOGO = os.environ.get("DYVA_CACHE_CONTROL_CATALOGO", "public, no-cache")
+CACHE_CONTROL_PRIVADO = "private, no-cache"
+
+# Respostas da API maiores que isto vão com gzip para quem aceita. Nível 5:
+# quase o tamanho do 6 em bem menos tempo para payloads de alguns MB
+GZIP_MINIMO = int(os.environ.get("DYVA_GZIP_MINIMO", "1024"))
+GZIP_NIVEL = int(os.environ.get("DYVA_GZIP_NIVEL", "5"))
+TIPOS_COMPRIMIVEIS = ("application/json", "application/x-ndjson", "text/")
+
+# Se definido, GET /api/metrics exige "Authorization: Bearer <token>"
+METRICAS_TOKEN = os.environ.get("DYVA_METRICAS_TOKEN", "")
 
 
 def gerar_token() -> str:
@@ -20,12 +64,188 @@ def gerar_token() -> str:
 	return secrets.token_urlsafe(32)
 
 
-def criar_app() -> Flask:
-	# Inicializa banco e cria dados iniciais (admin + produtos)
-	banco.inicializar_banco()
-	banco.criar_admin_e_produtos()
+def resposta_pool_ocupado() -> Response:
+	"""503 imediato quando o pool de hash de senhas está cheio."""
+	resp = make_response(jsonify({"erro": "Servidor ocupado, tente novamente em instantes"}), 503)
+	resp.headers["Retry-After"] = "1"
+	return resp
+
+
+def gerar_csv(linhas, colunas, linhas_por_bloco: int = 500):
+	"""Serializa as linhas em CSV sob demanda, em blocos de texto (memória constante)."""
+	buffer = io.StringIO()
+	escritor = csv.DictWriter(buffer, fieldnames=colunas, extrasaction="ignore", lineterminator="\n")
+	escritor.writeheader()
+	for n, linha in enumerate(linhas, start=1):
+		escritor.writerow(linha)
+		if n % linhas_por_bloco == 0:
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate()
+	yield buffer.getvalue()
+
+
+def gerar_ndjson(linhas, colunas, linhas_por_bloco: int = 500):
+	"""Serializa as linhas como NDJSON (um objeto por linha), em blocos."""
+	bloco = []
+	for linha in linhas:
+		bloco.append(json.dumps({c: linha.get(c) for c in colunas}, ensure_ascii=False))
+		if len(bloco) >= linhas_por_bloco:
+			yield "\n".join(bloco) + "\n"
+			bloco = []
+	if bloco:
+		yield "\n".join(bloco) + "\n"
+
+
+FORMATOS_EXPORTACAO = {
+	"csv": (gerar_csv, "text/csv", "csv"),
+	"ndjson": (gerar_ndjson, "application/x-ndjson", "ndjson"),
+}
+
+
+def resposta_exportacao(linhas, colunas, formato: str, nome_base: str) -> Response:
+	"""Resposta em streaming: as linhas vão do cursor do banco direto para o cliente."""
+	gerar, mimetype, extensao = FORMATOS_EXPORTACAO[formato]
+	resp = Response(gerar(linhas, colunas), mimetype=mimetype)
+	resp.headers["Content-Disposition"] = f'attachment; filename="{nome_base}.{extensao}"'
+	resp.headers["Cache-Control"] = "no-store"
+	return resp
+
+
+def criar_app(inicializar: bool = True) -> Flask:
+	"""Cria a aplicação. Com ``inicializar=False`` as migrações e os dados
+	iniciais ficam por conta de quem chama (no gunicorn, o master roda uma
+	vez em ``on_starting``, antes dos workers)."""
+	# Logs em JSON escritos por uma thread de fundo (DYVA_LOG_NIVEL, DYVA_LOG_NIVEIS)
+	logs.configurar_logs()
+	if inicializar:
+		# Inicializa banco e cria dados iniciais (admin + produtos)
+		banco.inicializar_banco()
+		banco.criar_admin_e_produtos()
+	# Libera em segundo plano as reservas de estoque vencidas
+	banco.iniciar_coletor_reservas()
+	# Variantes das imagens enviadas são geradas por uma thread de fundo
+	imagens.iniciar_gerador()
 
 	app = Flask(__name__, static_folder=None)
+	# orjson quando instalado (DYVA_JSON=orjson|padrao escolhe)
+	app.json = json_rapido.criar_provedor(app)
+	# Com um nginx na frente, send_file devolve só o cabeçalho X-Sendfile e o nginx envia o arquivo
+	app.config["USE_X_SENDFILE"] = os.environ.get("DYVA_X_SENDFILE") == "1"
+
+	# ----------------------------
+	# Logs: request id, usuário e latência em cada registro
+	# ----------------------------
+	@app.before_request
+	def iniciar_log_requisicao():
+		g.inicio = time.perf_counter()
+		g.request_id = (request.headers.get("X-Request-Id") or "")[:64] or secrets.token_hex(8)
+		logs.definir_contexto(request_id=g.request_id)
+
+	@app.after_request
+	def registrar_acesso(response):
+		# Registrado primeiro, roda por último: a latência inclui o commit
+		response.headers["X-Request-Id"] = g.request_id
+		if log_acesso.isEnabledFor(logging.INFO):
+			log_acesso.info("%s %s %s", request.method, request.path, response.status_code, extra={"campos": {
+				"metodo": request.method,
+				"caminho": request.path,
+				"status": response.status_code,
+				"latencia_ms": round((time.perf_counter() - g.inicio) * 1000, 2),
+			}})
+		return response
+
+	@app.teardown_request
+	def limpar_log_requisicao(erro=None):
+		logs.limpar_contexto()
+
+	# ----------------------------
+	# Métricas (Prometheus): latência por rota, status, em andamento e banco
+	# ----------------------------
+	metricas_app = metricas.RegistroMetricas()
+	metricas_app.declarar("dyva_http_requisicoes_total", "counter", "Requisições por rota, método e status")
+	metricas_app.declarar("dyva_http_latencia_segundos", "histogram", "Latência das requisições por rota")
+	metricas_app.declarar("dyva_http_em_andamento", "gauge", "Requisições sendo atendidas agora")
+	metricas_app.declarar("dyva_db_consultas_total", "counter", "Comandos SQL executados, por rota")
+	metricas_app.declarar("dyva_db_segundos_total", "counter", "Tempo gasto em comandos SQL, por rota")
+	metricas_app.declarar("dyva_db_consultas_por_requisicao", "histogram", "Comandos SQL por requisição",
+		metricas.BALDES_CONTAGEM)
+	metricas_app.declarar("dyva_db_pool_conexoes", "gauge", "Conexões do pool SQLite por estado")
+	metricas_app.declarar("dyva_cache_acertos_total", "counter", "Acertos do cache em memória")
+	metricas_app.declarar("dyva_cache_falhas_total", "counter", "Falhas do cache em memória")
+	metricas_app.declarar("dyva_cache_itens", "gauge", "Entradas no cache em memória")
+	metricas_app.declarar("dyva_senhas_operacoes_total", "counter", "Operações do pool de senhas por resultado")
+	metricas_app.declarar("dyva_logs_descartados_total", "counter", "Registros de log descartados com a fila cheia")
+
+	def coletar_recursos():
+		pool = banco.obter_pool().estatisticas()
+		for estado in ("livres", "em_uso"):
+			yield "dyva_db_pool_conexoes", {"estado": estado}, pool[estado]
+		cache = banco.CACHE_SESSOES.estatisticas()
+		yield "dyva_cache_acertos_total", {"cache": "sessoes"}, cache["acertos"]
+		yield "dyva_cache_falhas_total", {"cache": "sessoes"}, cache["falhas"]
+		yield "dyva_cache_itens", {"cache": "sessoes"}, cache["tamanho"]
+		pool_senhas = senhas.estatisticas_pool()
+		if pool_senhas:
+			yield "dyva_senhas_operacoes_total", {"resultado": "concluida"}, pool_senhas["concluidas"]
+			yield "dyva_senhas_operacoes_total", {"resultado": "recusada"}, pool_senhas["recusadas"]
+			yield "dyva_senhas_operacoes_total", {"resultado": "falha"}, pool_senhas["falhas"]
+		yield "dyva_logs_descartados_total", {}, logs.estatisticas()["descartados"]
+
+	metricas_app.adicionar_coletor(coletar_recursos)
+	# Acessível a quem embrulha o app (ex.: assincrono.AppASGI soma os próprios coletores)
+	app.extensions["dyva_metricas"] = metricas_app
+
+	@app.before_request
+	def iniciar_metricas():
+		metricas_app.somar("dyva_http_em_andamento", 1)
+		banco.iniciar_medicao()
+
+	@app.after_request
+	def registrar_metricas(response):
+		# A rota é o molde da URL (/api/produtos/<int:produto_id>), não o caminho
+		rota = request.url_rule.rule if request.url_rule else "desconhecida"
+		metricas_app.somar("dyva_http_requisicoes_total", rota=rota, metodo=request.method, status=response.status_code)
+		metricas_app.observar("dyva_http_latencia_segundos", time.perf_counter() - g.inicio, rota=rota, metodo=request.method)
+		medicao = banco.encerrar_medicao()
+		if medicao is not None:
+			metricas_app.somar("dyva_db_consultas_total", medicao.consultas, rota=rota)
+			metricas_app.somar("dyva_db_segundos_total", medicao.segundos, rota=rota)
+			metricas_app.observar("dyva_db_consultas_por_requisicao", medicao.consultas, rota=rota)
+		return response
+
+	@app.teardown_request
+	def encerrar_metricas(erro=None):
+		metricas_app.somar("dyva_http_em_andamento", -1)
+		banco.encerrar_medicao()
+
+	# ----------------------------
+	# Compressão: gzip nas respostas da API acima de GZIP_MINIMO bytes.
+	# Registrado antes do CORS para rodar depois dele (after_request roda
+	# na ordem inversa) e depois do commit, sem segurar a transação
+	# ----------------------------
+	@app.after_request
+	def comprimir_resposta(response):
+		if (
+			not request.path.startswith("/api")
+			or response.status_code < 200
+			or response.status_code in (204, 304)
+			or response.is_streamed
+			or response.direct_passthrough
+			or "Content-Encoding" in response.headers
+			or not response.mimetype.startswith(TIPOS_COMPRIMIVEIS)
+		):
+			return response
+		response.vary.add("Accept-Encoding")
+		if request.accept_encodings["gzip"] <= 0 or response.content_length is None or response.content_length < GZIP_MINIMO:
+			return response
+		response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_NIVEL))
+		response.headers["Content-Encoding"] = "gzip"
+		# O ETag forte valia para os bytes sem compressão; fraco, continua casando no If-None-Match
+		etag, fraco = response.get_etag()
+		if etag and not fraco:
+			response.set_etag(etag, weak=True)
+		return response
 
 	# ----------------------------
 	# CORS básico para permitir testes via file:// e http://127.0.0.1:5000
@@ -38,7 +258,7 @@ def criar_app() -> Flask:
 				origin = request.headers.get("Origin") or "*"
 				response.headers["Access-Control-Allow-Origin"] = origin
 				# Vary habilita cache correto por origem
-				response.headers["Vary"] = "Origin"
+				response.vary.add("Origin")
 				response.headers["Access-Control-Allow-Credentials"] = "false"
 				response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
 				response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
@@ -46,6 +266,29 @@ def criar_app() -> Flask:
 			pass
 		return response
 
+	# ----------------------------
+	# Unidade de trabalho: uma conexão e uma transação por requisição
+	# ----------------------------
+	@app.before_request
+	def abrir_unidade_de_trabalho():
+		# A conexão só é emprestada do pool no primeiro acesso ao banco
+		banco.iniciar_unidade_de_trabalho()
+
+	@app.after_request
+	def confirmar_unidade_de_trabalho(response):
+		# Respostas de erro (4xx/5xx) desfazem tudo o que a requisição escreveu
+		try:
+			banco.encerrar_unidade_de_trabalho(confirmar=response.status_code < 400)
+		except Exception:
+			log.exception("erro ao confirmar transação")
+			return make_response(jsonify({"erro": "Erro ao salvar dados"}), 500)
+		return response
+
+	@app.teardown_request
+	def descartar_unidade_de_trabalho(erro=None):
+		# Garante rollback e devolução da conexão se a requisição falhou com exceção
+		banco.encerrar_unidade_de_trabalho(confirmar=False)
+
 	# Responde rapidamente às preflights da API
 	@app.route('/api/<path:subpath>', methods=['OPTIONS'])
 	def cors_preflight(subpath):
@@ -68,10 +311,12 @@ def criar_app() -> Flask:
 		if not auth.lower().startswith("bearer "):
 			return None
 		token = auth.split(" ", 1)[1].strip()
-		sessao = banco.obter_sessao_por_token(token)
-		if not sessao:
+		if not token:
 			return None
-		usuario = banco.obter_usuario_por_id(sessao["usuario_id"])
+		# Cache em memória token -> usuário (evita duas consultas por requisição)
+		usuario = banco.obter_usuario_por_token(token)
+		if usuario:
+			logs.definir_usuario(usuario["id"])
 		return usuario
 
 	def requer_auth() -> Optional[Dict[str, Any]]:
@@ -88,19 +333,78 @@ def criar_app() -> Flask:
 			return make_response(resp, 403)
 		return None
 
+	# ----------------------------
+	# ETag / Cache-Control para as leituras da API
+	# ----------------------------
+	def responder_com_etag(chaves, gerar, cache_control: str):
+		"""
+		Responde 304 sem montar o payload se o If-None-Match do cliente bate com
+		as versões atuais (tabela ``versoes``); senão chama ``gerar()`` e envia
+		o corpo com ETag forte.
+		"""
+		versoes = banco.obter_versoes(chaves)
+		base = request.full_path + "|" + "|".join(f"{c}={versoes[c]}" for c in chaves)
+		etag = hashlib.blake2b(base.encode("utf-8"), digest_size=12).hexdigest()
+		if request.if_none_match.contains_weak(etag):
+			resp = make_response("", 304)
+		else:
+			resp = make_response(gerar())
+			if resp.status_code != 200:
+				return resp
+		resp.set_etag(etag)
+		resp.headers["Cache-Control"] = cache_control
+		return resp
+
 	# ----------------------------
 	# Rota raiz: retorna o site HTML
 	# ----------------------------
+	ativos_site = ativos.AtivosSite(os.path.join(os.path.dirname(os.path.abspath(__file__)), "site.html"))
+
+	def resposta_recurso(recurso: ativos.Recurso, cache_control: str) -> Response:
+		"""Versão já comprimida conforme o Accept-Encoding, com ETag (fraco:
+		vale para todas as codificações) e 304 na revalidação."""
+		if request.if_none_match.contains_weak(recurso.etag):
+			resp = make_response("", 304)
+		else:
+			codificacao, corpo = recurso.escolher(request.accept_encodings)
+			resp = make_response(corpo)
+			resp.headers["Content-Type"] = recurso.tipo
+			if codificacao != "identity":
+				resp.headers["Content-Encoding"] = codificacao
+		resp.set_etag(recurso.etag, weak=True)
+		resp.headers["Cache-Control"] = cache_control
+		resp.vary.add("Accept-Encoding")
+		return resp
+
 	@app.get("/")
 	def spa_index():
-		pasta = os.path.dirname(os.path.abspath(__file__))
-		return send_from_directory(pasta, "site.html")
+		ativos_site.atualizar_se_mudou()
+		return resposta_recurso(ativos_site.pagina, ativos.CACHE_CONTROL_PAGINA)
+
+	@app.get("/ativos/<nome>")
+	def arquivo_ativo(nome):
+		recurso = ativos_site.obter(nome)
+		if recurso is None:
+			return make_response(jsonify({"erro": "Arquivo não encontrado"}), 404)
+		return resposta_recurso(recurso, ativos.CACHE_CONTROL_IMUTAVEL)
 
 	# Rota de verificação do servidor
 	@app.get("/api/ping")
 	def ping():
 		return {"ok": True, "quando": datetime.now().isoformat() + "Z"}
 
+	@app.get("/api/metrics")
+	def exportar_metricas():
+		"""Métricas no formato texto do Prometheus."""
+		if METRICAS_TOKEN and not secrets.compare_digest(
+			request.headers.get("Authorization", ""), f"Bearer {METRICAS_TOKEN}"
+		):
+			return make_response(jsonify({"erro": "Não autorizado"}), 401)
+		resp = Response(metricas_app.exportar(), mimetype="text/plain")
+		resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+		resp.headers["Cache-Control"] = "no-store"
+		return resp
+
 	# ----------------------------
 	# Autenticação
 	# ----------------------------
@@ -131,47 +435,58 @@ def criar_app() -> Flask:
 		if banco.obter_usuario_por_email(email):
 			return make_response(jsonify({"erro": "Email já cadastrado"}), 409)
 
-		usuario_id = banco.criar_usuario(nome=nome, email=email, senha_hash=hash_senha(senha), role="user")
-		print(f"✅ NOVO USUÁRIO CRIADO: {nome} ({email}) - ID: {usuario_id}")
+		# O hash leva dezenas de ms no pool; a conexão do banco não fica presa esperando
+		banco.liberar_conexao_ociosa()
+		try:
+			senha_hash = senhas.hash_senha(senha)
+		except senhas.PoolOcupado:
+			return resposta_pool_ocupado()
+		try:
+			usuario_id = banco.criar_usuario(nome=nome, email=email, senha_hash=senha_hash, role="user")
+		except sqlite3.IntegrityError:
+			# Outro cadastro com o mesmo email passou pela checagem durante o hash
+			return make_response(jsonify({"erro": "Email já cadastrado"}), 409)
+		logs.definir_usuario(usuario_id)
+		log.info("novo usuário criado")
 		return {"ok": True, "usuario_id": usuario_id}
 
 	@app.post("/api/login")
 	def login():
 		try:
-			print("🔐 LOGIN: Recebendo requisição...")
 			dados = request.get_json(force=True)
-			print(f"🔐 LOGIN: Dados recebidos: {dados}")
-			
 			if not dados:
-				print("❌ LOGIN: JSON vazio")
+				log.info("login: JSON vazio")
 				return make_response(jsonify({"erro": "JSON inválido"}), 400)
 		except Exception as e:
-			print(f"❌ LOGIN: Erro ao processar JSON: {e}")
+			log.info("login: JSON inválido: %s", e)
 			return make_response(jsonify({"erro": "JSON inválido"}), 400)
 			
 		email = (dados.get("email") or "").strip().lower()
 		senha = (dados.get("senha") or "").strip()
-		
-		print(f"🔐 LOGIN: Email processado: '{email}'")
-		print(f"🔐 LOGIN: Senha recebida: {'*' * len(senha)}")
 
 		usuario = banco.obter_usuario_por_email(email)
 		if not usuario:
-			print(f"❌ LOGIN: Usuário não encontrado: {email}")
+			log.info("login recusado: usuário não encontrado")
 			return make_response(jsonify({"erro": "Credenciais inválidas"}), 401)
-			
-		print(f"🔐 LOGIN: Usuário encontrado: {usuario['nome']}")
+		logs.definir_usuario(usuario["id"])
 		
-		hash_fornecido = hash_senha(senha)
-		if usuario["senha_hash"] != hash_fornecido:
-			print(f"❌ LOGIN: Senha incorreta para {email}")
-			print(f"❌ Hash esperado: {usuario['senha_hash'][:20]}...")
-			print(f"❌ Hash fornecido: {hash_fornecido[:20]}...")
+		banco.liberar_conexao_ociosa()
+		try:
+			confere, hash_novo = senhas.verificar_senha(senha, usuario["senha_hash"])
+		except senhas.PoolOcupado:
+			log.warning("login recusado: pool de senhas ocupado")
+			return resposta_pool_ocupado()
+		if not confere:
+			log.info("login recusado: senha incorreta")
 			return make_response(jsonify({"erro": "Credenciais inválidas"}), 401)
+		if hash_novo:
+			# Hash legado (SHA-256) ou de outro custo: regrava com os parâmetros atuais
+			banco.atualizar_senha_hash(usuario["id"], hash_novo)
+			log.info("hash de senha atualizado")
 
 		token = gerar_token()
 		banco.criar_sessao(token=token, usuario_id=usuario["id"]) 
-		print(f"🔑 LOGIN REALIZADO: {usuario['nome']} ({email}) - Token: {token[:8]}...")
+		log.info("login realizado")
 		return {"ok": True, "token": token, "usuario": {"id": usuario["id"], "nome": usuario["nome"], "email": usuario["email"], "role": usuario["role"]}}
 
 	@app.get("/api/me")
@@ -186,24 +501,83 @@ def criar_app() -> Flask:
 	# ----------------------------
 	@app.get("/api/produtos")
 	def listar_produtos():
-		itens = banco.listar_produtos(ativos=True)
-		return {"itens": itens}
+		"""
+		Vitrine com filtros e paginação no servidor:
+		?categoria=&preco_min=&preco_max=&tamanho=&ordem=(id|recentes|preco|-preco|nome|-nome)
+		&limit=&cursor=&incluir=tamanhos. Sem ?limit a página tem PRODUTOS_POR_PAGINA
+		produtos; o restante vem seguindo o proximo_cursor.
+		"""
+		args = request.args
+		try:
+			limite = max(1, min(int(args.get("limit") or PRODUTOS_POR_PAGINA), PRODUTOS_POR_PAGINA_MAX))
+			preco_min = float(args["preco_min"]) if args.get("preco_min") else None
+			preco_max = float(args["preco_max"]) if args.get("preco_max") else None
+			ordem = args.get("ordem") or "id"
+			if ordem not in banco.ORDENACOES_CATALOGO:
+				raise ValueError(ordem)
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "Parâmetros de consulta inválidos"}), 400)
+
+		incluir_tamanhos = "tamanhos" in args.get("incluir", "").split(",")
+		tamanho = (args.get("tamanho") or "").strip() or None
+
+		def gerar():
+			try:
+				# Produtos montados em JSON pelo SQLite e colados na resposta pelo provedor
+				itens, proximo_cursor = banco.consultar_catalogo_json(
+					categoria=(args.get("categoria") or "").strip() or None,
+					preco_min=preco_min,
+					preco_max=preco_max,
+					tamanho=tamanho,
+					ordem=ordem,
+					limite=limite,
+					cursor=args.get("cursor") or None,
+					incluir_tamanhos=incluir_tamanhos,
+				)
+			except ValueError:
+				return make_response(jsonify({"erro": "Cursor inválido"}), 400)
+			return {"itens": json_rapido.JSONPronto(itens), "proximo_cursor": proximo_cursor}
+
+		# O saldo reservado só pesa com os tamanhos ou com o filtro por tamanho;
+		# sem eles a vitrine não muda a cada carrinho
+		chaves = ["catalogo", "reservas"] if incluir_tamanhos or tamanho else ["catalogo"]
+		return responder_com_etag(chaves, gerar, CACHE_CONTROL_CATALOGO)
+
+	@app.get("/api/produtos/busca")
+	def buscar_produtos():
+		"""Busca textual (FTS5): ?q=texto&limit= — acentos ignorados, prefixo na última palavra."""
+		termo = (request.args.get("q") or "").strip()
+		try:
+			limite = max(1, min(int(request.args.get("limit", BUSCA_LIMITE_PADRAO)), BUSCA_LIMITE_MAX))
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "Parâmetros de consulta inválidos"}), 400)
+		if len(termo) > 100:
+			return make_response(jsonify({"erro": "Busca deve ter no máximo 100 caracteres"}), 400)
+		return responder_com_etag(
+			["catalogo"],
+			lambda: {"itens": banco.buscar_produtos(termo, limite=limite)},
+			CACHE_CONTROL_CATALOGO,
+		)
 
 	@app.get("/api/produtos/<int:produto_id>/tamanhos")
 	def listar_tamanhos(produto_id: int):
-		produto = banco.obter_produto(produto_id)
-		if not produto:
-			return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
-		
-		tamanhos = banco.listar_tamanhos(produto_id)
-		return {"tamanhos": tamanhos}
+		def gerar():
+			produto = banco.obter_produto(produto_id)
+			if not produto:
+				return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
+			return {"tamanhos": banco.listar_tamanhos(produto_id)}
+
+		return responder_com_etag(["catalogo", "reservas"], gerar, CACHE_CONTROL_CATALOGO)
 
 	@app.get("/api/produtos/<int:produto_id>")
 	def obter_produto(produto_id: int):
-		prod = banco.obter_produto(produto_id)
-		if not prod:
-			return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
-		return prod
+		def gerar():
+			prod = banco.obter_produto(produto_id)
+			if not prod:
+				return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
+			return prod
+
+		return responder_com_etag(["catalogo", "reservas"], gerar, CACHE_CONTROL_CATALOGO)
 
 	@app.post("/api/produtos")
 	def criar_produto():
@@ -273,32 +647,158 @@ def criar_app() -> Flask:
 
 		return {"ok": True, "produto_id": pid}
 
+	@app.post("/api/produtos/importar")
+	def importar_produtos():
+		"""
+		Importação em massa (admin): corpo CSV/JSONL cru ou multipart com o campo
+		``arquivo``. Formato por ?formato=csv|jsonl ou pela extensão/Content-Type.
+		O arquivo é lido em streaming e gravado em lotes (upsert por sku).
+		"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+
+		enviado = request.files.get("arquivo")
+		if enviado is not None:
+			fluxo, nome, tipo = enviado.stream, enviado.filename, enviado.content_type
+		else:
+			fluxo, nome, tipo = request.stream, "", request.content_type
+		formato = request.args.get("formato") or importador.detectar_formato(nome, tipo)
+		if formato not in importador.FORMATOS:
+			return make_response(jsonify({"erro": "Informe o formato: csv ou jsonl"}), 400)
+		try:
+			lote = int(request.args.get("lote", importador.TAMANHO_LOTE))
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "Tamanho de lote inválido"}), 400)
+
+		texto = io.TextIOWrapper(fluxo, encoding="utf-8-sig", newline="")
+		try:
+			relatorio = importador.importar(texto, formato, max(1, min(lote, 10000)))
+		except (UnicodeDecodeError, csv.Error) as e:
+			return make_response(jsonify({"erro": f"Arquivo inválido: {e}"}), 400)
+		log.info("importação de produtos", extra={"campos": {
+			"importadas": relatorio["importadas"], "lidas": relatorio["lidas"], "com_erro": relatorio["com_erro"],
+		}})
+		return {"ok": relatorio["com_erro"] == 0, **relatorio}
+
+	# ----------------------------
+	# Imagens dos produtos: armazenamento local por conteúdo (imagens.py)
+	# ----------------------------
+	@app.post("/api/admin/imagens")
+	def enviar_imagem():
+		"""
+		Upload de imagem (admin): multipart com o campo ``arquivo`` ou corpo cru.
+		Com ``produto_id`` (formulário ou query) a imagem do produto passa a ser
+		esta. Arquivos repetidos não são gravados de novo; as variantes ficam
+		prontas em segundo plano (até lá, o original é servido).
+		"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		if not imagens.disponivel():
+			return make_response(jsonify({"erro": "Upload de imagens indisponível (Pillow não instalado)"}), 503)
+
+		enviado = request.files.get("arquivo")
+		dados = (enviado.stream if enviado is not None else request.stream).read(imagens.MAX_BYTES + 1)
+		if not dados:
+			return make_response(jsonify({"erro": "Envie a imagem no campo arquivo"}), 400)
+		produto_id = request.form.get("produto_id") or request.args.get("produto_id")
+		if produto_id is not None:
+			try:
+				produto_id = int(produto_id)
+			except ValueError:
+				return make_response(jsonify({"erro": "produto_id inválido"}), 400)
+		try:
+			hash_imagem, nova = imagens.salvar_original(dados)
+		except imagens.ImagemInvalida as e:
+			return make_response(jsonify({"erro": str(e)}), 400)
+
+		pendente = bool(imagens.variantes_pendentes(hash_imagem))
+		if pendente:
+			imagens.enfileirar(hash_imagem)
+		url = imagens.url_imagem(hash_imagem)
+		if produto_id is not None and not banco.atualizar_produto(produto_id, imagem=url):
+			return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
+		log.info("imagem enviada", extra={"campos": {"hash": hash_imagem, "nova": nova, "produto_id": produto_id}})
+		return make_response(jsonify({
+			"ok": True,
+			"hash": hash_imagem,
+			"nova": nova,
+			"pendente": pendente,
+			"url": url,
+			"variantes": {v: imagens.url_imagem(hash_imagem, v) for v in imagens.VARIANTES},
+		}), 201 if nova else 200)
+
+	@app.get("/imagens/<hash_imagem>/<arquivo>")
+	def servir_imagem(hash_imagem: str, arquivo: str):
+		"""
+		``/imagens/<hash>/<variante>[.jpg|.webp]`` ou ``/original``. Sem extensão,
+		o formato sai do Accept (webp para quem aceita). O conteúdo de uma URL
+		nunca muda, então o cache é imutável; o arquivo vai por send_file
+		(sendfile do servidor WSGI ou X-Sendfile com DYVA_X_SENDFILE=1).
+		"""
+		nao_encontrada = make_response(jsonify({"erro": "Imagem não encontrada"}), 404)
+		if not imagens.hash_valido(hash_imagem):
+			return nao_encontrada
+		variante, _, formato = arquivo.partition(".")
+		if variante == "original":
+			caminho = imagens.caminho_original(hash_imagem)
+			if caminho is None:
+				return nao_encontrada
+			resp = send_file(caminho, mimetype=imagens.TIPOS_ORIGINAL[caminho.rsplit(".", 1)[1]], etag=hash_imagem[:32])
+			resp.headers["Cache-Control"] = ativos.CACHE_CONTROL_IMUTAVEL
+			return resp
+		if variante not in imagens.VARIANTES or (formato and formato not in imagens.FORMATOS_VARIANTE):
+			return nao_encontrada
+
+		negociado = not formato
+		if negociado:
+			# Só o tipo explícito conta: "*/*" também chega de navegadores sem webp
+			aceita_webp = any(tipo == "image/webp" and q > 0 for tipo, q in request.accept_mimetypes)
+			formato = "webp" if aceita_webp else "jpg"
+		caminho = imagens.caminho_variante(hash_imagem, variante, formato)
+		if os.path.exists(caminho):
+			resp = send_file(caminho, mimetype=imagens.FORMATOS_VARIANTE[formato][1],
+			                 etag=f"{hash_imagem[:32]}-{variante}-{formato}")
+			resp.headers["Cache-Control"] = ativos.CACHE_CONTROL_IMUTAVEL
+		else:
+			# Variante ainda não gerada: o original por enquanto, sem cache longo
+			original = imagens.caminho_original(hash_imagem)
+			if original is None:
+				return nao_encontrada
+			imagens.enfileirar(hash_imagem)
+			resp = send_file(original, mimetype=imagens.TIPOS_ORIGINAL[original.rsplit(".", 1)[1]], etag=False)
+			resp.headers["Cache-Control"] = "no-cache"
+		if negociado:
+			resp.vary.add("Accept")
+		return resp
+
 	@app.put("/api/produtos/<int:produto_id>")
 	def atualizar_produto(produto_id: int):
-		print(f"✏️ PRODUTO: Recebendo requisição de atualização...")
-		print(f"✏️ PRODUTO: ID do produto: {produto_id}")
-		
 		usr = requer_auth()
 		if not isinstance(usr, dict):
-			print(f"❌ PRODUTO: Erro de autenticação")
 			return usr
-			
-		print(f"✏️ PRODUTO: Admin autenticado: {usr['nome']} (ID: {usr['id']})")
 		
 		erro = requer_admin(usr)
 		if erro:
-			print(f"❌ PRODUTO: Usuário não é admin")
+			log.warning("atualização de produto negada: usuário não é admin")
 			return erro
 
 		try:
 			dados = request.get_json(force=True)
-			print(f"✏️ PRODUTO: Dados recebidos: {dados}")
 			if not dados:
-				print(f"❌ PRODUTO: JSON inválido ou vazio")
 				return make_response(jsonify({"erro": "JSON inválido"}), 400)
 		except Exception as e:
-			print(f"❌ PRODUTO: Erro ao processar JSON: {e}")
+			log.info("produto: JSON inválido: %s", e)
 			return make_response(jsonify({"erro": "JSON inválido"}), 400)
+		if log.isEnabledFor(logging.DEBUG):
+			log.debug("produto: dados recebidos", extra={"campos": {"produto_id": produto_id, "dados": dados}})
 			
 		nome = dados.get("nome")
 		categoria = dados.get("categoria")
@@ -306,25 +806,22 @@ def criar_app() -> Flask:
 		imagem = dados.get("imagem")
 		ativo = dados.get("ativo")
 		descricao = dados.get("descricao")
-		
-		print(f"✏️ PRODUTO: Atualizando - Nome: '{nome}', Preço: {preco}, Categoria: '{categoria}'")
+
 
 		ok = banco.atualizar_produto(produto_id, nome, categoria, preco, imagem, ativo, descricao)
 		if not ok:
-			print(f"❌ PRODUTO: Produto ID {produto_id} não encontrado no banco")
 			return make_response(jsonify({"erro": "Produto não encontrado"}), 404)
 
 		# Atualiza tamanhos se vierem no payload
 		tamanhos = dados.get("tamanhos")
 		if isinstance(tamanhos, list):
 			try:
-				print(f"✏️ PRODUTO: Atualizando tamanhos: {tamanhos}")
 				banco.salvar_tamanhos(produto_id, tamanhos)
 			except Exception as e:
-				print(f"❌ PRODUTO: Erro ao atualizar tamanhos: {e}")
+				log.info("produto: tamanhos inválidos: %s", e, extra={"campos": {"produto_id": produto_id}})
 				return make_response(jsonify({"erro": "Tamanhos inválidos"}), 400)
 				
-		print(f"✅ PRODUTO ATUALIZADO: ID {produto_id} - {nome} por {usr['nome']}")
+		log.info("produto atualizado", extra={"campos": {"produto_id": produto_id}})
 		return {"ok": True}
 
 	@app.delete("/api/produtos/<int:produto_id>")
@@ -349,32 +846,67 @@ def criar_app() -> Flask:
 		usr = requer_auth()
 		if not isinstance(usr, dict):
 			return usr
-		itens = banco.listar_carrinho(usr["id"])
-		return {"itens": itens}
+		# Nome/preço/imagem vêm do catálogo e o saldo das reservas, então as versões deles também entram no ETag
+		return responder_com_etag(
+			["catalogo", "reservas", f"carrinho:{usr['id']}"],
+			lambda: {"itens": banco.listar_carrinho(usr["id"])},
+			CACHE_CONTROL_PRIVADO,
+		)
+
+	@app.put("/api/carrinho")
+	def carrinho_sincronizar():
+		"""
+		Sincroniza o carrinho numa só requisição e transação:
+		{"itens": [...]} substitui o carrinho inteiro; {"alteracoes": [...]} altera só
+		as linhas informadas. Cada linha: {"produto_id", "tamanho", "quantidade"}, com a
+		quantidade final (0 remove). Responde com o carrinho reconciliado.
+		"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		dados = request.get_json(silent=True)
+		if not isinstance(dados, dict) or ("itens" in dados) == ("alteracoes" in dados):
+			return make_response(jsonify({"erro": "Envie 'itens' (carrinho inteiro) ou 'alteracoes'"}), 400)
+		substituir = "itens" in dados
+		linhas_raw = dados["itens"] if substituir else dados["alteracoes"]
+		if not isinstance(linhas_raw, list):
+			return make_response(jsonify({"erro": "Lista de itens inválida"}), 400)
+		if len(linhas_raw) > CARRINHO_MAX_LINHAS:
+			return make_response(jsonify({"erro": f"Máximo de {CARRINHO_MAX_LINHAS} linhas por sincronização"}), 400)
+		linhas = []
+		try:
+			for linha in linhas_raw:
+				produto_id = int(linha.get("produto_id"))
+				tamanho = str(linha.get("tamanho") or "").strip()
+				quantidade = int(linha.get("quantidade", 1))
+				if not tamanho:
+					return make_response(jsonify({"erro": "Informe o tamanho"}), 400)
+				if quantidade < 0 or quantidade > 99:
+					return make_response(jsonify({"erro": "Quantidade deve estar entre 0 e 99"}), 400)
+				linhas.append({"produto_id": produto_id, "tamanho": tamanho, "quantidade": quantidade})
+		except (ValueError, TypeError, AttributeError):
+			return make_response(jsonify({"erro": "Dados inválidos"}), 400)
+
+		resultado = banco.sincronizar_carrinho(usr["id"], linhas, substituir=substituir)
+		if not resultado["ok"]:
+			return make_response(jsonify(resultado), 400)
+		return resultado
 
 	@app.post("/api/carrinho/adicionar")
 	def carrinho_adicionar():
-		print(f"🛒 CARRINHO: Recebendo requisição...")
 		usr = requer_auth()
 		if not isinstance(usr, dict):
-			print(f"❌ CARRINHO: Erro de autenticação")
 			return usr
-		print(f"🛒 CARRINHO: Usuário autenticado: {usr['nome']} (ID: {usr['id']})")
 		
 		try:
 			dados = request.get_json(force=True)
-			print(f"🛒 CARRINHO: Dados recebidos: {dados}")
-			
 			if not dados:
-				print(f"❌ CARRINHO: JSON inválido ou vazio")
 				return make_response(jsonify({"erro": "JSON inválido"}), 400)
 				
 			produto_id = int(dados.get("produto_id"))
 			tamanho = (dados.get("tamanho") or "").strip()
 			quantidade_raw = dados.get("quantidade", 1)
 			
-			print(f"🛒 CARRINHO: Produto ID: {produto_id}, Tamanho: '{tamanho}', Quantidade: {quantidade_raw}")
-			
 			# Validar quantidade explicitamente
 			try:
 				quantidade = int(quantidade_raw)
@@ -388,16 +920,15 @@ def criar_app() -> Flask:
 		except (ValueError, TypeError, KeyError):
 			return make_response(jsonify({"erro": "Dados inválidos"}), 400)
 		if not tamanho:
-			print(f"❌ CARRINHO: Tamanho não informado")
 			return make_response(jsonify({"erro": "Informe o tamanho"}), 400)
 		
-		print(f"🛒 CARRINHO: Tentando adicionar ao carrinho...")
-		ok = banco.adicionar_ao_carrinho(usr["id"], produto_id, tamanho, quantidade)
-		if not ok:
-			print(f"❌ CARRINHO: Produto {produto_id} não encontrado ou inativo")
-			return make_response(jsonify({"erro": "Produto inválido ou inativo"}), 400)
-		print(f"✅ ITEM ADICIONADO: {usr['nome']} - Produto {produto_id} ({tamanho}) x{quantidade}")
-		return {"ok": True}
+		resultado = banco.adicionar_ao_carrinho(usr["id"], produto_id, tamanho, quantidade)
+		campos = {"produto_id": produto_id, "tamanho": tamanho, "quantidade": quantidade}
+		if not resultado["ok"]:
+			log.info("carrinho: %s", resultado["erro"], extra={"campos": campos})
+			return make_response(jsonify(resultado), 400)
+		log.debug("item adicionado ao carrinho", extra={"campos": campos})
+		return resultado
 
 	@app.post("/api/carrinho/remover")
 	def carrinho_remover():
@@ -432,8 +963,11 @@ def criar_app() -> Flask:
 		usr = requer_auth()
 		if not isinstance(usr, dict):
 			return usr
-		itens = banco.listar_favoritos(usr["id"])
-		return {"itens": itens}
+		return responder_com_etag(
+			["catalogo", f"favoritos:{usr['id']}"],
+			lambda: {"itens": banco.listar_favoritos(usr["id"])},
+			CACHE_CONTROL_PRIVADO,
+		)
 
 	@app.post("/api/favoritos/toggle")
 	def toggle_favorito():
@@ -452,38 +986,192 @@ def criar_app() -> Flask:
 		if marcado is None:
 			return make_response(jsonify({"erro": "Produto inválido"}), 400)
 		acao = "ADICIONADO" if marcado else "REMOVIDO"
-		print(f"❤️ FAVORITO {acao}: {usr['nome']} - Produto {produto_id}")
+		log.debug("favorito %s", acao, extra={"campos": {"produto_id": produto_id}})
 		return {"ok": True, "favoritado": marcado}
 
+	# ----------------------------
+	# Relatórios (admin): respondidos pelas tabelas de resumo de vendas
+	# ----------------------------
+	def ler_periodo():
+		"""Lê ?de=&ate= (AAAA-MM-DD); levanta ValueError se inválido."""
+		de = request.args.get("de")
+		ate = request.args.get("ate")
+		de = datetime.strptime(de, "%Y-%m-%d").strftime("%Y-%m-%d") if de else None
+		ate = datetime.strptime(ate, "%Y-%m-%d").strftime("%Y-%m-%d") if ate else None
+		return de, ate
+
+	@app.get("/api/admin/relatorios")
+	def relatorios_resumo():
+		"""Painel do admin: últimos 30 dias, categorias, tamanhos e top 10."""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		desde = (datetime.utcnow() - timedelta(days=29)).strftime("%Y-%m-%d")
+		return {
+			"diario": banco.relatorio_vendas_diarias(de=desde),
+			"categorias": banco.relatorio_categorias(),
+			"tamanhos": banco.relatorio_tamanhos(),
+			"mais_vendidos": banco.relatorio_mais_vendidos(limite=10),
+		}
+
+	@app.get("/api/admin/relatorios/diario")
+	def relatorio_diario():
+		"""?de=AAAA-MM-DD&ate=AAAA-MM-DD (inclusivos)"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		try:
+			de, ate = ler_periodo()
+		except ValueError:
+			return make_response(jsonify({"erro": "Datas devem estar no formato AAAA-MM-DD"}), 400)
+		return {"dias": banco.relatorio_vendas_diarias(de=de, ate=ate)}
+
+	@app.get("/api/admin/relatorios/mais-vendidos")
+	def relatorio_mais_vendidos():
+		"""?limit=10&por=unidades|receita"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		try:
+			limite = max(1, min(int(request.args.get("limit", 10)), 100))
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "Parâmetros de consulta inválidos"}), 400)
+		por = request.args.get("por", "unidades")
+		if por not in ("unidades", "receita"):
+			return make_response(jsonify({"erro": "Use por=unidades ou por=receita"}), 400)
+		return {"itens": banco.relatorio_mais_vendidos(limite=limite, por=por)}
+
+	@app.get("/api/admin/relatorios/categorias")
+	def relatorio_categorias():
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		return {"categorias": banco.relatorio_categorias()}
+
+	@app.get("/api/admin/relatorios/tamanhos")
+	def relatorio_tamanhos():
+		"""?produto_id= opcional: sem ele, totais da loja por tamanho."""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		try:
+			produto_id = request.args.get("produto_id")
+			produto_id = int(produto_id) if produto_id else None
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "produto_id inválido"}), 400)
+		return {"tamanhos": banco.relatorio_tamanhos(produto_id)}
+
+	@app.get("/api/admin/sql")
+	def estatisticas_sql():
+		"""?limit=&ordem=total_ms|execucoes|max_ms|lentas (rastreio ligado com DYVA_SQL_RASTREIO=1)"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+		rastreador = rastreio_sql.rastreador_ativo()
+		if rastreador is None:
+			return make_response(jsonify({"erro": "Rastreio SQL desligado (DYVA_SQL_RASTREIO=1)"}), 404)
+		ordem = request.args.get("ordem") or "total_ms"
+		if ordem not in ("total_ms", "execucoes", "max_ms", "lentas"):
+			return make_response(jsonify({"erro": "ordem inválida"}), 400)
+		try:
+			limite = max(1, min(int(request.args.get("limit", 20)), 200))
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "limit inválido"}), 400)
+		return {"comandos": rastreador.estatisticas(limite, ordem)}
+
+	# ----------------------------
+	# Exportações (admin): CSV ou NDJSON em streaming
+	# ----------------------------
+	def ler_formato_exportacao():
+		formato = (request.args.get("formato") or "csv").lower()
+		return formato if formato in FORMATOS_EXPORTACAO else None
+
+	@app.get("/api/admin/exportar/pedidos")
+	def exportar_pedidos():
+		"""?formato=csv|ndjson&de=AAAA-MM-DD&ate=AAAA-MM-DD (inclusivo)&status=Pago"""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+
+		formato = ler_formato_exportacao()
+		if not formato:
+			return make_response(jsonify({"erro": "Formato deve ser csv ou ndjson"}), 400)
+		try:
+			de = request.args.get("de")
+			ate = request.args.get("ate")
+			de = datetime.strptime(de, "%Y-%m-%d").strftime("%Y-%m-%d") if de else None
+			# "ate" é inclusivo para quem chama; no banco vira "< dia seguinte"
+			ate = (datetime.strptime(ate, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d") if ate else None
+		except ValueError:
+			return make_response(jsonify({"erro": "Datas devem estar no formato AAAA-MM-DD"}), 400)
+		status = (request.args.get("status") or "").strip() or None
+
+		linhas = banco.exportar_pedidos(de=de, ate=ate, status=status)
+		log.info("exportação de pedidos", extra={"campos": {"formato": formato}})
+		return resposta_exportacao(linhas, banco.COLUNAS_EXPORTACAO_PEDIDOS, formato, "pedidos")
+
+	@app.get("/api/admin/exportar/produtos")
+	def exportar_produtos():
+		"""?formato=csv|ndjson — catálogo completo, uma linha por produto x tamanho."""
+		usr = requer_auth()
+		if not isinstance(usr, dict):
+			return usr
+		erro = requer_admin(usr)
+		if erro:
+			return erro
+
+		formato = ler_formato_exportacao()
+		if not formato:
+			return make_response(jsonify({"erro": "Formato deve ser csv ou ndjson"}), 400)
+		linhas = banco.exportar_produtos()
+		return resposta_exportacao(linhas, banco.COLUNAS_EXPORTACAO_PRODUTOS, formato, "produtos")
+
 	# ----------------------------
 	# Pedidos
 	# ----------------------------
 	@app.post("/api/pedidos/finalizar")
 	def finalizar_pedido():
-		print(f"📦 PEDIDO: Recebendo requisição de finalizar pedido...")
 		usr = requer_auth()
 		if not isinstance(usr, dict):
-			print(f"❌ PEDIDO: Erro de autenticação")
 			return usr
-		print(f"📦 PEDIDO: Usuário autenticado: {usr['nome']} (ID: {usr['id']})")
 		
 		try:
 			dados = request.get_json(force=True)
-			print(f"📦 PEDIDO: Dados recebidos: {dados}")
 			if not dados:
-				print(f"❌ PEDIDO: JSON inválido ou vazio")
 				return make_response(jsonify({"erro": "JSON inválido"}), 400)
 		except Exception as e:
-			print(f"❌ PEDIDO: Erro ao processar JSON: {e}")
+			log.info("pedido: JSON inválido: %s", e)
 			return make_response(jsonify({"erro": "JSON inválido"}), 400)
+		if log.isEnabledFor(logging.DEBUG):
+			log.debug("pedido: dados recebidos", extra={"campos": {"dados": dados}})
 			
 		# Verificar se é pedido do frontend (dados completos) ou API simples
 		if "produtos" in dados and "total" in dados:
-			print(f"📦 PEDIDO: Formato frontend - processando dados completos")
+			formato = "frontend"
 			# Formato do frontend
 			produtos_pedido = dados.get("produtos", [])
 			if not produtos_pedido:
-				print(f"❌ PEDIDO: Lista de produtos vazia")
 				return make_response(jsonify({"erro": "Nenhum produto no pedido"}), 400)
 			
 			metodo = dados.get("pagamento", "Desconhecido")
@@ -494,47 +1182,51 @@ def criar_app() -> Flask:
 			else:
 				total = float(total_raw)
 			
-			print(f"📦 PEDIDO: {len(produtos_pedido)} produtos, Total: R${total}, Método: {metodo}")
+			# Com as chaves estrangeiras ligadas, item de produto inexistente não grava:
+			# recusa antes de criar o pedido (a resposta 400 desfaz a transação)
+			inexistentes = banco.produtos_inexistentes([p.get("id") for p in produtos_pedido])
+			if inexistentes:
+				log.info("pedido recusado: produtos inexistentes", extra={"campos": {"produtos": inexistentes}})
+				return make_response(jsonify({"erro": "Produtos inexistentes no pedido", "produtos": inexistentes}), 400)
 			
 			pedido_id = banco.criar_pedido(usr["id"], total, metodo, status="Pago")
 			
-			# Adicionar itens do pedido
+			# Monta os itens do pedido e grava todos de uma vez
+			itens = []
 			for produto in produtos_pedido:
-				produto_id = produto.get("id")
-				nome = produto.get("nome", "Produto")
 				# Preco pode vir como int, float ou string
 				preco_raw = produto.get("preco", 0)
 				if isinstance(preco_raw, str):
 					preco = float(preco_raw.replace(",", "."))
 				else:
 					preco = float(preco_raw)
-				quantidade = produto.get("qty", 1)
-				tamanho = produto.get("tamanho", "")
-				
-				banco.adicionar_item_pedido(pedido_id, produto_id, nome, preco, quantidade, tamanho)
-				print(f"📦 PEDIDO: Item adicionado - {nome} ({tamanho}) x{quantidade} = R${preco}")
+				itens.append({
+					"produto_id": produto.get("id"),
+					"nome": produto.get("nome", "Produto"),
+					"preco": preco,
+					"quantidade": produto.get("qty", 1),
+					"tamanho": produto.get("tamanho", ""),
+				})
+			try:
+				banco.adicionar_itens_pedido(pedido_id, itens)
+			except sqlite3.IntegrityError:
+				# Produto excluído entre a verificação e o INSERT
+				log.info("pedido recusado: item viola chave estrangeira")
+				return make_response(jsonify({"erro": "Produtos inexistentes no pedido"}), 400)
 		else:
-			print(f"📦 PEDIDO: Formato API - usando carrinho")
-			# Formato original da API
+			formato = "carrinho"
+			# Formato original da API: checkout atômico a partir do carrinho
 			metodo = (dados.get("metodo_pagamento") or "").strip()
-			itens = banco.listar_carrinho(usr["id"])
-			if not itens:
-				print(f"❌ PEDIDO: Carrinho vazio")
-				return make_response(jsonify({"erro": "Carrinho vazio"}), 400)
-			total = sum(i["preco"] * i["quantidade"] for i in itens)
-			pedido_id = banco.criar_pedido(usr["id"], total, metodo or "Desconhecido", status="Pago")
-			
-			for i in itens:
-				# valida e baixa estoque por tamanho
-				if i.get("tamanho"):
-					ok = banco.decrementar_estoque(i["produto_id"], i["tamanho"], i["quantidade"])
-					if not ok:
-						print(f"❌ PEDIDO: Sem estoque - {i['tamanho']}")
-						return make_response(jsonify({"erro": f"Sem estoque do tamanho {i['tamanho']}"}), 400)
-				banco.adicionar_item_pedido(pedido_id, i["produto_id"], i["nome"], i["preco"], i["quantidade"], i.get("tamanho"))
-			banco.limpar_carrinho(usr["id"])  # esvazia após pedido
+			resultado = banco.finalizar_checkout(usr["id"], metodo or "Desconhecido", status="Pago")
+			if not resultado["ok"]:
+				log.info("pedido recusado: %s", resultado["erro"], extra={"campos": {"faltas": len(resultado["faltas"])}})
+				return make_response(jsonify({"erro": resultado["erro"], "faltas": resultado["faltas"]}), 400)
+			pedido_id = resultado["pedido_id"]
+			total = resultado["total"]
 		
-		print(f"✅ PEDIDO FINALIZADO: {usr['nome']} - ID: {pedido_id} - Total: R$ {total:.2f}")
+		log.info("pedido finalizado", extra={"campos": {
+			"pedido_id": pedido_id, "total": round(total, 2), "metodo": metodo, "formato": formato,
+		}})
 		return {"ok": True, "pedido_id": pedido_id, "total": total}
 
 	@app.get("/api/pedidos")
@@ -542,13 +1234,51 @@ def criar_app() -> Flask:
 		usr = requer_auth()
 		if not isinstance(usr, dict):
 			return usr
-		pedidos = banco.listar_pedidos(usr["id"]) 
-		return {"pedidos": pedidos}
+		# Paginação por keyset: ?limit=&before_id= (id do último pedido da página anterior)
+		try:
+			limite = int(request.args.get("limit", PEDIDOS_POR_PAGINA))
+			antes_de = request.args.get("before_id")
+			antes_de = int(antes_de) if antes_de else None
+		except (ValueError, TypeError):
+			return make_response(jsonify({"erro": "Parâmetros de paginação inválidos"}), 400)
+		limite = max(1, min(limite, PEDIDOS_POR_PAGINA_MAX))
+
+		def gerar():
+			pedidos, quantidade, ultimo = banco.listar_pedidos_json(usr["id"], limite=limite, antes_de=antes_de)
+			proximo = ultimo if quantidade == limite else None
+			return {"pedidos": json_rapido.JSONPronto(pedidos), "proximo_before_id": proximo}
+
+		return responder_com_etag([f"pedidos:{usr['id']}"], gerar, CACHE_CONTROL_PRIVADO)
 
 	return app
 
 
+def encerrar_app() -> None:
+	"""Para o coletor e fecha pools e logs do processo (saída de um worker)."""
+	banco.parar_coletor_reservas()
+	imagens.parar_gerador()
+	banco.fechar_pool()
+	senhas.fechar_pool()
+	logs.parar_logs()
+
+
+def rodar_producao() -> None:
+	"""Sobe o perfil de produção (gunicorn.conf.py); volta se o gunicorn não estiver instalado."""
+	try:
+		from gunicorn.app.wsgiapp import run
+	except ImportError:
+		print("⚠️  gunicorn não instalado (pip install -r requirements.txt): usando o servidor de desenvolvimento")
+		return
+	pasta = os.path.dirname(os.path.abspath(__file__))
+	os.chdir(pasta)
+	sys.argv = [sys.argv[0], "-c", os.path.join(pasta, "gunicorn.conf.py"), "wsgi:app"]
+	sys.exit(run())
+
+
 if __name__ == "__main__":
+	# Produção: python app.py (gunicorn com workers). Desenvolvimento: python app.py --dev
+	if "--dev" not in sys.argv[1:]:
+		rodar_producao()
 	app = criar_app()
 	print("\n" + "="*70)
 	print("🚀 SERVIDOR DYVA E-COMMERCE INICIADO COM SUCESSO!")
@@ -565,7 +1295,7 @@ if __name__ == "__main__":
 	print("      POST /api/registro    - Cadastro de novos usuários") 
 	print("      GET  /api/me          - Dados do usuário logado")
 	print("   🛍️  Produtos:")
-	print("      GET  /api/produtos    - Listar todos os produtos")
+	print("      GET  /api/produtos    - Listar produtos (paginado)")
 	print("      GET  /api/produtos/id - Produto específico")
 	print("      GET  /api/produtos/id/tamanhos - Tamanhos do produto")
 	print("      POST /api/produtos    - Criar produto (admin)")
@@ -584,6 +1314,8 @@ if __name__ == "__main__":
 	print("      GET  /api/pedidos          - Histórico de pedidos")
 	print("   🏠 Página:")
 	print("      GET  /                     - Servir site.html")
+	print("      GET  /ativos/<nome>        - CSS/JS do site (hash no nome, cache imutável)")
+	print("      GET  /imagens/<hash>/<var> - Imagens dos produtos (miniatura, card, zoom)")
 	print("="*70)
 	print("✅ Backend Flask com 18 endpoints funcionando!")
 	print("✅ Banco de dados SQLite com 8 tabelas estruturadas!")
@@ -0,0 +1,23 @@
+"""Ponto de entrada ASGI: ``uvicorn asgi:app`` (ou ``python asgi.py``).
+
+Cada requisição é uma corrotina no loop asyncio; os handlers do Flask rodam
+nas threads leitoras ou no escritor único de ``assincrono.ExecutorBanco``.
+Sob o gunicorn (``DYVA_WORKER_CLASS=uvicorn.workers.UvicornWorker``) as
+migrações já rodaram no master; rodando sozinho, o próprio processo as aplica.
+"""
+import os
+
+import assincrono
+from app import criar_app, encerrar_app
+
+app = assincrono.AppASGI(
+    criar_app(inicializar=os.environ.get("DYVA_BANCO_PRONTO") != "1"),
+    ao_encerrar=encerrar_app,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get("DYVA_HOST", "127.0.0.1"), port=int(os.environ.get("PORT", "5000")),
+                lifespan="on", access_log=False)
@@ -0,0 +1,307 @@
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import banco
+
+# Threads leitoras: o pool SQLite menos uma conexão para o escritor e uma para o coletor
+LEITORES = int(os.environ.get("DYVA_ASYNC_LEITORES", str(max(1, banco.POOL_TAMANHO - 2))))
+# Requisições em andamento ou na fila de cada faixa; acima disso, 503 na hora
+FILA_POR_FAIXA = int(os.environ.get("DYVA_ASYNC_FILA", "1000"))
+# Corpo da requisição fica em memória até este tamanho, depois vai para disco
+CORPO_EM_MEMORIA = 1024 * 1024
+
+LEITURA = "leitura"
+ESCRITA = "escrita"
+METODOS_LEITURA = frozenset({"GET", "HEAD", "OPTIONS"})
+# POSTs dominados pelo scrypt (que já roda no pool de senhas): na faixa de
+# escrita, cada hash seguraria todas as outras escritas
+CAMINHOS_LEITURA = frozenset({"/api/login", "/api/registro"})
+
+Escopo = Dict[str, Any]
+Receber = Callable[[], Any]
+Enviar = Callable[[Dict[str, Any]], Any]
+
+
+class FaixaOcupada(RuntimeError):
+    """Fila da faixa cheia (a requisição deve responder 503)."""
+
+
+class _Desconectado(Exception):
+    """O cliente fechou a conexão antes de terminar de enviar o corpo."""
+
+
+def classificar_faixa(metodo: str, caminho: str) -> str:
+    """Faixa da requisição: leituras (e login/registro) nas threads leitoras,
+    o resto no escritor único."""
+    if metodo in METODOS_LEITURA or caminho in CAMINHOS_LEITURA:
+        return LEITURA
+    return ESCRITA
+
+
+class ExecutorBanco:
+    """Threads dedicadas ao banco: várias leitoras e uma única escritora.
+
+    ``await executor.ler(funcao, ...)`` e ``await executor.escrever(funcao, ...)``
+    rodam a função numa thread da faixa e devolvem o resultado ao loop. Com um
+    só escritor, as transações do app não disputam entre si o lock de escrita
+    do SQLite (em WAL as leituras seguem em paralelo) e um checkout lento ocupa
+    apenas a faixa de escrita. Os contadores só são alterados pelo loop.
+    """
+
+    def __init__(self, leitores: int = LEITORES, fila_por_faixa: int = FILA_POR_FAIXA) -> None:
+        self.leitores = max(1, int(leitores))
+        self.limite = max(1, int(fila_por_faixa))
+        self._executores = {
+            LEITURA: ThreadPoolExecutor(self.leitores, thread_name_prefix="dyva-leitor"),
+            ESCRITA: ThreadPoolExecutor(1, thread_name_prefix="dyva-escritor"),
+        }
+        self.pendentes = {LEITURA: 0, ESCRITA: 0}
+        self.concluidas = {LEITURA: 0, ESCRITA: 0}
+        self.recusadas = {LEITURA: 0, ESCRITA: 0}
+
+    def reservar(self, faixa: str) -> None:
+        """Ocupa uma vaga da faixa; levanta ``FaixaOcupada`` se não houver."""
+        if self.pendentes[faixa] >= self.limite:
+            self.recusadas[faixa] += 1
+            raise FaixaOcupada(f"Faixa de {faixa} ocupada")
+        self.pendentes[faixa] += 1
+
+    def liberar(self, faixa: str) -> None:
+        self.pendentes[faixa] -= 1
+        self.concluidas[faixa] += 1
+
+    async def executar(self, faixa: str, funcao: Callable[..., Any], *args: Any,
+                       contexto: Optional[contextvars.Context] = None) -> Any:
+        """Roda ``funcao`` numa thread da faixa, sem reservar vaga.
+
+        ``contexto`` permite que chamadas seguidas da mesma requisição (o
+        handler e depois cada bloco de uma resposta em streaming) vejam a
+        mesma unidade de trabalho e a mesma medição do banco.
+        """
+        contexto = contexto if contexto is not None else contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executores[faixa], contexto.run, funcao, *args)
+
+    async def _reservar_e_executar(self, faixa: str, funcao: Callable[..., Any], *args: Any) -> Any:
+        self.reservar(faixa)
+        try:
+            return await self.executar(faixa, funcao, *args)
+        finally:
+            self.liberar(faixa)
+
+    async def ler(self, funcao: Callable[..., Any], *args: Any) -> Any:
+        return await self._reservar_e_executar(LEITURA, funcao, *args)
+
+    async def escrever(self, funcao: Callable[..., Any], *args: Any) -> Any:
+        return await self._reservar_e_executar(ESCRITA, funcao, *args)
+
+    def fechar(self) -> None:
+        """Espera o que já está nas threads e encerra as duas faixas."""
+        for executor in self._executores.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "leitores": self.leitores,
+            "limite_por_faixa": self.limite,
+            "pendentes": dict(self.pendentes),
+            "concluidas": dict(self.concluidas),
+            "recusadas": dict(self.recusadas),
+        }
+
+
+def montar_ambiente(escopo: Escopo, corpo: Any, tamanho: int) -> Dict[str, Any]:
+    """Ambiente WSGI (PEP 3333) a partir do escopo HTTP do ASGI."""
+    servidor = escopo.get("server") or ("localhost", 80)
+    cliente = escopo.get("client") or ("", 0)
+    ambiente: Dict[str, Any] = {
+        "REQUEST_METHOD": escopo["method"],
+        "SCRIPT_NAME": escopo.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": escopo["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": escopo.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(servidor[0]),
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": f"HTTP/{escopo.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(cliente[0]),
+        "REMOTE_PORT": str(cliente[1]),
+        "CONTENT_LENGTH": str(tamanho),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": escopo.get("scheme", "http"),
+        "wsgi.input": corpo,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for nome, valor in escopo.get("headers", []):
+        chave = nome.decode("latin-1").upper().replace("-", "_")
+        texto = valor.decode("latin-1")
+        if chave == "CONTENT_LENGTH":
+            continue
+        if chave != "CONTENT_TYPE":
+            chave = "HTTP_" + chave
+        ambiente[chave] = f"{ambiente[chave]},{texto}" if chave in ambiente else texto
+    return ambiente
+
+
+def _chamar_wsgi(app_wsgi: Callable[..., Iterable[bytes]], ambiente: Dict[str, Any]
+                 ) -> Tuple[int, List[Tuple[bytes, bytes]], Iterable[bytes], List[bytes]]:
+    # Roda na thread da faixa: o handler inteiro, inclusive before/after_request
+    inicio: Dict[str, Any] = {}
+    escritos: List[bytes] = []
+
+    def start_response(status: str, cabecalhos: List[Tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:
+        if exc_info and inicio:
+            raise exc_info[1].with_traceback(exc_info[2])
+        inicio["status"] = int(status.split(" ", 1)[0])
+        inicio["cabecalhos"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in cabecalhos]
+        return escritos.append
+
+    resposta = app_wsgi(ambiente, start_response)
+    if any(nome == b"content-length" for nome, _ in inicio.get("cabecalhos", ())):
+        # Corpo com tamanho conhecido (tudo que não é stream: JSON, arquivos):
+        # lido e fechado aqui mesmo, sem um salto de thread por bloco
+        try:
+            corpo = b"".join(resposta)
+        finally:
+            fechar = getattr(resposta, "close", None)
+            if fechar is not None:
+                fechar()
+        resposta = [corpo]
+    return inicio["status"], inicio["cabecalhos"], resposta, escritos
+
+
+class AppASGI:
+    """Adaptador ASGI 3 do app Flask com as rotas atrás do ``ExecutorBanco``.
+
+    O loop asyncio guarda as conexões (keep-alive e clientes lentos não ocupam
+    thread) e cada requisição é uma corrotina: lê o corpo, aguarda o handler
+    WSGI na faixa dela e envia a resposta. Respostas com Content-Length já
+    voltam lidas da faixa; só as em streaming (exportações) são lidas bloco a
+    bloco na mesma faixa, no mesmo contexto da requisição.
+    """
+
+    def __init__(self, app_wsgi: Any, executor: Optional[ExecutorBanco] = None,
+                 classificar: Callable[[str, str], str] = classificar_faixa,
+                 ao_encerrar: Optional[Callable[[], None]] = None) -> None:
+        self.app_wsgi = app_wsgi
+        self.executor = executor or ExecutorBanco()
+        self.classificar = classificar
+        self.ao_encerrar = ao_encerrar
+        registro = getattr(app_wsgi, "extensions", {}).get("dyva_metricas")
+        if registro is not None:
+            registro.declarar("dyva_async_pendentes", "gauge", "Requisições em andamento ou na fila, por faixa")
+            registro.declarar("dyva_async_recusadas_total", "counter", "Requisições recusadas com a faixa cheia")
+            registro.adicionar_coletor(self._coletar)
+
+    def _coletar(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for faixa, pendentes in self.executor.pendentes.items():
+            yield "dyva_async_pendentes", {"faixa": faixa}, pendentes
+            yield "dyva_async_recusadas_total", {"faixa": faixa}, self.executor.recusadas[faixa]
+
+    async def __call__(self, escopo: Escopo, receber: Receber, enviar: Enviar) -> None:
+        tipo = escopo["type"]
+        if tipo == "http":
+            await self._http(escopo, receber, enviar)
+        elif tipo == "lifespan":
+            await self._ciclo_de_vida(receber, enviar)
+        elif tipo == "websocket":
+            await receber()
+            await enviar({"type": "websocket.close", "code": 1003})
+
+    async def _ciclo_de_vida(self, receber: Receber, enviar: Enviar) -> None:
+        while True:
+            mensagem = await receber()
+            if mensagem["type"] == "lifespan.startup":
+                await enviar({"type": "lifespan.startup.complete"})
+            elif mensagem["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.encerrar)
+                await enviar({"type": "lifespan.shutdown.complete"})
+                return
+
+    def encerrar(self) -> None:
+        self.executor.fechar()
+        if self.ao_encerrar is not None:
+            self.ao_encerrar()
+
+    @staticmethod
+    async def _ler_corpo(receber: Receber) -> Tuple[Any, int]:
+        corpo = tempfile.SpooledTemporaryFile(max_size=CORPO_EM_MEMORIA)
+        tamanho = 0
+        while True:
+            mensagem = await receber()
+            if mensagem["type"] == "http.disconnect":
+                corpo.close()
+                raise _Desconectado()
+            pedaco = mensagem.get("body", b"")
+            corpo.write(pedaco)
+            tamanho += len(pedaco)
+            if not mensagem.get("more_body", False):
+                break
+        corpo.seek(0)
+        return corpo, tamanho
+
+    @staticmethod
+    async def _responder_ocupado(enviar: Enviar) -> None:
+        # Mesmo corpo do 503 do pool de senhas (app.resposta_pool_ocupado)
+        corpo = json.dumps({"erro": "Servidor ocupado, tente novamente em instantes"}, ensure_ascii=False).encode("utf-8")
+        await enviar({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode("ascii")),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await enviar({"type": "http.response.body", "body": corpo})
+
+    async def _http(self, escopo: Escopo, receber: Receber, enviar: Enviar) -> None:
+        faixa = self.classificar(escopo["method"], escopo["path"])
+        try:
+            self.executor.reservar(faixa)
+        except FaixaOcupada:
+            await self._responder_ocupado(enviar)
+            return
+        try:
+            try:
+                corpo, tamanho = await self._ler_corpo(receber)
+            except _Desconectado:
+                return
+            contexto = contextvars.copy_context()
+            try:
+                status, cabecalhos, resposta, escritos = await self.executor.executar(
+                    faixa, _chamar_wsgi, self.app_wsgi, montar_ambiente(escopo, corpo, tamanho), contexto=contexto
+                )
+            finally:
+                corpo.close()
+            await enviar({"type": "http.response.start", "status": status, "headers": cabecalhos})
+            try:
+                for pedaco in escritos:
+                    await enviar({"type": "http.response.body", "body": pedaco, "more_body": True})
+                if isinstance(resposta, list):
+                    # Resposta já lida em _chamar_wsgi (o caso comum): nenhum salto extra de thread
+                    for pedaco in resposta:
+                        await enviar({"type": "http.response.body", "body": pedaco, "more_body": True})
+                else:
+                    iterador = iter(resposta)
+                    while True:
+                        pedaco = await self.executor.executar(faixa, next, iterador, None, contexto=contexto)
+                        if pedaco is None:
+                            break
+                        if pedaco:
+                            await enviar({"type": "http.response.body", "body": pedaco, "more_body": True})
+                await enviar({"type": "http.response.body", "body": b""})
+            finally:
+                fechar = getattr(resposta, "close", None)
+                if fechar is not None:
+                    # Fecha o gerador na faixa: libera cursor e conexão do banco
+                    await self.executor.executar(faixa, fechar, contexto=contexto)
+        finally:
+            self.executor.liberar(faixa)
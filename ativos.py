@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # opcional: sem o módulo, só gzip
+    brotli = None
+
+# Arquivos com hash no nome nunca mudam: cache de um ano sem revalidar.
+# A página sempre revalida (ETag -> 304) para apontar para os hashes novos
+CACHE_CONTROL_IMUTAVEL = "public, max-age=31536000, immutable"
+CACHE_CONTROL_PAGINA = "no-cache"
+PREFIXO_URL = "/ativos/"
+
+TIPOS = {
+    "html": "text/html; charset=utf-8",
+    "css": "text/css; charset=utf-8",
+    "js": "text/javascript; charset=utf-8",
+}
+
+# Só blocos inline sem atributos: <script src=...> e <style media=...> ficam na página
+_RE_STYLE = re.compile(r"<style>(.*?)</style>", re.S | re.I)
+_RE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S | re.I)
+
+
+def _hash(dados: bytes) -> str:
+    return hashlib.blake2b(dados, digest_size=8).hexdigest()
+
+
+class Recurso:
+    """Um arquivo servido da memória, já comprimido em cada codificação.
+
+    A compressão roda uma vez, na construção, no nível máximo; versões que
+    não ficam menores que o original são descartadas.
+    """
+
+    __slots__ = ("tipo", "etag", "versoes")
+
+    def __init__(self, conteudo: bytes, tipo: str) -> None:
+        self.tipo = TIPOS[tipo]
+        self.etag = _hash(conteudo)
+        self.versoes: Dict[str, bytes] = {"identity": conteudo}
+        # mtime=0: mesma entrada, mesmos bytes (workers diferentes servem o mesmo arquivo)
+        comprimido = gzip.compress(conteudo, compresslevel=9, mtime=0)
+        if len(comprimido) < len(conteudo):
+            self.versoes["gzip"] = comprimido
+        if brotli is not None:
+            comprimido = brotli.compress(conteudo, quality=11)
+            if len(comprimido) < len(conteudo):
+                self.versoes["br"] = comprimido
+
+    def escolher(self, aceitas) -> Tuple[str, bytes]:
+        """``(codificacao, corpo)`` para o ``Accept-Encoding`` do cliente
+        (``request.accept_encodings`` do Werkzeug): br, depois gzip, senão o original."""
+        melhor = aceitas.best_match([c for c in ("br", "gzip") if c in self.versoes])
+        if melhor is None:
+            return "identity", self.versoes["identity"]
+        return melhor, self.versoes[melhor]
+
+
+class AtivosSite:
+    """Pipeline do site.html, sem etapa de build: roda na inicialização.
+
+    Cada ``<style>`` e ``<script>`` inline vira um arquivo ``site.<hash>.css``
+    ou ``site.<hash>.js`` servido em ``/ativos/`` com cache imutável, e a
+    página fica só com o esqueleto HTML apontando para eles. Mudar o JS não
+    invalida o CSS (e vice-versa) no cache do navegador. Se o site.html mudar
+    no disco, a próxima visita reconstrói tudo.
+    """
+
+    def __init__(self, caminho_html: str) -> None:
+        self.caminho_html = caminho_html
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self.pagina: Optional[Recurso] = None
+        self.arquivos: Dict[str, Recurso] = {}
+        self.atualizar_se_mudou()
+
+    def construir(self, html: str) -> None:
+        arquivos: Dict[str, Recurso] = {}
+
+        def extrair(conteudo: str, extensao: str) -> str:
+            dados = conteudo.encode("utf-8")
+            nome = f"site.{_hash(dados)}.{extensao}"
+            if nome not in arquivos:
+                arquivos[nome] = Recurso(dados, extensao)
+            return PREFIXO_URL + nome
+
+        html = _RE_STYLE.sub(lambda m: f'<link rel="stylesheet" href="{extrair(m.group(1), "css")}">', html)
+        # Sem defer: o script externo roda no mesmo ponto da página que o inline rodava
+        html = _RE_SCRIPT.sub(lambda m: f'<script src="{extrair(m.group(1), "js")}"></script>', html)
+        pagina = Recurso(html.encode("utf-8"), "html")
+        # Os arquivos novos entram antes da página que aponta para eles; os
+        # antigos continuam servidos para quem ainda está com a página anterior
+        self.arquivos = {**self.arquivos, **arquivos}
+        self.pagina = pagina
+
+    def atualizar_se_mudou(self) -> None:
+        """Reconstrói se o site.html mudou (um ``stat`` por visita à página)."""
+        mtime = os.stat(self.caminho_html).st_mtime
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.caminho_html, encoding="utf-8") as f:
+                self.construir(f.read())
+            self._mtime = mtime
+
+    def obter(self, nome: str) -> Optional[Recurso]:
+        return self.arquivos.get(nome)
+
+    def estatisticas(self) -> Dict[str, Dict[str, int]]:
+        """Bytes de cada arquivo por codificação (página incluída)."""
+        recursos = dict(self.arquivos)
+        if self.pagina is not None:
+            recursos["site.html"] = self.pagina
+        return {nome: {cod: len(corpo) for cod, corpo in r.versoes.items()} for nome, r in recursos.items()}
@@ -1,157 +1,906 @@
+import base64
+import json
+import logging
 import os
+import re
 import sqlite3
-from typing import Optional, List, Dict, Any, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from datetime import datetime
 
+from cache import CacheLRU
+import rastreio_sql
+from senhas import calcular_hash
+
+log = logging.getLogger("dyva.banco")
+
 ARQUIVO_DB = os.path.join(os.path.dirname(__file__), "dyva.db")
 
+# Configuração do pool de conexões (pode ser ajustada por variáveis de ambiente)
+POOL_TAMANHO = int(os.environ.get("DYVA_DB_POOL_TAMANHO", "8"))
+POOL_ESPERA = float(os.environ.get("DYVA_DB_POOL_ESPERA", "10"))
+POOL_VERIFICAR_APOS = float(os.environ.get("DYVA_DB_POOL_VERIFICAR_APOS", "30"))
+
+# PRAGMAs aplicados uma única vez, quando cada conexão é criada
+PRAGMAS_CONEXAO = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", int(os.environ.get("DYVA_DB_CACHE_KB", "16384")) * -1),
+    ("mmap_size", int(os.environ.get("DYVA_DB_MMAP_BYTES", str(256 * 1024 * 1024)))),
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "ON"),
+)
+
+# Reservas de estoque feitas pelo carrinho: prazo (s), intervalo do coletor (s)
+# e quantas reservas vencidas são liberadas por transação
+RESERVA_TTL = float(os.environ.get("DYVA_RESERVA_TTL", "900"))
+RESERVA_INTERVALO_COLETOR = float(os.environ.get("DYVA_RESERVA_INTERVALO_COLETOR", "30"))
+RESERVA_LOTE_EXPIRACAO = int(os.environ.get("DYVA_RESERVA_LOTE_EXPIRACAO", "500"))
+
+
+class MedicaoBanco:
+    """Consultas e tempo de banco acumulados num contexto (ex.: uma requisição)."""
+
+    __slots__ = ("consultas", "segundos")
+
+    def __init__(self) -> None:
+        self.consultas = 0
+        self.segundos = 0.0
+
+
+_medicao_atual: ContextVar[Optional[MedicaoBanco]] = ContextVar("dyva_medicao_banco", default=None)
+
+
+def iniciar_medicao() -> MedicaoBanco:
+    medicao = MedicaoBanco()
+    _medicao_atual.set(medicao)
+    return medicao
+
+
+def encerrar_medicao() -> Optional[MedicaoBanco]:
+    medicao = _medicao_atual.get()
+    _medicao_atual.set(None)
+    return medicao
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que soma na medição ativa o tempo de cada execute/executemany
+    e, com o rastreio ligado (``rastreio_sql``), entrega o comando ao rastreador.
+
+    Para SELECTs o tempo inclui a busca da primeira linha; o restante do
+    fetch fica de fora. Sem medição nem rastreio o custo é um ``ContextVar.get``
+    e a leitura de um global.
+    """
+
+    def execute(self, sql: str, parametros: Any = ()) -> "CursorMedido":
+        medicao = _medicao_atual.get()
+        rastreador = rastreio_sql.rastreador_ativo()
+        if medicao is None and rastreador is None:
+            return super().execute(sql, parametros)
+        return self._medir(super().execute, sql, parametros, medicao, rastreador, False)
+
+    def executemany(self, sql: str, sequencia: Any) -> "CursorMedido":
+        medicao = _medicao_atual.get()
+        rastreador = rastreio_sql.rastreador_ativo()
+        if medicao is None and rastreador is None:
+            return super().executemany(sql, sequencia)
+        if rastreador is not None and not isinstance(sequencia, (list, tuple)):
+            sequencia = list(sequencia)  # o rastreador olha a forma do primeiro item
+        return self._medir(super().executemany, sql, sequencia, medicao, rastreador, True)
+
+    def _medir(self, executar: Any, sql: str, parametros: Any, medicao: Optional["MedicaoBanco"],
+               rastreador: Optional["rastreio_sql.RastreadorSQL"], varios: bool) -> "CursorMedido":
+        if rastreador is not None:
+            rastreador.antes(self.connection, sql, parametros, varios)
+        inicio = time.perf_counter()
+        try:
+            return executar(sql, parametros)
+        finally:
+            segundos = time.perf_counter() - inicio
+            if medicao is not None:
+                medicao.consultas += 1
+                medicao.segundos += segundos
+            if rastreador is not None:
+                rastreador.depois(sql, parametros, segundos, varios)
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os atalhos execute/executemany) são medidos."""
 
-def conectar() -> sqlite3.Connection:
+    def cursor(self, factory: Any = CursorMedido) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parametros: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql: str, sequencia: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, sequencia)
+
+
+def conectar(caminho: Optional[str] = None) -> sqlite3.Connection:
+    """Abre uma nova conexão já configurada (row_factory + PRAGMAs)."""
     try:
-        conn = sqlite3.connect(ARQUIVO_DB, timeout=10.0)
+        # isolation_level IMMEDIATE: o BEGIN implícito antes da primeira escrita já
+        # reserva o lock de escrita, evitando SQLITE_BUSY ao "promover" a transação
+        conn = sqlite3.connect(caminho or ARQUIVO_DB, timeout=10.0, check_same_thread=False,
+                               isolation_level="IMMEDIATE", factory=ConexaoMedida)
         conn.row_factory = sqlite3.Row
+        for nome, valor in PRAGMAS_CONEXAO:
+            conn.execute(f"PRAGMA {nome} = {valor}")
         return conn
     except Exception as e:
         print(f"Erro ao conectar banco: {e}")
         raise
 
 
-def inicializar_banco() -> None:
-    """Cria tabelas caso não existam."""
+class PoolEsgotado(sqlite3.OperationalError):
+    """Nenhuma conexão ficou livre dentro do tempo de espera do pool."""
+
+
+class PoolConexoes:
+    """Pool thread-safe de conexões SQLite reutilizáveis.
+
+    As conexões são criadas sob demanda até ``tamanho`` e devolvidas em ordem
+    LIFO, para que as mais "quentes" (cache de páginas já populado) sejam
+    reaproveitadas primeiro. Conexões paradas há mais de ``verificar_apos``
+    segundos passam por um health check (``SELECT 1``) antes de serem entregues.
+    """
+
+    def __init__(self, caminho: str, tamanho: int = POOL_TAMANHO, espera: float = POOL_ESPERA,
+                 verificar_apos: float = POOL_VERIFICAR_APOS) -> None:
+        self.caminho = caminho
+        self.tamanho = max(1, int(tamanho))
+        self.espera = espera
+        self.verificar_apos = verificar_apos
+        self._livres: List[Tuple[sqlite3.Connection, float]] = []
+        self._criadas = 0
+        self._fechado = False
+        self._cond = threading.Condition()
+
+    def emprestar(self) -> sqlite3.Connection:
+        limite = time.monotonic() + self.espera
+        with self._cond:
+            while True:
+                if self._fechado:
+                    raise sqlite3.ProgrammingError("Pool de conexões fechado")
+                if self._livres:
+                    conn, desde = self._livres.pop()
+                    break
+                if self._criadas < self.tamanho:
+                    self._criadas += 1
+                    conn, desde = None, 0.0
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise PoolEsgotado(f"Nenhuma conexão livre em {self.espera:.1f}s (tamanho={self.tamanho})")
+                self._cond.wait(restante)
+
+        if conn is not None and time.monotonic() - desde > self.verificar_apos and not self._saudavel(conn):
+            self._fechar(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = conectar(self.caminho)
+            except Exception:
+                with self._cond:
+                    self._criadas -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def devolver(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.descartar(conn)
+            return
+        with self._cond:
+            if self._fechado:
+                self._criadas -= 1
+                self._fechar(conn)
+            else:
+                self._livres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def descartar(self, conn: sqlite3.Connection) -> None:
+        """Fecha uma conexão emprestada que não deve voltar para o pool."""
+        self._fechar(conn)
+        with self._cond:
+            self._criadas -= 1
+            self._cond.notify()
+
+    def fechar(self) -> None:
+        with self._cond:
+            self._fechado = True
+            livres, self._livres = self._livres, []
+            self._criadas -= len(livres)
+            self._cond.notify_all()
+        for conn, _ in livres:
+            self._fechar(conn)
+
+    def estatisticas(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "tamanho": self.tamanho,
+                "criadas": self._criadas,
+                "livres": len(self._livres),
+                "em_uso": self._criadas - len(self._livres),
+            }
+
+    @staticmethod
+    def _saudavel(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _fechar(conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+_pool: Optional[PoolConexoes] = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool() -> PoolConexoes:
+    """Retorna o pool do processo, criando-o na primeira chamada."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.caminho != ARQUIVO_DB:
+        with _pool_lock:
+            if _pool is None or _pool.caminho != ARQUIVO_DB:
+                if _pool is not None:
+                    _pool.fechar()
+                _pool = PoolConexoes(ARQUIVO_DB)
+            pool = _pool
+    return pool
+
+
+def fechar_pool() -> None:
+    """Fecha todas as conexões ociosas do pool (ex.: antes de apagar o arquivo do banco)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.fechar()
+            _pool = None
+
+
+# ---------------------------
+# Unidade de trabalho
+# ---------------------------
+
+class UnidadeDeTrabalho:
+    """Uma conexão e uma transação compartilhadas por todas as funções do banco.
+
+    A conexão só é emprestada do pool no primeiro acesso ao banco; ``concluir``
+    faz commit (ou rollback) uma única vez e devolve a conexão.
+    """
+
+    def __init__(self) -> None:
+        self._pool: Optional[PoolConexoes] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def ativa(self) -> bool:
+        return self._conn is not None
+
+    def conexao(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._pool = obter_pool()
+            self._conn = self._pool.emprestar()
+        return self._conn
+
+    def liberar_se_ociosa(self) -> bool:
+        """Devolve a conexão ao pool se não houver transação aberta.
+
+        Útil antes de uma espera longa sem banco (ex.: hash de senha); o
+        próximo acesso empresta outra conexão normalmente.
+        """
+        conn, pool = self._conn, self._pool
+        if conn is None or pool is None or conn.in_transaction:
+            return False
+        self._conn = self._pool = None
+        pool.devolver(conn)
+        return True
+
+    def concluir(self, confirmar: bool = True) -> None:
+        conn, pool = self._conn, self._pool
+        if conn is None or pool is None:
+            return
+        self._conn = self._pool = None
+        try:
+            if conn.in_transaction:
+                if confirmar:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        finally:
+            pool.devolver(conn)
+
+
+_unidade_atual: ContextVar[Optional[UnidadeDeTrabalho]] = ContextVar("dyva_unidade_de_trabalho", default=None)
+
+
+def iniciar_unidade_de_trabalho() -> UnidadeDeTrabalho:
+    """Associa uma nova unidade de trabalho ao contexto atual (ex.: requisição HTTP)."""
+    unidade = UnidadeDeTrabalho()
+    _unidade_atual.set(unidade)
+    return unidade
+
+
+def unidade_de_trabalho_atual() -> Optional[UnidadeDeTrabalho]:
+    return _unidade_atual.get()
+
+
+def liberar_conexao_ociosa() -> bool:
+    """Atalho para ``liberar_se_ociosa`` da unidade de trabalho atual, se houver."""
+    unidade = _unidade_atual.get()
+    return unidade.liberar_se_ociosa() if unidade is not None else False
+
+
+def encerrar_unidade_de_trabalho(confirmar: bool = True) -> None:
+    """Conclui a unidade de trabalho do contexto atual (commit ou rollback)."""
+    unidade = _unidade_atual.get()
+    if unidade is None:
+        return
+    _unidade_atual.set(None)
+    unidade.concluir(confirmar)
+
+
+@contextmanager
+def unidade_de_trabalho() -> Iterator[UnidadeDeTrabalho]:
+    """Versão em bloco ``with`` para scripts: commit no fim, rollback se houver exceção."""
+    unidade = iniciar_unidade_de_trabalho()
     try:
-        with conectar() as conn:
-            cur = conn.cursor()
-        # Usuários e sessões
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                email TEXT NOT NULL UNIQUE,
-                senha_hash TEXT NOT NULL,
-                role TEXT NOT NULL DEFAULT 'user'
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sessoes (
-                token TEXT PRIMARY KEY,
-                usuario_id INTEGER NOT NULL,
-                criado_em TEXT NOT NULL,
-                FOREIGN KEY(usuario_id) REFERENCES usuarios(id)
-            )
-            """
-        )
+        yield unidade
+    except BaseException:
+        encerrar_unidade_de_trabalho(confirmar=False)
+        raise
+    encerrar_unidade_de_trabalho(confirmar=True)
+
+
+@contextmanager
+def conexao() -> Iterator[sqlite3.Connection]:
+    """Conexão para uma função do banco.
+
+    Dentro de uma unidade de trabalho, reutiliza a conexão (e a transação) dela;
+    commit/rollback ficam a cargo de quem abriu a unidade. Fora dela, empresta
+    uma conexão do pool e faz commit ao sair ou rollback em caso de erro.
+    """
+    unidade = _unidade_atual.get()
+    if unidade is not None:
+        yield unidade.conexao()
+        return
+    with conexao_isolada() as conn:
+        yield conn
+
+
+@contextmanager
+def conexao_isolada() -> Iterator[sqlite3.Connection]:
+    """Conexão do pool que ignora a unidade de trabalho (commit próprio ao sair).
+
+    Para trabalhos longos dentro de uma requisição que não devem segurar a
+    transação dela, como importações em lotes.
+    """
+    pool = obter_pool()
+    conn = pool.emprestar()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        raise
+    finally:
+        pool.devolver(conn)
+
+
+@contextmanager
+def transacao() -> Iterator[sqlite3.Connection]:
+    """Bloco atômico (tudo ou nada), inclusive dentro de uma unidade de trabalho.
+
+    Abre ``BEGIN IMMEDIATE`` se ainda não houver transação e usa um SAVEPOINT,
+    de modo que uma exceção desfaz apenas o que foi feito dentro do bloco.
+    """
+    with conexao() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("SAVEPOINT dyva_transacao")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO dyva_transacao")
+            conn.execute("RELEASE dyva_transacao")
+            raise
+        conn.execute("RELEASE dyva_transacao")
 
-        # Produtos (adiciona coluna descricao se não existir)
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS produtos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                categoria TEXT,
-                preco REAL NOT NULL,
-                imagem TEXT,
-                ativo INTEGER NOT NULL DEFAULT 1
-            )
-            """
-        )
 
-        # Adiciona coluna descricao se não existir
-        cur.execute("PRAGMA table_info(produtos)")
-        colunas = [r[1] for r in cur.fetchall()]
-        if "descricao" not in colunas:
-            cur.execute("ALTER TABLE produtos ADD COLUMN descricao TEXT")
+# ---------------------------
+# Migrações de esquema (PRAGMA user_version)
+# ---------------------------
 
-        # Tamanhos por produto
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS produtos_tamanhos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                produto_id INTEGER NOT NULL,
-                tamanho TEXT NOT NULL,
-                estoque INTEGER NOT NULL DEFAULT 0,
-                UNIQUE(produto_id, tamanho),
-                FOREIGN KEY(produto_id) REFERENCES produtos(id)
-            )
-            """
+def _migracao_001_esquema_inicial(cur: sqlite3.Cursor) -> None:
+    """Tabelas originais; idempotente para bancos criados antes das migrações."""
+    # Usuários e sessões
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            senha_hash TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'user'
         )
-
-        # Carrinho e favoritos
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS carrinhos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                produto_id INTEGER NOT NULL,
-                tamanho TEXT,
-                quantidade INTEGER NOT NULL,
-                UNIQUE(usuario_id, produto_id, tamanho),
-                FOREIGN KEY(usuario_id) REFERENCES usuarios(id),
-                FOREIGN KEY(produto_id) REFERENCES produtos(id)
-            )
-            """
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessoes (
+            token TEXT PRIMARY KEY,
+            usuario_id INTEGER NOT NULL,
+            criado_em TEXT NOT NULL,
+            FOREIGN KEY(usuario_id) REFERENCES usuarios(id)
         )
-        # Adiciona coluna tamanho em carrinhos se não existir
-        cur.execute("PRAGMA table_info(carrinhos)")
-        cols_car = [r[1] for r in cur.fetchall()]
-        if "tamanho" not in cols_car:
-            try:
-                cur.execute("ALTER TABLE carrinhos ADD COLUMN tamanho TEXT")
-            except Exception:
-                pass
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS favoritos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                produto_id INTEGER NOT NULL,
-                UNIQUE(usuario_id, produto_id),
-                FOREIGN KEY(usuario_id) REFERENCES usuarios(id),
-                FOREIGN KEY(produto_id) REFERENCES produtos(id)
-            )
-            """
+        """
+    )
+
+    # Produtos (adiciona coluna descricao se não existir)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS produtos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            categoria TEXT,
+            preco REAL NOT NULL,
+            imagem TEXT,
+            ativo INTEGER NOT NULL DEFAULT 1
         )
-
-        # Pedidos
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS pedidos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                total REAL NOT NULL,
-                metodo_pagamento TEXT NOT NULL,
-                status TEXT NOT NULL,
-                criado_em TEXT NOT NULL,
-                FOREIGN KEY(usuario_id) REFERENCES usuarios(id)
-            )
-            """
+        """
+    )
+
+    # Adiciona coluna descricao se não existir
+    cur.execute("PRAGMA table_info(produtos)")
+    colunas = [r[1] for r in cur.fetchall()]
+    if "descricao" not in colunas:
+        cur.execute("ALTER TABLE produtos ADD COLUMN descricao TEXT")
+
+    # Tamanhos por produto
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS produtos_tamanhos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            produto_id INTEGER NOT NULL,
+            tamanho TEXT NOT NULL,
+            estoque INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(produto_id, tamanho),
+            FOREIGN KEY(produto_id) REFERENCES produtos(id)
         )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS pedido_itens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pedido_id INTEGER NOT NULL,
-                produto_id INTEGER NOT NULL,
-                nome TEXT NOT NULL,
-                preco REAL NOT NULL,
-                tamanho TEXT,
-                quantidade INTEGER NOT NULL,
-                FOREIGN KEY(pedido_id) REFERENCES pedidos(id),
-                FOREIGN KEY(produto_id) REFERENCES produtos(id)
+        """
+    )
+
+    # Carrinho e favoritos
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS carrinhos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            tamanho TEXT,
+            quantidade INTEGER NOT NULL,
+            UNIQUE(usuario_id, produto_id, tamanho),
+            FOREIGN KEY(usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY(produto_id) REFERENCES produtos(id)
+        )
+        """
+    )
+    # Adiciona coluna tamanho em carrinhos se não existir
+    cur.execute("PRAGMA table_info(carrinhos)")
+    cols_car = [r[1] for r in cur.fetchall()]
+    if "tamanho" not in cols_car:
+        cur.execute("ALTER TABLE carrinhos ADD COLUMN tamanho TEXT")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS favoritos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            UNIQUE(usuario_id, produto_id),
+            FOREIGN KEY(usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY(produto_id) REFERENCES produtos(id)
+        )
+        """
+    )
+
+    # Pedidos
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            total REAL NOT NULL,
+            metodo_pagamento TEXT NOT NULL,
+            status TEXT NOT NULL,
+            criado_em TEXT NOT NULL,
+            FOREIGN KEY(usuario_id) REFERENCES usuarios(id)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedido_itens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pedido_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            nome TEXT NOT NULL,
+            preco REAL NOT NULL,
+            tamanho TEXT,
+            quantidade INTEGER NOT NULL,
+            FOREIGN KEY(pedido_id) REFERENCES pedidos(id),
+            FOREIGN KEY(produto_id) REFERENCES produtos(id)
+        )
+        """
+    )
+    # Adiciona coluna tamanho em pedido_itens se não existir
+    cur.execute("PRAGMA table_info(pedido_itens)")
+    cols_pi = [r[1] for r in cur.fetchall()]
+    if "tamanho" not in cols_pi:
+        cur.execute("ALTER TABLE pedido_itens ADD COLUMN tamanho TEXT")
+
+
+def _migracao_002_indices(cur: sqlite3.Cursor) -> None:
+    """Índices secundários das consultas por usuário e da vitrine."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_usuario ON pedidos(usuario_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedido_itens_pedido ON pedido_itens(pedido_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_usuario ON sessoes(usuario_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carrinhos_usuario ON carrinhos(usuario_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_categoria ON produtos(ativo, categoria)")
+
+
+def _migracao_003_versoes(cur: sqlite3.Cursor) -> None:
+    """Contadores de versão (ETag) mantidos por triggers nas tabelas de origem.
+
+    Chaves: ``catalogo`` (produtos e tamanhos), ``carrinho:<usuario_id>``,
+    ``favoritos:<usuario_id>`` e ``pedidos:<usuario_id>``. Por estarem no banco,
+    os contadores valem para todos os processos e voltam atrás em um rollback.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS versoes (
+            chave TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    gatilhos = [
+        ("produtos", "'catalogo'", "'catalogo'"),
+        ("produtos_tamanhos", "'catalogo'", "'catalogo'"),
+        ("carrinhos", "'carrinho:' || NEW.usuario_id", "'carrinho:' || OLD.usuario_id"),
+        ("favoritos", "'favoritos:' || NEW.usuario_id", "'favoritos:' || OLD.usuario_id"),
+        ("pedidos", "'pedidos:' || NEW.usuario_id", "'pedidos:' || OLD.usuario_id"),
+        (
+            "pedido_itens",
+            "'pedidos:' || (SELECT usuario_id FROM pedidos WHERE id = NEW.pedido_id)",
+            "'pedidos:' || (SELECT usuario_id FROM pedidos WHERE id = OLD.pedido_id)",
+        ),
+    ]
+    for tabela, chave_nova, chave_antiga in gatilhos:
+        for evento, chave in (("INSERT", chave_nova), ("UPDATE", chave_nova), ("DELETE", chave_antiga)):
+            cur.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    INSERT INTO versoes (chave, versao) VALUES ({chave}, 1)
+                    ON CONFLICT(chave) DO UPDATE SET versao = versao + 1;
+                END
+                """
             )
-            """
+
+
+def _migracao_004_indices_vitrine(cur: sqlite3.Cursor) -> None:
+    """Índices que atendem filtro + ordenação da vitrine paginada (ver consultar_catalogo)."""
+    # (ativo) carrega o rowid: atende ORDER BY id / recentes sem ordenação temporária
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo ON produtos(ativo)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_preco ON produtos(ativo, preco)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_nome ON produtos(ativo, nome)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_categoria_preco ON produtos(ativo, categoria, preco)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_categoria_nome ON produtos(ativo, categoria, nome)")
+    # (ativo, categoria) virou prefixo dos índices acima
+    cur.execute("DROP INDEX IF EXISTS idx_produtos_ativo_categoria")
+
+
+def _fts5_disponivel(cur: sqlite3.Cursor) -> bool:
+    cur.execute("PRAGMA compile_options")
+    return any(r[0] == "ENABLE_FTS5" for r in cur.fetchall())
+
+
+def _migracao_005_busca_textual(cur: sqlite3.Cursor) -> None:
+    """Índice FTS5 (external content) sobre nome, descrição e categoria.
+
+    ``remove_diacritics 2`` faz "basica" encontrar "básica"; ``prefix`` acelera
+    a busca por prefixo do type-ahead. Triggers mantêm o índice em sincronia com
+    criar_produto/atualizar_produto/excluir_produto.
+    """
+    if not _fts5_disponivel(cur):
+        print("⚠️ SQLite sem FTS5: busca textual usará LIKE")
+        return
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5(
+            nome, descricao, categoria,
+            content='produtos', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
         )
-        # Adiciona coluna tamanho em pedido_itens se não existir
-        cur.execute("PRAGMA table_info(pedido_itens)")
-        cols_pi = [r[1] for r in cur.fetchall()]
-        if "tamanho" not in cols_pi:
-            try:
-                cur.execute("ALTER TABLE pedido_itens ADD COLUMN tamanho TEXT")
-            except Exception:
-                pass
-        conn.commit()
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_insert AFTER INSERT ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (rowid, nome, descricao, categoria)
+            VALUES (NEW.id, NEW.nome, NEW.descricao, NEW.categoria);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_delete AFTER DELETE ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (produtos_busca, rowid, nome, descricao, categoria)
+            VALUES ('delete', OLD.id, OLD.nome, OLD.descricao, OLD.categoria);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_update AFTER UPDATE OF nome, descricao, categoria ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (produtos_busca, rowid, nome, descricao, categoria)
+            VALUES ('delete', OLD.id, OLD.nome, OLD.descricao, OLD.categoria);
+            INSERT INTO produtos_busca (rowid, nome, descricao, categoria)
+            VALUES (NEW.id, NEW.nome, NEW.descricao, NEW.categoria);
+        END
+        """
+    )
+    cur.execute("INSERT INTO produtos_busca (produtos_busca) VALUES ('rebuild')")
+
+
+def _migracao_006_sku(cur: sqlite3.Cursor) -> None:
+    """Código SKU: chave natural dos produtos para importação com upsert."""
+    cur.execute("PRAGMA table_info(produtos)")
+    if "sku" not in [r[1] for r in cur.fetchall()]:
+        cur.execute("ALTER TABLE produtos ADD COLUMN sku TEXT")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_sku ON produtos(sku) WHERE sku IS NOT NULL")
+
+
+def _migracao_007_indice_pedidos_data(cur: sqlite3.Cursor) -> None:
+    """Índice por data dos pedidos, usado pelas exportações por período."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_criado_em ON pedidos(criado_em)")
+
+
+def _recalcular_relatorios(cur: sqlite3.Cursor) -> None:
+    """Recalcula do zero as tabelas de resumo de vendas a partir dos pedidos."""
+    for tabela in ("vendas_diarias", "vendas_produto", "vendas_produto_tamanho", "vendas_tamanho", "vendas_categoria"):
+        cur.execute(f"DELETE FROM {tabela}")
+    cur.execute(
+        """
+        INSERT INTO vendas_diarias (dia, pedidos, itens, receita)
+        SELECT substr(p.criado_em, 1, 10), COUNT(*), COALESCE(SUM(i.unidades), 0), SUM(p.total)
+        FROM pedidos p
+        LEFT JOIN (SELECT pedido_id, SUM(quantidade) AS unidades FROM pedido_itens GROUP BY pedido_id) i
+               ON i.pedido_id = p.id
+        GROUP BY substr(p.criado_em, 1, 10)
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO vendas_produto (produto_id, nome, unidades, receita)
+        SELECT produto_id, MAX(nome), SUM(quantidade), SUM(preco * quantidade)
+        FROM pedido_itens GROUP BY produto_id
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO vendas_produto_tamanho (produto_id, tamanho, unidades, receita)
+        SELECT produto_id, COALESCE(tamanho, ''), SUM(quantidade), SUM(preco * quantidade)
+        FROM pedido_itens GROUP BY produto_id, COALESCE(tamanho, '')
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO vendas_tamanho (tamanho, unidades, receita)
+        SELECT COALESCE(tamanho, ''), SUM(quantidade), SUM(preco * quantidade)
+        FROM pedido_itens GROUP BY COALESCE(tamanho, '')
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO vendas_categoria (categoria, unidades, receita)
+        SELECT COALESCE(pr.categoria, ''), SUM(i.quantidade), SUM(i.preco * i.quantidade)
+        FROM pedido_itens i LEFT JOIN produtos pr ON pr.id = i.produto_id
+        GROUP BY COALESCE(pr.categoria, '')
+        """
+    )
+
+
+def _migracao_008_resumos_vendas(cur: sqlite3.Cursor) -> None:
+    """Tabelas de resumo de vendas mantidas por triggers a cada pedido/item gravado.
+
+    Os triggers rodam na mesma transação do pedido: o resumo só muda quando o
+    pedido é confirmado. Para corrigir divergências (ex.: pedidos apagados à
+    mão) use ``reconstruir_relatorios()``.
+    """
+    cur.execute("CREATE TABLE IF NOT EXISTS vendas_diarias (dia TEXT PRIMARY KEY, pedidos INTEGER NOT NULL, itens INTEGER NOT NULL, receita REAL NOT NULL) WITHOUT ROWID")
+    cur.execute("CREATE TABLE IF NOT EXISTS vendas_produto (produto_id INTEGER PRIMARY KEY, nome TEXT, unidades INTEGER NOT NULL, receita REAL NOT NULL)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_produto_unidades ON vendas_produto(unidades)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_produto_receita ON vendas_produto(receita)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS vendas_produto_tamanho (
+            produto_id INTEGER NOT NULL, tamanho TEXT NOT NULL,
+            unidades INTEGER NOT NULL, receita REAL NOT NULL,
+            PRIMARY KEY (produto_id, tamanho)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE TABLE IF NOT EXISTS vendas_tamanho (tamanho TEXT PRIMARY KEY, unidades INTEGER NOT NULL, receita REAL NOT NULL) WITHOUT ROWID")
+    cur.execute("CREATE TABLE IF NOT EXISTS vendas_categoria (categoria TEXT PRIMARY KEY, unidades INTEGER NOT NULL, receita REAL NOT NULL) WITHOUT ROWID")
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_vendas_pedido_insert AFTER INSERT ON pedidos
+        BEGIN
+            INSERT INTO vendas_diarias (dia, pedidos, itens, receita)
+            VALUES (substr(NEW.criado_em, 1, 10), 1, 0, NEW.total)
+            ON CONFLICT(dia) DO UPDATE SET pedidos = pedidos + 1, receita = receita + excluded.receita;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_vendas_item_insert AFTER INSERT ON pedido_itens
+        BEGIN
+            INSERT INTO vendas_diarias (dia, pedidos, itens, receita)
+            VALUES ((SELECT substr(criado_em, 1, 10) FROM pedidos WHERE id = NEW.pedido_id), 0, NEW.quantidade, 0)
+            ON CONFLICT(dia) DO UPDATE SET itens = itens + excluded.itens;
+            INSERT INTO vendas_produto (produto_id, nome, unidades, receita)
+            VALUES (NEW.produto_id, NEW.nome, NEW.quantidade, NEW.preco * NEW.quantidade)
+            ON CONFLICT(produto_id) DO UPDATE SET
+                nome = excluded.nome, unidades = unidades + excluded.unidades, receita = receita + excluded.receita;
+            INSERT INTO vendas_produto_tamanho (produto_id, tamanho, unidades, receita)
+            VALUES (NEW.produto_id, COALESCE(NEW.tamanho, ''), NEW.quantidade, NEW.preco * NEW.quantidade)
+            ON CONFLICT(produto_id, tamanho) DO UPDATE SET
+                unidades = unidades + excluded.unidades, receita = receita + excluded.receita;
+            INSERT INTO vendas_tamanho (tamanho, unidades, receita)
+            VALUES (COALESCE(NEW.tamanho, ''), NEW.quantidade, NEW.preco * NEW.quantidade)
+            ON CONFLICT(tamanho) DO UPDATE SET
+                unidades = unidades + excluded.unidades, receita = receita + excluded.receita;
+            INSERT INTO vendas_categoria (categoria, unidades, receita)
+            VALUES (COALESCE((SELECT categoria FROM produtos WHERE id = NEW.produto_id), ''),
+                    NEW.quantidade, NEW.preco * NEW.quantidade)
+            ON CONFLICT(categoria) DO UPDATE SET
+                unidades = unidades + excluded.unidades, receita = receita + excluded.receita;
+        END
+        """
+    )
+    _recalcular_relatorios(cur)
+
+
+
+def _migracao_009_reservas(cur: sqlite3.Cursor) -> None:
+    """Reservas de estoque com prazo, feitas ao adicionar ao carrinho.
+
+    ``produtos_tamanhos.reservado`` é a soma das reservas ainda não liberadas,
+    mantida junto com cada reserva: o saldo vendável é ``estoque - reservado``
+    e a checagem no carrinho é um único UPDATE condicional. As reservas
+    vencidas são liberadas em lotes por ``expirar_reservas``. Mudanças em
+    ``reservado`` versionam a chave ``reservas`` em vez de ``catalogo``, para
+    que a vitrine continue cacheável durante um lançamento.
+    """
+    colunas = {r[1] for r in cur.execute("PRAGMA table_info(produtos_tamanhos)").fetchall()}
+    if "reservado" not in colunas:
+        cur.execute("ALTER TABLE produtos_tamanhos ADD COLUMN reservado INTEGER NOT NULL DEFAULT 0")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reservas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            tamanho TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            expira_em REAL NOT NULL,
+            UNIQUE(usuario_id, produto_id, tamanho),
+            FOREIGN KEY(usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY(produto_id) REFERENCES produtos(id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_expira_em ON reservas(expira_em)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_produto_tamanho ON reservas(produto_id, tamanho, expira_em)")
+    cur.execute("DROP TRIGGER IF EXISTS trg_versao_produtos_tamanhos_update")
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_versao_produtos_tamanhos_update
+        AFTER UPDATE OF produto_id, tamanho, estoque ON produtos_tamanhos
+        BEGIN
+            INSERT INTO versoes (chave, versao) VALUES ('catalogo', 1)
+            ON CONFLICT(chave) DO UPDATE SET versao = versao + 1;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_versao_produtos_tamanhos_reservado
+        AFTER UPDATE OF reservado ON produtos_tamanhos
+        BEGIN
+            INSERT INTO versoes (chave, versao) VALUES ('reservas', 1)
+            ON CONFLICT(chave) DO UPDATE SET versao = versao + 1;
+        END
+        """
+    )
+
+
+def _migracao_010_indice_ativo_categoria(cur: sqlite3.Cursor) -> None:
+    """Recria (ativo, categoria), removido pela migração 004.
+
+    É o único índice que entrega uma categoria já na ordem do rowid: sem ele a
+    vitrine por id/recentes filtrada por categoria percorre todos os ativos.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ativo_categoria ON produtos(ativo, categoria)")
+
+
+# Lista ordenada de migrações: (versão, descrição, função). Nunca altere uma
+# migração já publicada; acrescente uma nova com o próximo número.
+MIGRACOES: List[Tuple[int, str, Any]] = [
+    (1, "esquema inicial", _migracao_001_esquema_inicial),
+    (2, "índices secundários", _migracao_002_indices),
+    (3, "contadores de versão para ETag", _migracao_003_versoes),
+    (4, "índices da vitrine paginada", _migracao_004_indices_vitrine),
+    (5, "busca textual FTS5", _migracao_005_busca_textual),
+    (6, "sku dos produtos", _migracao_006_sku),
+    (7, "índice de pedidos por data", _migracao_007_indice_pedidos_data),
+    (8, "resumos de vendas", _migracao_008_resumos_vendas),
+    (9, "reservas de estoque", _migracao_009_reservas),
+    (10, "índice da vitrine por categoria", _migracao_010_indice_ativo_categoria),
+]
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+
+def versao_banco(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def inicializar_banco() -> None:
+    """Aplica as migrações pendentes; em partidas "quentes" é só uma leitura de PRAGMA."""
+    try:
+        with conexao() as conn:
+            if versao_banco(conn) >= VERSAO_ESQUEMA:
+                return
+            for versao, descricao, migrar in MIGRACOES:
+                # Cada migração roda na sua própria transação; a versão é relida
+                # com o lock de escrita para não reaplicar o que outro processo já fez
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if versao_banco(conn) < versao:
+                        migrar(conn.cursor())
+                        conn.execute(f"PRAGMA user_version = {int(versao)}")
+                        print(f"🔧 Migração {versao:03d} aplicada: {descricao}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
     except Exception as e:
         print(f"Erro ao inicializar banco: {e}")
         raise
@@ -159,11 +908,9 @@ def inicializar_banco() -> None:
 
 def criar_admin_e_produtos() -> None:
     """Cria usuário admin padrão e produtos iniciais se o banco estiver vazio."""
-    from hashlib import sha256
     admin_email = "admin@dyva.com"
-    admin_senha_hash = sha256("123456".encode("utf-8")).hexdigest()
 
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         # Admin
         cur.execute("SELECT id FROM usuarios WHERE email = ?", (admin_email,))
@@ -171,18 +918,17 @@ def criar_admin_e_produtos() -> None:
         if not row:
             cur.execute(
                 "INSERT INTO usuarios (nome, email, senha_hash, role) VALUES (?, ?, ?, 'admin')",
-                ("Admin", admin_email, admin_senha_hash),
+                ("Admin", admin_email, calcular_hash("123456")),
             )
             
         # Usuário comum padrão
         user_email = "usuario@teste.com"
-        user_senha_hash = sha256("senha123".encode("utf-8")).hexdigest()
         cur.execute("SELECT id FROM usuarios WHERE email = ?", (user_email,))
         row = cur.fetchone()
         if not row:
             cur.execute(
                 "INSERT INTO usuarios (nome, email, senha_hash, role) VALUES (?, ?, ?, 'user')",
-                ("Usuário Teste", user_email, user_senha_hash),
+                ("Usuário Teste", user_email, calcular_hash("senha123")),
             )
 
         # Produtos (só se não houver nenhum)
@@ -210,7 +956,24 @@ def criar_admin_e_produtos() -> None:
                 "INSERT OR IGNORE INTO produtos_tamanhos (produto_id, tamanho, estoque) VALUES (?, ?, ?)",
                 tamanhos_padrao,
             )
-        conn.commit()
+
+
+# ---------------------------
+# Versões (ETag)
+# ---------------------------
+
+def obter_versoes(chaves: List[str]) -> Dict[str, int]:
+    """Versão atual de cada chave (0 se o recurso nunca foi alterado)."""
+    versoes = {c: 0 for c in chaves}
+    if not chaves:
+        return versoes
+    with conexao() as conn:
+        cur = conn.cursor()
+        marcadores = ", ".join("?" for _ in chaves)
+        cur.execute(f"SELECT chave, versao FROM versoes WHERE chave IN ({marcadores})", list(chaves))
+        for r in cur.fetchall():
+            versoes[r[0]] = int(r[1])
+    return versoes
 
 
 # ---------------------------
@@ -219,66 +982,102 @@ def criar_admin_e_produtos() -> None:
 
 def criar_usuario(nome: str, email: str, senha_hash: str, role: str = "user") -> int:
     try:
-        with conectar() as conn:
+        with conexao() as conn:
             cur = conn.cursor()
             cur.execute(
                 "INSERT INTO usuarios (nome, email, senha_hash, role) VALUES (?, ?, ?, ?)",
                 (nome, email, senha_hash, role),
             )
-            conn.commit()
             return cur.lastrowid
     except sqlite3.IntegrityError:
-        print(f"Email já existe: {email}")
+        log.info("email já cadastrado")
         raise
-    except Exception as e:
-        print(f"Erro ao criar usuário: {e}")
+    except Exception:
+        log.exception("erro ao criar usuário")
         raise
 
 
 def obter_usuario_por_email(email: str) -> Optional[Dict[str, Any]]:
     try:
-        with conectar() as conn:
+        with conexao() as conn:
             cur = conn.cursor()
             cur.execute("SELECT * FROM usuarios WHERE email = ?", (email,))
             row = cur.fetchone()
             return dict(row) if row else None
-    except Exception as e:
-        print(f"Erro ao buscar usuário: {e}")
+    except Exception:
+        log.exception("erro ao buscar usuário")
         return None
 
 
 def obter_usuario_por_id(usuario_id: int) -> Optional[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM usuarios WHERE id = ?", (usuario_id,))
         row = cur.fetchone()
         return dict(row) if row else None
 
 
+def atualizar_senha_hash(usuario_id: int, senha_hash: str) -> bool:
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE usuarios SET senha_hash = ? WHERE id = ?", (senha_hash, usuario_id))
+        return cur.rowcount > 0
+
+
+# Cache token -> usuário usado pela autenticação de cada requisição. É por
+# processo: invalidar() só limpa o worker que atendeu a requisição, e nos
+# demais uma sessão removida ou um papel alterado valem até a entrada expirar.
+# Por isso o TTL é a garantia de consistência (gunicorn.conf.py o reduz para
+# 5 s quando há mais de um worker)
+CACHE_SESSOES = CacheLRU(
+    capacidade=int(os.environ.get("DYVA_CACHE_SESSOES_TAMANHO", "10000")),
+    ttl=float(os.environ.get("DYVA_CACHE_SESSOES_TTL", "60")),
+    ttl_negativo=float(os.environ.get("DYVA_CACHE_SESSOES_TTL_NEGATIVO", "5")),
+)
+
+
 def criar_sessao(token: str, usuario_id: int) -> None:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             "INSERT OR REPLACE INTO sessoes (token, usuario_id, criado_em) VALUES (?, ?, ?)",
             (token, usuario_id, datetime.utcnow().isoformat() + "Z"),
         )
-        conn.commit()
+    # O token pode ter sido substituído (ou estar no cache negativo)
+    CACHE_SESSOES.invalidar(token)
 
 
 def obter_sessao_por_token(token: str) -> Optional[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM sessoes WHERE token = ?", (token,))
         row = cur.fetchone()
         return dict(row) if row else None
 
 
+def obter_usuario_por_token(token: str) -> Optional[Dict[str, Any]]:
+    """Usuário dono da sessão, com cache LRU/TTL (inclusive para tokens inválidos)."""
+    encontrado, usuario = CACHE_SESSOES.obter(token)
+    if not encontrado:
+        with conexao() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT u.* FROM sessoes s JOIN usuarios u ON u.id = s.usuario_id WHERE s.token = ?",
+                (token,),
+            )
+            row = cur.fetchone()
+        usuario = dict(row) if row else None
+        CACHE_SESSOES.guardar(token, usuario)
+    # Cópia: quem chama pode alterar o dict sem contaminar o cache
+    return dict(usuario) if usuario else None
+
+
 # ---------------------------
 # Produtos
 # ---------------------------
 
 def listar_produtos(ativos: bool = True) -> List[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         if ativos:
             cur.execute("SELECT * FROM produtos WHERE ativo = 1 ORDER BY id ASC")
@@ -287,18 +1086,289 @@ def listar_produtos(ativos: bool = True) -> List[Dict[str, Any]]:
         return [dict(r) for r in cur.fetchall()]
 
 
+# Colunas devolvidas pela vitrine (evita SELECT *)
+COLUNAS_PRODUTO = "p.id, p.sku, p.nome, p.categoria, p.preco, p.imagem, p.ativo, p.descricao"
+
+# Ordem de exibição dos tamanhos (PP, P, M, G, GG; demais no fim)
+ORDEM_TAMANHOS = {"PP": 1, "P": 2, "M": 3, "G": 4, "GG": 5}
+
+# ordem -> (coluna de ordenação ou None para só o id, direção)
+ORDENACOES_CATALOGO = {
+    "id": (None, "ASC"),
+    "recentes": (None, "DESC"),
+    "preco": ("p.preco", "ASC"),
+    "-preco": ("p.preco", "DESC"),
+    "nome": ("p.nome", "ASC"),
+    "-nome": ("p.nome", "DESC"),
+}
+
+
+def _codificar_cursor(valores: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(valores, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor: str, quantidade: int) -> List[Any]:
+    """Valores do cursor, que vão direto para os parâmetros do SQL: exatamente
+    ``quantidade`` escalares (número ou texto), senão ``ValueError``."""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(bruto)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise ValueError("Cursor inválido")
+    for valor in valores:
+        if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+            raise ValueError("Cursor inválido")
+    return valores
+
+
+def _consulta_catalogo(
+    colunas: str,
+    categoria: Optional[str],
+    preco_min: Optional[float],
+    preco_max: Optional[float],
+    tamanho: Optional[str],
+    ordem: str,
+    limite: Optional[int],
+    cursor: Optional[str],
+    ativos: bool,
+) -> Tuple[str, List[Any], Optional[str]]:
+    """SQL e parâmetros da vitrine (filtros, ordem e keyset) com as ``colunas``
+    informadas; devolve também a coluna de ordenação (``None`` = só o id)."""
+    if ordem not in ORDENACOES_CATALOGO:
+        raise ValueError(f"Ordenação inválida: {ordem}")
+    coluna, direcao = ORDENACOES_CATALOGO[ordem]
+
+    filtros: List[str] = []
+    params: List[Any] = []
+    if ativos:
+        filtros.append("p.ativo = 1")
+    if categoria:
+        filtros.append("p.categoria = ?")
+        params.append(categoria)
+    if preco_min is not None:
+        filtros.append("p.preco >= ?")
+        params.append(float(preco_min))
+    if preco_max is not None:
+        filtros.append("p.preco <= ?")
+        params.append(float(preco_max))
+    if tamanho:
+        filtros.append(
+            "EXISTS (SELECT 1 FROM produtos_tamanhos t WHERE t.produto_id = p.id AND t.tamanho = ? AND t.estoque - t.reservado > 0)"
+        )
+        params.append(tamanho)
+    if cursor:
+        # Cursor da ordem com coluna: [valor, id]; da ordem só por id: [id]
+        valores = _decodificar_cursor(cursor, 2 if coluna else 1)
+        operador = ">" if direcao == "ASC" else "<"
+        if coluna:
+            filtros.append(f"({coluna}, p.id) {operador} (?, ?)")
+            params.extend(valores)
+        else:
+            filtros.append(f"p.id {operador} ?")
+            params.append(valores[0])
+
+    sql = f"SELECT {colunas} FROM produtos p"
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    sql += f" ORDER BY {coluna} {direcao}, p.id {direcao}" if coluna else f" ORDER BY p.id {direcao}"
+    if limite is not None:
+        # Uma linha a mais só para saber se existe próxima página
+        sql += " LIMIT ?"
+        params.append(int(limite) + 1)
+    return sql, params, coluna
+
+
+def _cortar_pagina(linhas: List[sqlite3.Row], limite: Optional[int], coluna: Optional[str]) -> Tuple[List[sqlite3.Row], Optional[str]]:
+    """Tira a linha extra da página e calcula o ``proximo_cursor``."""
+    if limite is None or len(linhas) <= int(limite):
+        return linhas, None
+    linhas = linhas[: int(limite)]
+    ultima = linhas[-1]
+    chave = [ultima[coluna.split(".")[1]], ultima["id"]] if coluna else [ultima["id"]]
+    return linhas, _codificar_cursor(chave)
+
+
+def consultar_catalogo(
+    categoria: Optional[str] = None,
+    preco_min: Optional[float] = None,
+    preco_max: Optional[float] = None,
+    tamanho: Optional[str] = None,
+    ordem: str = "id",
+    limite: Optional[int] = None,
+    cursor: Optional[str] = None,
+    incluir_tamanhos: bool = False,
+    ativos: bool = True,
+) -> Dict[str, Any]:
+    """Vitrine filtrada, ordenada e paginada por keyset.
+
+    ``tamanho`` mantém só produtos com saldo disponível (estoque - reservado)
+    naquele tamanho. ``cursor`` é o ``proximo_cursor`` da página anterior
+    (codifica o último valor de ordenação e o id). Com ``incluir_tamanhos`` cada produto traz ``tamanhos`` agregados
+    na mesma consulta. Cada página é atendida pelos índices (ativo, [categoria])
+    ou (ativo, [categoria,] preco|nome) e termina após ``limite`` linhas. Sem
+    ``limite`` devolve tudo.
+    Retorna ``{"itens": [...], "proximo_cursor": str | None}``.
+    """
+    colunas = COLUNAS_PRODUTO
+    if incluir_tamanhos:
+        colunas += """,
+            (SELECT json_group_array(json_object(
+                'tamanho', t.tamanho, 'estoque', t.estoque, 'reservado', t.reservado,
+                'disponivel', MAX(0, t.estoque - t.reservado)))
+             FROM produtos_tamanhos t WHERE t.produto_id = p.id) AS tamanhos_json"""
+    sql, params, coluna = _consulta_catalogo(
+        colunas, categoria, preco_min, preco_max, tamanho, ordem, limite, cursor, ativos
+    )
+
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        linhas = cur.fetchall()
+
+    linhas, proximo_cursor = _cortar_pagina(linhas, limite, coluna)
+    itens = []
+    for r in linhas:
+        prod = dict(r)
+        if incluir_tamanhos:
+            tamanhos = json.loads(prod.pop("tamanhos_json"))
+            tamanhos.sort(key=lambda t: ORDEM_TAMANHOS.get(t["tamanho"], 6))
+            prod["tamanhos"] = tamanhos
+        itens.append(prod)
+    return {"itens": itens, "proximo_cursor": proximo_cursor}
+
+
+def _objeto_json(colunas: str) -> str:
+    """``json_object('id', p.id, ...)`` com as colunas de uma lista ``p.id, p.nome, ...``."""
+    pares = []
+    for coluna in colunas.split(","):
+        coluna = coluna.strip()
+        pares.append(f"'{coluna.split('.')[-1]}', {coluna}")
+    return f"json_object({', '.join(pares)})"
+
+
+# Tamanhos agregados já na ordem PP..GG (a ordem da subconsulta é a do json_group_array)
+_TAMANHOS_JSON = """json((
+    SELECT json_group_array(json(o.j)) FROM (
+        SELECT json_object('tamanho', t.tamanho, 'estoque', t.estoque, 'reservado', t.reservado,
+                           'disponivel', MAX(0, t.estoque - t.reservado)) AS j
+        FROM produtos_tamanhos t WHERE t.produto_id = p.id
+        ORDER BY CASE t.tamanho %s ELSE 6 END
+    ) o
+))""" % " ".join(f"WHEN '{nome}' THEN {ordem}" for nome, ordem in ORDEM_TAMANHOS.items())
+
+
+def consultar_catalogo_json(
+    categoria: Optional[str] = None,
+    preco_min: Optional[float] = None,
+    preco_max: Optional[float] = None,
+    tamanho: Optional[str] = None,
+    ordem: str = "id",
+    limite: Optional[int] = None,
+    cursor: Optional[str] = None,
+    incluir_tamanhos: bool = False,
+    ativos: bool = True,
+) -> Tuple[str, Optional[str]]:
+    """Mesma vitrine de ``consultar_catalogo``, com cada produto já em JSON.
+
+    O SQLite monta os objetos (``json_object``), então as linhas não viram
+    dicts nem passam pelo codificador. Retorna ``(itens_json, proximo_cursor)``,
+    com ``itens_json`` sendo o array em texto.
+    """
+    objeto = _objeto_json(COLUNAS_PRODUTO)
+    if incluir_tamanhos:
+        objeto = objeto[:-1] + f", 'tamanhos', {_TAMANHOS_JSON})"
+    coluna = ORDENACOES_CATALOGO.get(ordem, (None, None))[0]
+    # Além do JSON, só o que o cursor da próxima página precisa
+    colunas = f"{objeto} AS json, p.id AS id" + (f", {coluna} AS {coluna.split('.')[1]}" if coluna else "")
+    sql, params, coluna = _consulta_catalogo(
+        colunas, categoria, preco_min, preco_max, tamanho, ordem, limite, cursor, ativos
+    )
+
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        linhas = cur.fetchall()
+
+    linhas, proximo_cursor = _cortar_pagina(linhas, limite, coluna)
+    return "[" + ",".join(r["json"] for r in linhas) + "]", proximo_cursor
+
+
+# Pesos do BM25 por coluna do índice (nome, descricao, categoria)
+PESOS_BUSCA = (10.0, 2.0, 5.0)
+
+
+def _expressao_busca(termo: str) -> Optional[str]:
+    """Converte o texto digitado numa consulta FTS5 segura.
+
+    Cada palavra vira uma frase entre aspas (nenhuma sintaxe FTS5 do usuário é
+    interpretada) e a última ganha ``*`` para o type-ahead: "saia mid" ->
+    ``"saia" "mid"*``.
+    """
+    palavras = re.findall(r"\w+", termo or "")
+    if not palavras:
+        return None
+    frases = ['"' + p.replace('"', '""') + '"' for p in palavras]
+    frases[-1] += "*"
+    return " ".join(frases)
+
+
+def buscar_produtos(termo: str, limite: int = 20) -> List[Dict[str, Any]]:
+    """Busca textual na vitrine, ordenada por relevância (BM25).
+
+    Cada item traz ``nome_destacado`` (nome com ``<mark>``) e ``trecho``
+    (snippet da descrição com ``<mark>``).
+    """
+    expressao = _expressao_busca(termo)
+    if not expressao:
+        return []
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'produtos_busca'")
+        if not cur.fetchone():
+            # SQLite sem FTS5: busca simples por LIKE em todas as palavras
+            palavras = re.findall(r"\w+", termo)
+            filtros = " AND ".join("(p.nome LIKE ? OR p.descricao LIKE ? OR p.categoria LIKE ?)" for _ in palavras)
+            params: List[Any] = []
+            for p in palavras:
+                params.extend([f"%{p}%"] * 3)
+            cur.execute(
+                f"""
+                SELECT {COLUNAS_PRODUTO}, p.nome AS nome_destacado, p.descricao AS trecho
+                FROM produtos p WHERE p.ativo = 1 AND {filtros}
+                ORDER BY p.id LIMIT ?
+                """,
+                params + [int(limite)],
+            )
+            return [dict(r) for r in cur.fetchall()]
+        cur.execute(
+            f"""
+            SELECT {COLUNAS_PRODUTO},
+                   highlight(produtos_busca, 0, '<mark>', '</mark>') AS nome_destacado,
+                   snippet(produtos_busca, 1, '<mark>', '</mark>', '…', 12) AS trecho
+            FROM produtos_busca
+            JOIN produtos p ON p.id = produtos_busca.rowid
+            WHERE produtos_busca MATCH ? AND p.ativo = 1
+            ORDER BY bm25(produtos_busca, ?, ?, ?)
+            LIMIT ?
+            """,
+            (expressao, *PESOS_BUSCA, int(limite)),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+
 def criar_produto(nome: str, categoria: str, preco: float, imagem: str, ativo: int = 1, descricao: Optional[str] = None) -> int:
     try:
-        with conectar() as conn:
+        with conexao() as conn:
             cur = conn.cursor()
             cur.execute(
                 "INSERT INTO produtos (nome, categoria, preco, imagem, ativo, descricao) VALUES (?, ?, ?, ?, ?, ?)",
                 (nome, categoria, float(preco), imagem, ativo, descricao),
             )
-            conn.commit()
             return cur.lastrowid
-    except Exception as e:
-        print(f"Erro ao criar produto: {e}")
+    except Exception:
+        log.exception("erro ao criar produto")
         raise
 
 
@@ -317,7 +1387,7 @@ def atualizar_produto(produto_id: int, nome=None, categoria=None, preco=None, im
             try:
                 params.append(float(preco))
             except (ValueError, TypeError):
-                print(f"Preço inválido: {preco}")
+                log.info("preço inválido: %r", preco)
                 return False
         if imagem is not None:
             campos.append("imagem = ?")
@@ -333,26 +1403,37 @@ def atualizar_produto(produto_id: int, nome=None, categoria=None, preco=None, im
             return False
 
         params.append(produto_id)
-        with conectar() as conn:
+        with conexao() as conn:
             cur = conn.cursor()
             cur.execute(f"UPDATE produtos SET {', '.join(campos)} WHERE id = ?", params)
-            conn.commit()
             return cur.rowcount > 0
-    except Exception as e:
-        print(f"Erro ao atualizar produto: {e}")
+    except Exception:
+        log.exception("erro ao atualizar produto")
         return False
 
 
 def excluir_produto(produto_id: int) -> bool:
-    with conectar() as conn:
+    """Exclui o produto e seus dependentes.
+
+    Com ``foreign_keys=ON`` o produto não pode sumir se já foi vendido; nesse
+    caso ele é apenas desativado para preservar o histórico de pedidos.
+    """
+    with conexao() as conn:
         cur = conn.cursor()
+        cur.execute("SELECT 1 FROM pedido_itens WHERE produto_id = ? LIMIT 1", (produto_id,))
+        if cur.fetchone():
+            cur.execute("UPDATE produtos SET ativo = 0 WHERE id = ?", (produto_id,))
+            return cur.rowcount > 0
+        cur.execute("DELETE FROM reservas WHERE produto_id = ?", (produto_id,))
+        cur.execute("DELETE FROM produtos_tamanhos WHERE produto_id = ?", (produto_id,))
+        cur.execute("DELETE FROM carrinhos WHERE produto_id = ?", (produto_id,))
+        cur.execute("DELETE FROM favoritos WHERE produto_id = ?", (produto_id,))
         cur.execute("DELETE FROM produtos WHERE id = ?", (produto_id,))
-        conn.commit()
         return cur.rowcount > 0
 
 
 def obter_produto(produto_id: int) -> Optional[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM produtos WHERE id = ? AND ativo = 1", (produto_id,))
         row = cur.fetchone()
@@ -361,7 +1442,7 @@ def obter_produto(produto_id: int) -> Optional[Dict[str, Any]]:
         prod = dict(row)
         # tamanhos em ordem correta (PP, P, M, G, GG)
         cur.execute("""
-            SELECT tamanho, estoque FROM produtos_tamanhos 
+            SELECT tamanho, estoque, reservado FROM produtos_tamanhos 
             WHERE produto_id = ? 
             ORDER BY 
                 CASE tamanho 
@@ -373,48 +1454,300 @@ def obter_produto(produto_id: int) -> Optional[Dict[str, Any]]:
                     ELSE 6 
                 END
         """, (produto_id,))
-        prod["tamanhos"] = [
-            {"tamanho": r[0], "estoque": int(r[1])}
-            for r in cur.fetchall()
-        ]
+        prod["tamanhos"] = [_tamanho_com_saldo(r) for r in cur.fetchall()]
         return prod
 
 
 def salvar_tamanhos(produto_id: int, tamanhos: List[Dict[str, Any]]) -> None:
-    """Substitui os tamanhos de um produto pela lista informada."""
-    with conectar() as conn:
+    """Substitui os tamanhos de um produto pela lista informada.
+
+    Tamanhos que continuam na lista são atualizados no lugar (upsert), para
+    não zerar o ``reservado`` de quem já tem o item no carrinho.
+    """
+    estoques: Dict[str, int] = {}
+    for t in tamanhos:
+        tam = str(t.get("tamanho", "")).strip()
+        est = int(t.get("estoque", 0))
+        if tam:
+            estoques[tam] = est
+    with conexao() as conn:
         cur = conn.cursor()
-        cur.execute("DELETE FROM produtos_tamanhos WHERE produto_id = ?", (produto_id,))
-        for t in tamanhos:
-            tam = str(t.get("tamanho", "")).strip()
-            est = int(t.get("estoque", 0))
-            if tam:
-                cur.execute(
-                    "INSERT INTO produtos_tamanhos (produto_id, tamanho, estoque) VALUES (?, ?, ?)",
-                    (produto_id, tam, est),
-                )
-        conn.commit()
+        marcadores = ", ".join("?" for _ in estoques)
+        if estoques:
+            cur.execute(
+                f"DELETE FROM produtos_tamanhos WHERE produto_id = ? AND tamanho NOT IN ({marcadores})",
+                [produto_id, *estoques],
+            )
+            cur.execute(
+                f"DELETE FROM reservas WHERE produto_id = ? AND tamanho NOT IN ({marcadores})",
+                [produto_id, *estoques],
+            )
+        else:
+            cur.execute("DELETE FROM produtos_tamanhos WHERE produto_id = ?", (produto_id,))
+            cur.execute("DELETE FROM reservas WHERE produto_id = ?", (produto_id,))
+        cur.executemany(
+            """
+            INSERT INTO produtos_tamanhos (produto_id, tamanho, estoque) VALUES (?, ?, ?)
+            ON CONFLICT(produto_id, tamanho) DO UPDATE SET estoque = excluded.estoque
+            """,
+            [(produto_id, tam, est) for tam, est in estoques.items()],
+        )
+
+def importar_lote_produtos(produtos: List[Dict[str, Any]]) -> int:
+    """Upsert de um lote de produtos (chave natural: ``sku``) em transação própria.
+
+    Cada item: sku, nome, categoria, preco, imagem, descricao, ativo e
+    ``tamanhos`` (lista de ``{"tamanho", "estoque"}``). Tamanhos informados são
+    criados ou têm o estoque sobrescrito; os demais tamanhos do produto ficam
+    como estão. Usa ``conexao_isolada`` para que cada lote seja um commit,
+    mesmo quando chamado dentro de uma requisição.
+    """
+    if not produtos:
+        return 0
+    with conexao_isolada() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            """
+            INSERT INTO produtos (sku, nome, categoria, preco, imagem, ativo, descricao)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(sku) WHERE sku IS NOT NULL DO UPDATE SET
+                nome = excluded.nome,
+                categoria = excluded.categoria,
+                preco = excluded.preco,
+                imagem = excluded.imagem,
+                ativo = excluded.ativo,
+                descricao = excluded.descricao
+            """,
+            [
+                (p["sku"], p["nome"], p["categoria"], float(p["preco"]), p["imagem"], int(p["ativo"]), p["descricao"])
+                for p in produtos
+            ],
+        )
+        ids: Dict[str, int] = {}
+        skus = list({p["sku"] for p in produtos})
+        for i in range(0, len(skus), 500):
+            parte = skus[i:i + 500]
+            cur = conn.execute(
+                f"SELECT id, sku FROM produtos WHERE sku IN ({', '.join('?' for _ in parte)})", parte
+            )
+            ids.update({r["sku"]: r["id"] for r in cur.fetchall()})
+        conn.executemany(
+            """
+            INSERT INTO produtos_tamanhos (produto_id, tamanho, estoque) VALUES (?, ?, ?)
+            ON CONFLICT(produto_id, tamanho) DO UPDATE SET estoque = excluded.estoque
+            """,
+            [
+                (ids[p["sku"]], t["tamanho"], int(t["estoque"]))
+                for p in produtos
+                for t in p.get("tamanhos") or []
+            ],
+        )
+    return len(produtos)
+
+
+def _tamanho_com_saldo(row: Any) -> Dict[str, Any]:
+    """``(tamanho, estoque, reservado)`` -> dict com o saldo ``disponivel``."""
+    estoque, reservado = int(row[1]), int(row[2])
+    return {
+        "tamanho": row[0],
+        "estoque": estoque,
+        "reservado": reservado,
+        "disponivel": max(0, estoque - reservado),
+    }
+
 
 def obter_tamanho(produto_id: int, tamanho: str) -> Optional[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
-            "SELECT tamanho, estoque FROM produtos_tamanhos WHERE produto_id = ? AND tamanho = ?",
+            "SELECT tamanho, estoque, reservado FROM produtos_tamanhos WHERE produto_id = ? AND tamanho = ?",
             (produto_id, tamanho),
         )
         row = cur.fetchone()
-        return {"tamanho": row[0], "estoque": int(row[1])} if row else None
+        return _tamanho_com_saldo(row) if row else None
 
 def listar_tamanhos(produto_id: int) -> List[Dict[str, Any]]:
     """Lista todos os tamanhos disponíveis para um produto."""
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
-            "SELECT tamanho, estoque FROM produtos_tamanhos WHERE produto_id = ? ORDER BY tamanho",
+            "SELECT tamanho, estoque, reservado FROM produtos_tamanhos WHERE produto_id = ? ORDER BY tamanho",
             (produto_id,),
         )
         rows = cur.fetchall()
-        return [{"tamanho": row[0], "estoque": int(row[1])} for row in rows]
+        return [_tamanho_com_saldo(row) for row in rows]
+
+
+# ---------------------------
+# Reservas de estoque
+# ---------------------------
+
+def _iso_utc(instante: float) -> str:
+    return datetime.utcfromtimestamp(instante).isoformat(timespec="seconds") + "Z"
+
+
+def _devolver_reservas(conn: sqlite3.Connection, reservas: List[Any]) -> None:
+    """Abate ``reservado`` e apaga as reservas (linhas com id, produto_id, tamanho, quantidade)."""
+    if not reservas:
+        return
+    conn.executemany(
+        "UPDATE produtos_tamanhos SET reservado = MAX(0, reservado - ?) WHERE produto_id = ? AND tamanho = ?",
+        [(int(r["quantidade"]), r["produto_id"], r["tamanho"]) for r in reservas],
+    )
+    conn.executemany("DELETE FROM reservas WHERE id = ?", [(r["id"],) for r in reservas])
+
+
+def _expirar_reservas(conn: sqlite3.Connection, limite: int, produto_id: Optional[int] = None,
+                      tamanho: Optional[str] = None) -> int:
+    """Libera até ``limite`` reservas vencidas (opcionalmente de um só tamanho)."""
+    sql = "SELECT id, produto_id, tamanho, quantidade FROM reservas WHERE "
+    params: List[Any] = []
+    if produto_id is not None:
+        sql += "produto_id = ? AND tamanho = ? AND "
+        params.extend([produto_id, tamanho])
+    sql += "expira_em <= ? LIMIT ?"
+    params.extend([time.time(), int(limite)])
+    vencidas = conn.execute(sql, params).fetchall()
+    _devolver_reservas(conn, vencidas)
+    return len(vencidas)
+
+
+def _reservar(conn: sqlite3.Connection, usuario_id: int, produto_id: int, tamanho: str, quantidade: int) -> Optional[float]:
+    """Segura ``quantidade`` unidades para o usuário, se houver saldo vendável.
+
+    Caminho rápido: um UPDATE condicional em ``reservado``. Só quando falta
+    saldo as reservas vencidas daquele tamanho são liberadas na hora (sem
+    esperar o coletor) e a reserva é tentada de novo. Renovar uma reserva
+    existente soma a quantidade e reinicia o prazo. Retorna o novo vencimento
+    (epoch) ou ``None`` se não houver saldo.
+    """
+    sql = (
+        "UPDATE produtos_tamanhos SET reservado = reservado + ? "
+        "WHERE produto_id = ? AND tamanho = ? AND estoque - reservado >= ?"
+    )
+    params = (int(quantidade), produto_id, tamanho, int(quantidade))
+    if conn.execute(sql, params).rowcount == 0:
+        if not _expirar_reservas(conn, RESERVA_LOTE_EXPIRACAO, produto_id, tamanho):
+            return None
+        if conn.execute(sql, params).rowcount == 0:
+            return None
+    expira_em = time.time() + RESERVA_TTL
+    conn.execute(
+        """
+        INSERT INTO reservas (usuario_id, produto_id, tamanho, quantidade, expira_em) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(usuario_id, produto_id, tamanho) DO UPDATE SET
+            quantidade = quantidade + excluded.quantidade,
+            expira_em = excluded.expira_em
+        """,
+        (usuario_id, produto_id, tamanho, int(quantidade), expira_em),
+    )
+    return expira_em
+
+
+def _liberar_reservas(conn: sqlite3.Connection, usuario_id: int, produto_id: Optional[int] = None,
+                      tamanho: Optional[str] = None) -> int:
+    sql = "SELECT id, produto_id, tamanho, quantidade FROM reservas WHERE usuario_id = ?"
+    params: List[Any] = [usuario_id]
+    if produto_id is not None:
+        sql += " AND produto_id = ?"
+        params.append(produto_id)
+    if tamanho is not None:
+        sql += " AND tamanho = ?"
+        params.append(tamanho)
+    reservas = conn.execute(sql, params).fetchall()
+    _devolver_reservas(conn, reservas)
+    return len(reservas)
+
+
+def liberar_reservas(usuario_id: int, produto_id: Optional[int] = None, tamanho: Optional[str] = None) -> int:
+    """Devolve ao saldo vendável as reservas do usuário (todas, de um produto ou de um tamanho)."""
+    with conexao() as conn:
+        return _liberar_reservas(conn, usuario_id, produto_id, tamanho)
+
+
+def expirar_reservas(lote: int = RESERVA_LOTE_EXPIRACAO) -> int:
+    """Libera todas as reservas vencidas, ``lote`` por transação; retorna o total.
+
+    Usa ``conexao_isolada``: cada lote é um commit curto, sem segurar o lock de
+    escrita enquanto houver muitas reservas para liberar.
+    """
+    total = 0
+    while True:
+        with conexao_isolada() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            liberadas = _expirar_reservas(conn, lote)
+        total += liberadas
+        if liberadas < lote:
+            return total
+
+
+class ColetorReservas(threading.Thread):
+    """Thread de fundo que chama ``expirar_reservas`` a cada ``intervalo`` segundos."""
+
+    def __init__(self, intervalo: float = RESERVA_INTERVALO_COLETOR) -> None:
+        super().__init__(name="dyva-coletor-reservas", daemon=True)
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+
+    def run(self) -> None:
+        while not self._parar.wait(self.intervalo):
+            try:
+                liberadas = expirar_reservas()
+                if liberadas:
+                    log.info("%d reservas vencidas liberadas", liberadas)
+            except sqlite3.Error:
+                log.exception("erro ao expirar reservas")
+
+    def parar(self) -> None:
+        self._parar.set()
+
+
+_coletor_reservas: Optional[ColetorReservas] = None
+_coletor_lock = threading.Lock()
+
+
+def iniciar_coletor_reservas(intervalo: float = RESERVA_INTERVALO_COLETOR) -> ColetorReservas:
+    """Inicia (uma vez por processo) o coletor de reservas vencidas."""
+    global _coletor_reservas
+    with _coletor_lock:
+        if _coletor_reservas is None or not _coletor_reservas.is_alive():
+            _coletor_reservas = ColetorReservas(intervalo)
+            _coletor_reservas.start()
+        return _coletor_reservas
+
+
+def parar_coletor_reservas() -> None:
+    global _coletor_reservas
+    with _coletor_lock:
+        if _coletor_reservas is not None:
+            _coletor_reservas.parar()
+            _coletor_reservas = None
+
+
+# Pools herdados de um fork: ficam referenciados para nunca serem fechados no filho
+_pools_herdados: List[PoolConexoes] = []
+
+
+def _apos_fork_no_filho() -> None:
+    """Estado do banco limpo no processo filho (ex.: worker do gunicorn).
+
+    Conexões SQLite não podem atravessar um fork. O pool herdado é abandonado
+    sem fechar as conexões: fechar um descritor herdado derrubaria locks
+    POSIX do arquivo. Os locks são recriados porque outra thread do pai
+    podia estar com eles no momento do fork, e a thread do coletor não existe
+    no filho.
+    """
+    global _pool, _pool_lock, _coletor_reservas, _coletor_lock
+    if _pool is not None:
+        _pools_herdados.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+    _coletor_reservas = None
+    _coletor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_apos_fork_no_filho)
 
 
 # ---------------------------
@@ -422,64 +1755,203 @@ def listar_tamanhos(produto_id: int) -> List[Dict[str, Any]]:
 # ---------------------------
 
 def listar_carrinho(usuario_id: int) -> List[Dict[str, Any]]:
-    with conectar() as conn:
+    """Linhas do carrinho com a reserva do usuário e o saldo vendável do tamanho.
+
+    ``reservado`` é quanto da linha está garantido para o usuário (0 se a
+    reserva venceu) e ``reserva_expira_em`` quando isso deixa de valer.
+    """
+    agora = time.time()
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             """
-            SELECT c.produto_id, p.nome, p.preco, p.imagem, c.tamanho, c.quantidade
+            SELECT c.produto_id, p.nome, p.preco, p.imagem, c.tamanho, c.quantidade,
+                   t.estoque, t.reservado AS reservado_total, r.quantidade AS reservado, r.expira_em
             FROM carrinhos c
             JOIN produtos p ON p.id = c.produto_id
+            LEFT JOIN produtos_tamanhos t ON t.produto_id = c.produto_id AND t.tamanho = c.tamanho
+            LEFT JOIN reservas r
+                ON r.usuario_id = c.usuario_id AND r.produto_id = c.produto_id AND r.tamanho = c.tamanho
             WHERE c.usuario_id = ? AND p.ativo = 1
             ORDER BY c.id DESC
             """,
             (usuario_id,),
         )
-        return [
-            {
+        itens = []
+        for r in cur.fetchall():
+            ativa = r["expira_em"] is not None and r["expira_em"] > agora
+            itens.append({
                 "produto_id": r["produto_id"],
                 "nome": r["nome"],
                 "preco": float(r["preco"]),
                 "imagem": r["imagem"],
                 "tamanho": r["tamanho"],
                 "quantidade": int(r["quantidade"]),
-            }
-            for r in cur.fetchall()
-        ]
+                "reservado": int(r["reservado"]) if ativa else 0,
+                "reserva_expira_em": _iso_utc(r["expira_em"]) if ativa else None,
+                "disponivel": max(0, int(r["estoque"] or 0) - int(r["reservado_total"] or 0)),
+            })
+        return itens
 
 
-def adicionar_ao_carrinho(usuario_id: int, produto_id: int, tamanho: str, quantidade: int) -> bool:
-    prod = obter_produto(produto_id)
-    if not prod:
-        return False
-    # valida tamanho
-    tinfo = obter_tamanho(produto_id, tamanho)
-    if not tinfo:
-        return False
-    with conectar() as conn:
+def adicionar_ao_carrinho(usuario_id: int, produto_id: int, tamanho: str, quantidade: int) -> Dict[str, Any]:
+    """Adiciona ao carrinho reservando o estoque pelo prazo ``RESERVA_TTL``.
+
+    Retorna ``{"ok": True, "reserva_expira_em"}`` ou ``{"ok": False, "erro"}``;
+    sem saldo vendável o erro vem com ``disponivel``.
+    """
+    with transacao() as conn:
         cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT t.estoque, t.reservado FROM produtos_tamanhos t
+            JOIN produtos p ON p.id = t.produto_id
+            WHERE t.produto_id = ? AND t.tamanho = ? AND p.ativo = 1
+            """,
+            (produto_id, tamanho),
+        )
+        tinfo = cur.fetchone()
+        if not tinfo:
+            return {"ok": False, "erro": "Produto inválido ou inativo"}
+        expira_em = _reservar(conn, usuario_id, produto_id, tamanho, quantidade)
+        if expira_em is None:
+            disponivel = conn.execute(
+                "SELECT MAX(0, estoque - reservado) FROM produtos_tamanhos WHERE produto_id = ? AND tamanho = ?",
+                (produto_id, tamanho),
+            ).fetchone()[0]
+            return {"ok": False, "erro": "Estoque insuficiente", "disponivel": int(disponivel)}
         # Se já existe, soma quantidade
         cur.execute(
-            "SELECT quantidade FROM carrinhos WHERE usuario_id = ? AND produto_id = ? AND tamanho = ?",
-            (usuario_id, produto_id, tamanho),
+            """
+            INSERT INTO carrinhos (usuario_id, produto_id, tamanho, quantidade) VALUES (?, ?, ?, ?)
+            ON CONFLICT(usuario_id, produto_id, tamanho) DO UPDATE SET quantidade = quantidade + excluded.quantidade
+            """,
+            (usuario_id, produto_id, tamanho, int(quantidade)),
         )
-        row = cur.fetchone()
-        if row:
-            nova = int(row["quantidade"]) + int(quantidade)
-            cur.execute(
-                "UPDATE carrinhos SET quantidade = ? WHERE usuario_id = ? AND produto_id = ? AND tamanho = ?",
-                (nova, usuario_id, produto_id, tamanho),
+        return {"ok": True, "reserva_expira_em": _iso_utc(expira_em)}
+
+
+def _conferir_linhas_carrinho(conn: sqlite3.Connection, usuario_id: int,
+                              linhas: Dict[Tuple[int, Optional[str]], int]) -> List[Any]:
+    """Confere todas as linhas de uma vez: um JOIN de ``VALUES`` com produtos,
+    tamanhos e a reserva atual do usuário (``saldo`` já inclui essa reserva)."""
+    valores = ", ".join("(?, ?, ?)" for _ in linhas)
+    params: List[Any] = []
+    for (produto_id, tamanho), quantidade in linhas.items():
+        params.extend([produto_id, tamanho, quantidade])
+    params.append(usuario_id)
+    return conn.execute(
+        f"""
+        WITH linhas(produto_id, tamanho, quantidade) AS (VALUES {valores})
+        SELECT l.produto_id, l.tamanho, l.quantidade, p.ativo,
+               t.estoque - t.reservado + COALESCE(r.quantidade, 0) AS saldo,
+               COALESCE(r.quantidade, 0) AS minha_reserva
+        FROM linhas l
+        LEFT JOIN produtos p ON p.id = l.produto_id
+        LEFT JOIN produtos_tamanhos t ON t.produto_id = l.produto_id AND t.tamanho = l.tamanho
+        LEFT JOIN reservas r ON r.usuario_id = ? AND r.produto_id = l.produto_id AND r.tamanho = l.tamanho
+        """,
+        params,
+    ).fetchall()
+
+
+def _faltas_carrinho(conferidas: List[Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "produto_id": r["produto_id"],
+            "tamanho": r["tamanho"],
+            "solicitado": int(r["quantidade"]),
+            "disponivel": max(0, int(r["saldo"])),
+        }
+        for r in conferidas
+        if r["quantidade"] > 0 and r["saldo"] is not None and r["quantidade"] > r["saldo"]
+    ]
+
+
+def sincronizar_carrinho(usuario_id: int, itens: List[Dict[str, Any]], substituir: bool = False) -> Dict[str, Any]:
+    """Aplica várias linhas ao carrinho numa única transação.
+
+    Cada item é ``{"produto_id", "tamanho", "quantidade"}`` com a quantidade
+    final da linha (0 remove). Com ``substituir`` o carrinho passa a ser
+    exatamente ``itens``; sem ele, as demais linhas ficam como estão. As
+    linhas são conferidas numa só consulta e gravadas com ``executemany``
+    (upsert), ajustando as reservas pela diferença e renovando o prazo.
+    Nada é gravado se alguma linha for inválida (``invalidos``) ou não tiver
+    saldo (``faltas``). Em caso de sucesso: ``{"ok": True, "itens": [...]}``
+    com o carrinho reconciliado.
+    """
+    linhas: Dict[Tuple[int, Optional[str]], int] = {}
+    for item in itens:
+        linhas[(int(item["produto_id"]), item["tamanho"])] = int(item["quantidade"])
+
+    with transacao() as conn:
+        if substituir:
+            atuais = conn.execute(
+                "SELECT produto_id, tamanho FROM carrinhos WHERE usuario_id = ?", (usuario_id,)
+            ).fetchall()
+            for r in atuais:
+                linhas.setdefault((r["produto_id"], r["tamanho"]), 0)
+        if linhas:
+            conferidas = _conferir_linhas_carrinho(conn, usuario_id, linhas)
+            invalidos = [
+                {"produto_id": r["produto_id"], "tamanho": r["tamanho"]}
+                for r in conferidas
+                if r["quantidade"] > 0 and (r["ativo"] != 1 or r["saldo"] is None)
+            ]
+            if invalidos:
+                return {"ok": False, "erro": "Produto inválido ou inativo", "invalidos": invalidos}
+            faltas = _faltas_carrinho(conferidas)
+            if faltas:
+                # Antes de recusar, libera as reservas vencidas dos tamanhos em falta
+                liberadas = sum(
+                    _expirar_reservas(conn, RESERVA_LOTE_EXPIRACAO, f["produto_id"], f["tamanho"]) for f in faltas
+                )
+                if liberadas:
+                    conferidas = _conferir_linhas_carrinho(conn, usuario_id, linhas)
+                    faltas = _faltas_carrinho(conferidas)
+                if faltas:
+                    return {"ok": False, "erro": "Estoque insuficiente", "faltas": faltas}
+
+            manter = [r for r in conferidas if r["quantidade"] > 0]
+            remover = [r for r in conferidas if r["quantidade"] <= 0]
+            expira_em = time.time() + RESERVA_TTL
+            conn.executemany(
+                "UPDATE produtos_tamanhos SET reservado = MAX(0, reservado + ?) WHERE produto_id = ? AND tamanho = ?",
+                [
+                    (max(0, r["quantidade"]) - r["minha_reserva"], r["produto_id"], r["tamanho"])
+                    for r in conferidas
+                    if r["tamanho"] is not None and max(0, r["quantidade"]) != r["minha_reserva"]
+                ],
             )
-        else:
-            cur.execute(
-                "INSERT INTO carrinhos (usuario_id, produto_id, tamanho, quantidade) VALUES (?, ?, ?, ?)",
-                (usuario_id, produto_id, tamanho, int(quantidade)),
+            conn.executemany(
+                """
+                INSERT INTO carrinhos (usuario_id, produto_id, tamanho, quantidade) VALUES (?, ?, ?, ?)
+                ON CONFLICT(usuario_id, produto_id, tamanho) DO UPDATE SET quantidade = excluded.quantidade
+                """,
+                [(usuario_id, r["produto_id"], r["tamanho"], r["quantidade"]) for r in manter],
             )
-        conn.commit()
-        return True
+            conn.executemany(
+                """
+                INSERT INTO reservas (usuario_id, produto_id, tamanho, quantidade, expira_em) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(usuario_id, produto_id, tamanho) DO UPDATE SET
+                    quantidade = excluded.quantidade,
+                    expira_em = excluded.expira_em
+                """,
+                [(usuario_id, r["produto_id"], r["tamanho"], r["quantidade"], expira_em) for r in manter],
+            )
+            conn.executemany(
+                "DELETE FROM carrinhos WHERE usuario_id = ? AND produto_id = ? AND tamanho IS ?",
+                [(usuario_id, r["produto_id"], r["tamanho"]) for r in remover],
+            )
+            conn.executemany(
+                "DELETE FROM reservas WHERE usuario_id = ? AND produto_id = ? AND tamanho = ?",
+                [(usuario_id, r["produto_id"], r["tamanho"]) for r in remover if r["minha_reserva"]],
+            )
+    return {"ok": True, "itens": listar_carrinho(usuario_id)}
 
 
 def remover_do_carrinho(usuario_id: int, produto_id: int, tamanho: Optional[str] = None) -> None:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         if tamanho is None:
             cur.execute(
@@ -491,14 +1963,14 @@ def remover_do_carrinho(usuario_id: int, produto_id: int, tamanho: Optional[str]
                 "DELETE FROM carrinhos WHERE usuario_id = ? AND produto_id = ? AND tamanho = ?",
                 (usuario_id, produto_id, tamanho),
             )
-        conn.commit()
+        _liberar_reservas(conn, usuario_id, produto_id, tamanho)
 
 
 def limpar_carrinho(usuario_id: int) -> None:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM carrinhos WHERE usuario_id = ?", (usuario_id,))
-        conn.commit()
+        _liberar_reservas(conn, usuario_id)
 
 
 # ---------------------------
@@ -506,7 +1978,7 @@ def limpar_carrinho(usuario_id: int) -> None:
 # ---------------------------
 
 def listar_favoritos(usuario_id: int) -> List[Dict[str, Any]]:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -533,7 +2005,7 @@ def alternar_favorito(usuario_id: int, produto_id: int) -> Optional[bool]:
     prod = obter_produto(produto_id)
     if not prod:
         return None
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT id FROM favoritos WHERE usuario_id = ? AND produto_id = ?",
@@ -542,14 +2014,12 @@ def alternar_favorito(usuario_id: int, produto_id: int) -> Optional[bool]:
         row = cur.fetchone()
         if row:
             cur.execute("DELETE FROM favoritos WHERE id = ?", (row["id"],))
-            conn.commit()
             return False
         else:
             cur.execute(
                 "INSERT INTO favoritos (usuario_id, produto_id) VALUES (?, ?)",
                 (usuario_id, produto_id),
             )
-            conn.commit()
             return True
 
 
@@ -558,67 +2028,380 @@ def alternar_favorito(usuario_id: int, produto_id: int) -> Optional[bool]:
 # ---------------------------
 
 def criar_pedido(usuario_id: int, total: float, metodo_pagamento: str, status: str) -> int:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO pedidos (usuario_id, total, metodo_pagamento, status, criado_em) VALUES (?, ?, ?, ?, ?)",
             (usuario_id, float(total), metodo_pagamento, status, datetime.utcnow().isoformat() + "Z"),
         )
-        conn.commit()
         return cur.lastrowid
 
 
 def adicionar_item_pedido(pedido_id: int, produto_id: int, nome: str, preco: float, quantidade: int, tamanho: Optional[str]) -> None:
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO pedido_itens (pedido_id, produto_id, nome, preco, tamanho, quantidade) VALUES (?, ?, ?, ?, ?, ?)",
             (pedido_id, produto_id, nome, float(preco), tamanho, int(quantidade)),
         )
-        conn.commit()
 
 
-def listar_pedidos(usuario_id: int) -> List[Dict[str, Any]]:
-    with conectar() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM pedidos WHERE usuario_id = ? ORDER BY id DESC",
-            (usuario_id,),
-        )
-        pedidos = [dict(r) for r in cur.fetchall()]
-        for p in pedidos:
-            cur.execute(
-                "SELECT nome, preco, quantidade, tamanho FROM pedido_itens WHERE pedido_id = ?",
-                (p["id"],),
+def produtos_inexistentes(ids: List[Any]) -> List[Any]:
+    """Ids (como recebidos, sem repetir) que não existem em ``produtos``.
+
+    Com ``foreign_keys`` ligado, um item de pedido com um desses ids falharia
+    no INSERT; ``None`` é ignorado (item sem produto é aceito pela chave).
+    """
+    candidatos: List[Tuple[Any, Optional[int]]] = []
+    for valor in ids:
+        if valor is None:
+            continue
+        try:
+            candidatos.append((valor, int(valor)))
+        except (TypeError, ValueError):
+            candidatos.append((valor, None))
+    numeros = sorted({n for _, n in candidatos if n is not None})
+    existentes = set()
+    if numeros:
+        with conexao() as conn:
+            cur = conn.execute(
+                "SELECT id FROM produtos WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(numeros),),
             )
+            existentes = {r[0] for r in cur.fetchall()}
+    faltando: List[Any] = []
+    for valor, numero in candidatos:
+        if (numero is None or numero not in existentes) and valor not in faltando:
+            faltando.append(valor)
+    return faltando
+
+
+def adicionar_itens_pedido(pedido_id: int, itens: List[Dict[str, Any]]) -> None:
+    """Grava vários itens do pedido de uma vez (``executemany``)."""
+    with conexao() as conn:
+        conn.executemany(
+            "INSERT INTO pedido_itens (pedido_id, produto_id, nome, preco, tamanho, quantidade) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (pedido_id, i["produto_id"], i["nome"], float(i["preco"]), i.get("tamanho"), int(i["quantidade"]))
+                for i in itens
+            ],
+        )
+
+
+def listar_pedidos(usuario_id: int, limite: Optional[int] = None, antes_de: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Histórico de pedidos do usuário (mais recentes primeiro) com os itens embutidos.
+
+    Uma única consulta: os itens de cada pedido vêm agregados em JSON pela
+    subconsulta correlacionada (índice em pedido_itens.pedido_id). ``limite`` e
+    ``antes_de`` fazem paginação por keyset sobre ``pedidos.id``.
+    """
+    sql = """
+        SELECT p.id, p.usuario_id, p.total, p.metodo_pagamento, p.status, p.criado_em,
+               (SELECT json_group_array(json_object(
+                           'nome', i.nome, 'preco', i.preco,
+                           'quantidade', i.quantidade, 'tamanho', i.tamanho))
+                FROM pedido_itens i WHERE i.pedido_id = p.id) AS itens
+        FROM pedidos p
+        WHERE p.usuario_id = ?
+    """
+    params: List[Any] = [usuario_id]
+    if antes_de is not None:
+        sql += " AND p.id < ?"
+        params.append(int(antes_de))
+    sql += " ORDER BY p.id DESC"
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(int(limite))
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        pedidos = []
+        for r in cur.fetchall():
+            p = dict(r)
             p["itens"] = [
-                {"nome": r["nome"], "preco": float(r["preco"]), "quantidade": int(r["quantidade"]), "tamanho": r["tamanho"]}
-                for r in cur.fetchall()
+                {"nome": i["nome"], "preco": float(i["preco"]), "quantidade": int(i["quantidade"]), "tamanho": i["tamanho"]}
+                for i in json.loads(r["itens"])
             ]
+            pedidos.append(p)
         return pedidos
 
 
+def listar_pedidos_json(usuario_id: int, limite: Optional[int] = None, antes_de: Optional[int] = None) -> Tuple[str, int, Optional[int]]:
+    """Mesmo histórico de ``listar_pedidos``, com cada pedido já em JSON pelo SQLite.
+
+    Retorna ``(pedidos_json, quantidade, id_do_ultimo)`` para a paginação.
+    """
+    sql = """
+        SELECT p.id, json_object(
+                   'id', p.id, 'usuario_id', p.usuario_id, 'total', p.total,
+                   'metodo_pagamento', p.metodo_pagamento, 'status', p.status, 'criado_em', p.criado_em,
+                   'itens', json((SELECT json_group_array(json_object(
+                                     'nome', i.nome, 'preco', CAST(i.preco AS REAL),
+                                     'quantidade', CAST(i.quantidade AS INTEGER), 'tamanho', i.tamanho))
+                                  FROM pedido_itens i WHERE i.pedido_id = p.id))
+               ) AS json
+        FROM pedidos p
+        WHERE p.usuario_id = ?
+    """
+    params: List[Any] = [usuario_id]
+    if antes_de is not None:
+        sql += " AND p.id < ?"
+        params.append(int(antes_de))
+    sql += " ORDER BY p.id DESC"
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(int(limite))
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        linhas = cur.fetchall()
+    ultimo = linhas[-1]["id"] if linhas else None
+    return "[" + ",".join(r["json"] for r in linhas) + "]", len(linhas), ultimo
+
+
 def decrementar_estoque(produto_id: int, tamanho: str, quantidade: int) -> bool:
     """Decrementa estoque do tamanho informado se houver saldo suficiente."""
-    with conectar() as conn:
+    with conexao() as conn:
         cur = conn.cursor()
+        # UPDATE condicional: verifica e baixa o saldo no mesmo comando, sem janela de corrida
         cur.execute(
-            "SELECT estoque FROM produtos_tamanhos WHERE produto_id = ? AND tamanho = ?",
-            (produto_id, tamanho),
+            "UPDATE produtos_tamanhos SET estoque = estoque - ? WHERE produto_id = ? AND tamanho = ? AND estoque >= ?",
+            (int(quantidade), produto_id, tamanho, int(quantidade)),
         )
-        row = cur.fetchone()
-        if not row:
-            return False
-        atual = int(row[0])
-        if atual < quantidade:
-            return False
-        novo = atual - quantidade
+        return cur.rowcount > 0
+
+
+def finalizar_checkout(usuario_id: int, metodo_pagamento: str, status: str = "Pago") -> Dict[str, Any]:
+    """Transforma o carrinho do usuário em pedido numa única transação.
+
+    Baixa o estoque de todas as linhas com UPDATEs condicionais, consumindo as
+    reservas do próprio usuário (o saldo de cada linha é ``estoque - reservado``
+    mais o que ele mesmo reservou), grava os itens com ``executemany`` e esvazia
+    o carrinho. Se alguma linha não tiver saldo,
+    nada é gravado e o retorno traz ``faltas`` com o relatório por linha:
+    ``{"ok": False, "erro": ..., "faltas": [{"produto_id", "nome", "tamanho",
+    "solicitado", "disponivel"}]}``. Em caso de sucesso:
+    ``{"ok": True, "pedido_id", "total", "itens"}``.
+    """
+    with transacao() as conn:
+        cur = conn.cursor()
+        # BEGIN IMMEDIATE já segura o lock de escrita: a leitura abaixo e as baixas
+        # de estoque enxergam o mesmo saldo, mesmo com vários compradores simultâneos
         cur.execute(
-            "UPDATE produtos_tamanhos SET estoque = ? WHERE produto_id = ? AND tamanho = ?",
-            (novo, produto_id, tamanho),
+            """
+            SELECT c.produto_id, p.nome, p.preco, c.tamanho, c.quantidade,
+                   t.estoque - t.reservado + COALESCE(r.quantidade, 0) AS saldo,
+                   COALESCE(r.quantidade, 0) AS minha_reserva
+            FROM carrinhos c
+            JOIN produtos p ON p.id = c.produto_id
+            LEFT JOIN produtos_tamanhos t ON t.produto_id = c.produto_id AND t.tamanho = c.tamanho
+            LEFT JOIN reservas r
+                ON r.usuario_id = c.usuario_id AND r.produto_id = c.produto_id AND r.tamanho = c.tamanho
+            WHERE c.usuario_id = ? AND p.ativo = 1
+            ORDER BY c.id DESC
+            """,
+            (usuario_id,),
         )
-        conn.commit()
-        return True
+        linhas = cur.fetchall()
+        if not linhas:
+            return {"ok": False, "erro": "Carrinho vazio", "faltas": []}
+
+        faltas = [
+            {
+                "produto_id": r["produto_id"],
+                "nome": r["nome"],
+                "tamanho": r["tamanho"],
+                "solicitado": int(r["quantidade"]),
+                "disponivel": max(0, int(r["saldo"] or 0)),
+            }
+            for r in linhas
+            if r["tamanho"] and (r["saldo"] is None or int(r["saldo"]) < int(r["quantidade"]))
+        ]
+        if faltas:
+            tamanhos = ", ".join(f["tamanho"] for f in faltas)
+            return {"ok": False, "erro": f"Sem estoque do tamanho {tamanhos}", "faltas": faltas}
+
+        baixas = [
+            (int(r["quantidade"]), int(r["minha_reserva"]), r["produto_id"], r["tamanho"],
+             int(r["minha_reserva"]), int(r["quantidade"]))
+            for r in linhas
+            if r["tamanho"]
+        ]
+        if baixas:
+            cur.executemany(
+                """
+                UPDATE produtos_tamanhos SET estoque = estoque - ?, reservado = MAX(0, reservado - ?)
+                WHERE produto_id = ? AND tamanho = ? AND estoque - reservado + ? >= ?
+                """,
+                baixas,
+            )
+            if cur.rowcount != len(baixas):
+                # Não deveria acontecer com o lock de escrita; desfaz o bloco inteiro
+                raise sqlite3.IntegrityError("Estoque alterado durante o checkout")
+
+        total = sum(float(r["preco"]) * int(r["quantidade"]) for r in linhas)
+        cur.execute(
+            "INSERT INTO pedidos (usuario_id, total, metodo_pagamento, status, criado_em) VALUES (?, ?, ?, ?, ?)",
+            (usuario_id, total, metodo_pagamento, status, datetime.utcnow().isoformat() + "Z"),
+        )
+        pedido_id = cur.lastrowid
+        itens = [
+            {
+                "produto_id": r["produto_id"],
+                "nome": r["nome"],
+                "preco": float(r["preco"]),
+                "tamanho": r["tamanho"],
+                "quantidade": int(r["quantidade"]),
+            }
+            for r in linhas
+        ]
+        adicionar_itens_pedido(pedido_id, itens)
+        # As reservas das linhas compradas já foram abatidas acima; as que sobrarem
+        # (produtos desativados, por exemplo) voltam para o saldo vendável
+        compradas = {(r["produto_id"], r["tamanho"]) for r in linhas if r["tamanho"]}
+        cur.execute("SELECT id, produto_id, tamanho, quantidade FROM reservas WHERE usuario_id = ?", (usuario_id,))
+        reservas = cur.fetchall()
+        cur.executemany(
+            "DELETE FROM reservas WHERE id = ?",
+            [(r["id"],) for r in reservas if (r["produto_id"], r["tamanho"]) in compradas],
+        )
+        _devolver_reservas(conn, [r for r in reservas if (r["produto_id"], r["tamanho"]) not in compradas])
+        cur.execute("DELETE FROM carrinhos WHERE usuario_id = ?", (usuario_id,))
+        return {"ok": True, "pedido_id": pedido_id, "total": total, "itens": itens}
+
+
+# ---------------------------
+# Relatórios de vendas (tabelas de resumo)
+# ---------------------------
+
+def reconstruir_relatorios() -> None:
+    """Recalcula todas as tabelas de resumo numa única transação."""
+    with transacao() as conn:
+        _recalcular_relatorios(conn.cursor())
+
+
+def relatorio_vendas_diarias(de: Optional[str] = None, ate: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Vendas por dia (UTC) entre ``de`` e ``ate`` (AAAA-MM-DD, inclusivos)."""
+    sql = "SELECT dia, pedidos, itens, ROUND(receita, 2) AS receita FROM vendas_diarias WHERE 1 = 1"
+    params: List[Any] = []
+    if de:
+        sql += " AND dia >= ?"
+        params.append(de)
+    if ate:
+        sql += " AND dia <= ?"
+        params.append(ate)
+    with conexao() as conn:
+        return [dict(r) for r in conn.execute(sql + " ORDER BY dia", params).fetchall()]
+
+
+def relatorio_mais_vendidos(limite: int = 10, por: str = "unidades") -> List[Dict[str, Any]]:
+    coluna = "receita" if por == "receita" else "unidades"
+    with conexao() as conn:
+        cur = conn.execute(
+            f"SELECT produto_id, nome, unidades, ROUND(receita, 2) AS receita FROM vendas_produto ORDER BY vendas_produto.{coluna} DESC LIMIT ?",
+            (int(limite),),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+
+def relatorio_categorias() -> List[Dict[str, Any]]:
+    with conexao() as conn:
+        cur = conn.execute("SELECT categoria, unidades, ROUND(receita, 2) AS receita FROM vendas_categoria ORDER BY receita DESC")
+        return [dict(r) for r in cur.fetchall()]
+
+
+def relatorio_tamanhos(produto_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Unidades e receita por tamanho (de um produto, ou da loja inteira)."""
+    with conexao() as conn:
+        if produto_id is None:
+            cur = conn.execute("SELECT tamanho, unidades, ROUND(receita, 2) AS receita FROM vendas_tamanho")
+        else:
+            cur = conn.execute(
+                "SELECT tamanho, unidades, ROUND(receita, 2) AS receita FROM vendas_produto_tamanho WHERE produto_id = ?",
+                (produto_id,),
+            )
+        linhas = [dict(r) for r in cur.fetchall()]
+    linhas.sort(key=lambda t: ORDEM_TAMANHOS.get(t["tamanho"], 6))
+    return linhas
+
+
+# ---------------------------
+# Exportações (streaming)
+# ---------------------------
+
+COLUNAS_EXPORTACAO_PEDIDOS = [
+    "pedido_id", "criado_em", "usuario_id", "status", "metodo_pagamento", "total",
+    "item_id", "produto_id", "nome", "tamanho", "quantidade", "preco", "subtotal",
+]
+COLUNAS_EXPORTACAO_PRODUTOS = ["id", "sku", "nome", "categoria", "preco", "ativo", "tamanho", "estoque"]
+
+
+def exportar_pedidos(de: Optional[str] = None, ate: Optional[str] = None, status: Optional[str] = None,
+                     lote: int = 500) -> Iterator[Dict[str, Any]]:
+    """Gera as linhas (pedido x item) sem materializar o resultado.
+
+    Lê ``lote`` pedidos por vez com keyset em (criado_em, id), cada lote numa
+    leitura curta com conexão própria: nenhuma transação de leitura fica aberta
+    entre lotes (o WAL pode ser checkpointado) e a memória fica constante.
+    ``de`` é inclusivo e ``ate`` exclusivo (strings ISO comparáveis a criado_em).
+    """
+    ultimo: Tuple[str, int] = (de or "", 0)
+    filtros = "(criado_em, id) > (?, ?)"
+    extras: List[Any] = []
+    if ate:
+        filtros += " AND criado_em < ?"
+        extras.append(ate)
+    if status:
+        filtros += " AND status = ?"
+        extras.append(status)
+    sql = f"""
+        SELECT p.id AS pedido_id, p.criado_em, p.usuario_id, p.status, p.metodo_pagamento, p.total,
+               i.id AS item_id, i.produto_id, i.nome, i.tamanho, i.quantidade, i.preco
+        FROM (SELECT * FROM pedidos WHERE {filtros} ORDER BY criado_em, id LIMIT ?) p
+        LEFT JOIN pedido_itens i ON i.pedido_id = p.id
+        ORDER BY p.criado_em, p.id, i.id
+    """
+    while True:
+        with conexao_isolada() as conn:
+            linhas = conn.execute(sql, [*ultimo, *extras, int(lote)]).fetchall()
+        if not linhas:
+            return
+        pedidos_no_lote = 0
+        for r in linhas:
+            if (r["criado_em"], r["pedido_id"]) != ultimo:
+                ultimo = (r["criado_em"], r["pedido_id"])
+                pedidos_no_lote += 1
+            linha = dict(r)
+            linha["subtotal"] = (
+                round(float(r["preco"]) * int(r["quantidade"]), 2) if r["item_id"] is not None else None
+            )
+            yield linha
+        if pedidos_no_lote < lote:
+            return
+
+
+def exportar_produtos(lote: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Gera o catálogo completo (uma linha por produto x tamanho), em lotes por id."""
+    ultimo_id = 0
+    sql = """
+        SELECT p.id, p.sku, p.nome, p.categoria, p.preco, p.ativo, t.tamanho, t.estoque
+        FROM (SELECT * FROM produtos WHERE id > ? ORDER BY id LIMIT ?) p
+        LEFT JOIN produtos_tamanhos t ON t.produto_id = p.id
+        ORDER BY p.id, t.id
+    """
+    while True:
+        with conexao_isolada() as conn:
+            linhas = conn.execute(sql, (ultimo_id, int(lote))).fetchall()
+        if not linhas:
+            return
+        produtos_no_lote = 0
+        for r in linhas:
+            if r["id"] != ultimo_id:
+                ultimo_id = r["id"]
+                produtos_no_lote += 1
+            yield dict(r)
+        if produtos_no_lote < lote:
+            return
 
 
 # Executar inicialização quando arquivo é executado diretamente
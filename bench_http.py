@@ -0,0 +1,388 @@
+# Benchmark HTTP por cenários: vazão e p50/p95/p99 por endpoint
+#
+# Uso: python bench_http.py [--modo cliente|servidor] [--mistura misto] [--concorrencia 8]
+#                           [--segundos 20] [--saida resultado.json] [--base base.json]
+#
+# Cada usuário virtual (uma thread) sorteia cenários da mistura: navegação
+# anônima pela vitrine, login, carrinho, compra (checkout) e histórico de
+# pedidos. Roda sobre uma cópia temporária do banco (o dyva.db nunca é
+# alterado), com estoque alto e usuários de benchmark criados na cópia.
+#
+#   --modo cliente   usa o test client do Flask (sem rede; mede a aplicação)
+#   --modo servidor  sobe o app num servidor local com threads e usa HTTP de verdade
+#
+# Com --base, compara com um resultado salvo antes: p95 de um endpoint ou
+# vazão total piores que --tolerancia (padrão 15%) contam como regressão e o
+# script sai com código 1, para barrar o deploy.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# O log de acesso de cada requisição atrapalharia a medição
+os.environ.setdefault("DYVA_LOG_NIVEL", "WARNING")
+
+import banco
+import senhas
+
+SENHA_BENCH = "senha-bench-123"
+EMAIL_BENCH = "bench{}@dyva.local"
+ESTOQUE_BENCH = 10 ** 9
+
+# Pesos de cada cenário nas misturas disponíveis
+MISTURAS: Dict[str, Dict[str, int]] = {
+    "misto": {"navegacao": 60, "carrinho": 20, "historico": 10, "compra": 5, "login": 5},
+    "navegacao": {"navegacao": 1},
+    "compra": {"carrinho": 1, "compra": 1},
+    "login": {"login": 1},
+}
+
+Medida = Tuple[str, float, int]
+
+
+class ClienteTeste:
+    """Requisições pelo test client do Flask."""
+
+    def __init__(self, app: Any) -> None:
+        self.cliente = app.test_client()
+
+    def requisitar(self, metodo: str, caminho: str, corpo: Any, cabecalhos: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        resp = self.cliente.open(caminho, method=metodo, json=corpo, headers=cabecalhos)
+        return resp.status_code, dict(resp.headers), resp.get_data()
+
+
+class ClienteHTTP:
+    """Requisições HTTP/1.1 com a conexão reaproveitada entre chamadas."""
+
+    def __init__(self, host: str, porta: int) -> None:
+        self.host, self.porta = host, porta
+        self.conn = http.client.HTTPConnection(host, porta, timeout=30)
+
+    def requisitar(self, metodo: str, caminho: str, corpo: Any, cabecalhos: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        dados = None
+        if corpo is not None:
+            dados = json.dumps(corpo).encode("utf-8")
+            cabecalhos = dict(cabecalhos, **{"Content-Type": "application/json"})
+        try:
+            self.conn.request(metodo, caminho, body=dados, headers=cabecalhos)
+            resp = self.conn.getresponse()
+            return resp.status, dict(resp.getheaders()), resp.read()
+        except (OSError, http.client.HTTPException):
+            # Conexão derrubada pelo servidor: conta como erro e reconecta
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.porta, timeout=30)
+            return 0, {}, b""
+
+
+class UsuarioVirtual:
+    """Estado de um usuário simulado: cliente, token, ETags e medidas."""
+
+    def __init__(self, indice: int, cliente: Any, catalogo: List[Tuple[int, str]], semente: int) -> None:
+        self.email = EMAIL_BENCH.format(indice)
+        self.cliente = cliente
+        self.catalogo = catalogo
+        self.rng = random.Random(semente * 1000 + indice)
+        self.token: Optional[str] = None
+        self.etags: Dict[str, str] = {}
+        self.medidas: List[Medida] = []
+        self.registrar = True
+
+    def chamar(self, rotulo: str, metodo: str, caminho: str, corpo: Any = None,
+               autenticado: bool = False, condicional: bool = False) -> Tuple[int, Any]:
+        cabecalhos: Dict[str, str] = {}
+        if autenticado and self.token:
+            cabecalhos["Authorization"] = f"Bearer {self.token}"
+        if condicional and caminho in self.etags:
+            # Como um navegador revalidando o que já tem em cache
+            cabecalhos["If-None-Match"] = self.etags[caminho]
+        inicio = time.perf_counter()
+        status, resposta, dados = self.cliente.requisitar(metodo, caminho, corpo, cabecalhos)
+        duracao = time.perf_counter() - inicio
+        if self.registrar:
+            self.medidas.append((rotulo, duracao, status))
+        if condicional and status == 200 and resposta.get("ETag"):
+            self.etags[caminho] = resposta["ETag"]
+        try:
+            return status, json.loads(dados) if dados and status != 304 else None
+        except ValueError:
+            return status, None
+
+    def garantir_login(self) -> bool:
+        if self.token is None:
+            self.logar()
+        return self.token is not None
+
+    def logar(self) -> None:
+        status, dados = self.chamar("POST /api/login", "POST", "/api/login",
+                                    {"email": self.email, "senha": SENHA_BENCH})
+        if status == 200 and dados:
+            self.token = dados["token"]
+
+    def sortear_item(self) -> Tuple[int, str]:
+        # Popularidade concentrada: poucos produtos recebem a maior parte dos acessos
+        indice = min(int(self.rng.paretovariate(1.2)) - 1, len(self.catalogo) - 1)
+        return self.catalogo[indice]
+
+
+def cenario_navegacao(u: UsuarioVirtual) -> None:
+    u.chamar("GET /api/produtos", "GET", "/api/produtos?limit=24", condicional=True)
+    for _ in range(u.rng.randint(1, 3)):
+        produto_id, _ = u.sortear_item()
+        u.chamar("GET /api/produtos/<id>", "GET", f"/api/produtos/{produto_id}", condicional=True)
+        u.chamar("GET /api/produtos/<id>/tamanhos", "GET", f"/api/produtos/{produto_id}/tamanhos", condicional=True)
+
+
+def cenario_login(u: UsuarioVirtual) -> None:
+    u.logar()
+
+
+def cenario_carrinho(u: UsuarioVirtual) -> None:
+    if not u.garantir_login():
+        return
+    produto_id, tamanho = u.sortear_item()
+    u.chamar("POST /api/carrinho/adicionar", "POST", "/api/carrinho/adicionar",
+             {"produto_id": produto_id, "tamanho": tamanho, "quantidade": 1}, autenticado=True)
+    u.chamar("GET /api/carrinho", "GET", "/api/carrinho", autenticado=True, condicional=True)
+
+
+def cenario_compra(u: UsuarioVirtual) -> None:
+    cenario_carrinho(u)
+    if u.token:
+        u.chamar("POST /api/pedidos/finalizar", "POST", "/api/pedidos/finalizar",
+                 {"metodo_pagamento": "pix"}, autenticado=True)
+
+
+def cenario_historico(u: UsuarioVirtual) -> None:
+    if u.garantir_login():
+        u.chamar("GET /api/pedidos", "GET", "/api/pedidos?limit=10", autenticado=True, condicional=True)
+
+
+CENARIOS: Dict[str, Callable[[UsuarioVirtual], None]] = {
+    "navegacao": cenario_navegacao,
+    "login": cenario_login,
+    "carrinho": cenario_carrinho,
+    "compra": cenario_compra,
+    "historico": cenario_historico,
+}
+
+
+def preparar_banco(origem: Optional[str], usuarios: int) -> str:
+    """Cópia temporária do banco com estoque alto e os usuários de benchmark."""
+    pasta = tempfile.mkdtemp(prefix="dyva-bench-")
+    destino = os.path.join(pasta, "bench.db")
+    if origem:
+        # backup() copia um banco em WAL de forma consistente
+        with closing(sqlite3.connect(origem)) as de, closing(sqlite3.connect(destino)) as para:
+            de.backup(para)
+    banco.ARQUIVO_DB = destino
+    banco.fechar_pool()
+    banco.inicializar_banco()
+    banco.criar_admin_e_produtos()
+    senha_hash = senhas.calcular_hash(SENHA_BENCH)
+    with banco.transacao() as conn:
+        conn.execute("UPDATE produtos_tamanhos SET estoque = ?", (ESTOQUE_BENCH,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO usuarios (nome, email, senha_hash, role) VALUES (?, ?, ?, 'user')",
+            [(f"Bench {i}", EMAIL_BENCH.format(i), senha_hash) for i in range(usuarios)],
+        )
+    return destino
+
+
+def carregar_catalogo() -> List[Tuple[int, str]]:
+    with banco.conexao() as conn:
+        linhas = conn.execute(
+            "SELECT t.produto_id, t.tamanho FROM produtos_tamanhos t JOIN produtos p ON p.id = t.produto_id "
+            "WHERE p.ativo = 1 ORDER BY t.produto_id, t.tamanho"
+        ).fetchall()
+    return [(r[0], r[1]) for r in linhas]
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100.0 * len(ordenados))) - 1))]
+
+
+def resumir(medidas: List[Medida], segundos: float) -> Dict[str, Any]:
+    por_rotulo: Dict[str, List[Medida]] = {}
+    for medida in medidas:
+        por_rotulo.setdefault(medida[0], []).append(medida)
+    endpoints = {}
+    for rotulo, lista in sorted(por_rotulo.items()):
+        tempos = sorted(m[1] for m in lista)
+        status: Dict[str, int] = {}
+        for m in lista:
+            status[str(m[2])] = status.get(str(m[2]), 0) + 1
+        endpoints[rotulo] = {
+            "n": len(lista),
+            "req_s": round(len(lista) / segundos, 2),
+            "p50_ms": round(percentil(tempos, 50) * 1000, 3),
+            "p95_ms": round(percentil(tempos, 95) * 1000, 3),
+            "p99_ms": round(percentil(tempos, 99) * 1000, 3),
+            "max_ms": round(tempos[-1] * 1000, 3),
+            "erros": sum(1 for m in lista if m[2] == 0 or m[2] >= 500),
+            "status": status,
+        }
+    return {
+        "total": {
+            "n": len(medidas),
+            "req_s": round(len(medidas) / segundos, 2),
+            "erros": sum(e["erros"] for e in endpoints.values()),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def executar(app: Any, modo: str, mistura: Dict[str, int], concorrencia: int, segundos: float,
+             aquecimento: float, semente: int) -> Dict[str, Any]:
+    servidor = None
+    if modo == "servidor":
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class HandlerSilencioso(WSGIRequestHandler):
+            def log_request(self, *args: Any, **kwargs: Any) -> None:
+                pass
+
+        servidor = make_server("127.0.0.1", 0, app, threaded=True, request_handler=HandlerSilencioso)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    def novo_cliente() -> Any:
+        return ClienteHTTP("127.0.0.1", servidor.server_port) if servidor else ClienteTeste(app)
+
+    catalogo = carregar_catalogo()
+    nomes = list(mistura)
+    pesos = [mistura[n] for n in nomes]
+    usuarios = [UsuarioVirtual(i, novo_cliente(), catalogo, semente) for i in range(concorrencia)]
+    inicio_medicao = time.perf_counter() + aquecimento
+    fim = inicio_medicao + segundos
+
+    def rodar(u: UsuarioVirtual) -> None:
+        u.registrar = False
+        while True:
+            agora = time.perf_counter()
+            if agora >= fim:
+                break
+            u.registrar = agora >= inicio_medicao
+            CENARIOS[u.rng.choices(nomes, pesos)[0]](u)
+
+    threads = [threading.Thread(target=rodar, args=(u,)) for u in usuarios]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio_medicao
+    if servidor:
+        servidor.shutdown()
+    return resumir([m for u in usuarios for m in u.medidas], duracao)
+
+
+def versao_codigo() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def comparar(atual: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Regressões de ``atual`` em relação a ``base`` acima da tolerância."""
+    regressoes = []
+    total_base, total_atual = base["total"]["req_s"], atual["total"]["req_s"]
+    if total_base and total_atual < total_base * (1 - tolerancia):
+        regressoes.append(f"vazão total {total_atual:.1f} req/s < base {total_base:.1f} req/s")
+    for rotulo, dados in atual["endpoints"].items():
+        anterior = base["endpoints"].get(rotulo)
+        if anterior and anterior["p95_ms"] and dados["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regressoes.append(f"{rotulo}: p95 {dados['p95_ms']:.1f}ms > base {anterior['p95_ms']:.1f}ms")
+        if anterior is not None and dados["erros"] > anterior["erros"]:
+            regressoes.append(f"{rotulo}: {dados['erros']} erros (base {anterior['erros']})")
+    return regressoes
+
+
+def imprimir(resultado: Dict[str, Any], base: Optional[Dict[str, Any]]) -> None:
+    print(f"{'endpoint':<34} {'n':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}"
+          + (f" {'Δp95':>7}" if base else ""))
+    for rotulo, d in resultado["endpoints"].items():
+        linha = (f"{rotulo:<34} {d['n']:>7} {d['req_s']:>8.1f} {d['p50_ms']:>8.2f} "
+                 f"{d['p95_ms']:>8.2f} {d['p99_ms']:>8.2f} {d['erros']:>6}")
+        anterior = base["endpoints"].get(rotulo) if base else None
+        if anterior and anterior["p95_ms"]:
+            linha += f" {(d['p95_ms'] / anterior['p95_ms'] - 1) * 100:>+6.0f}%"
+        print(linha)
+    total = resultado["total"]
+    print(f"{'TOTAL':<34} {total['n']:>7} {total['req_s']:>8.1f} {'':>8} {'':>8} {'':>8} {total['erros']:>6}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark HTTP por cenários da API da DYVA.")
+    parser.add_argument("--modo", choices=("cliente", "servidor"), default="cliente")
+    parser.add_argument("--mistura", choices=sorted(MISTURAS), default="misto")
+    parser.add_argument("--concorrencia", type=int, default=8, help="usuários virtuais (threads)")
+    parser.add_argument("--segundos", type=float, default=20.0, help="duração da medição")
+    parser.add_argument("--aquecimento", type=float, default=2.0, help="segundos iniciais fora da medição")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--banco", help="banco de origem (copiado; padrão: banco novo com os produtos iniciais)")
+    parser.add_argument("--saida", help="grava o resultado em JSON")
+    parser.add_argument("--base", help="resultado JSON anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="piora aceita antes de acusar regressão")
+    args = parser.parse_args(argv)
+
+    base = None
+    if args.base:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+
+    caminho = preparar_banco(args.banco, args.concorrencia)
+    import app as aplicacao
+
+    app = aplicacao.criar_app()
+    print(f"🏁 modo={args.modo} mistura={args.mistura} concorrência={args.concorrencia} "
+          f"{args.segundos}s (+{args.aquecimento}s de aquecimento)")
+    try:
+        resultado = executar(app, args.modo, MISTURAS[args.mistura], args.concorrencia,
+                             args.segundos, args.aquecimento, args.semente)
+    finally:
+        banco.parar_coletor_reservas()
+        banco.fechar_pool()
+        senhas.fechar_pool()
+        shutil.rmtree(os.path.dirname(caminho), ignore_errors=True)
+
+    resultado.update({
+        "quando": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "versao": versao_codigo(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "parametros": {k: getattr(args, k) for k in ("modo", "mistura", "concorrencia", "segundos", "semente", "banco")},
+    })
+    imprimir(resultado, base)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultado gravado em {args.saida}")
+
+    if base is not None:
+        if base.get("parametros", {}).get("modo") != args.modo or base.get("parametros", {}).get("mistura") != args.mistura:
+            print("⚠️  A base foi medida com outro modo/mistura; a comparação pode não fazer sentido")
+        regressoes = comparar(resultado, base, args.tolerancia)
+        if regressoes:
+            print(f"❌ {len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}:")
+            for r in regressoes:
+                print(f"   - {r}")
+            return 1
+        print(f"✅ Sem regressões acima de {args.tolerancia:.0%} em relação à base")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# Micro-benchmark da serialização da vitrine: dicts + json x orjson x JSON do SQLite
+#
+# Uso: python bench_json.py [--produtos 10000] [--repeticoes 20] [--tamanhos] [--banco dyva.db]
+#
+# Mede, sobre o payload de GET /api/produtos (catálogo inteiro), o caminho
+# antigo (sqlite3.Row -> dict -> json da biblioteca padrão com chaves
+# ordenadas, como o provedor padrão do Flask), dicts com orjson e o caminho
+# novo (objetos montados pelo SQLite com json_object e colados pelo provedor),
+# além do gzip e de uma página cheia da rota (limit=PRODUTOS_POR_PAGINA_MAX)
+# pelo test client, com e sem Accept-Encoding.
+# Sem --banco, gera um banco temporário com gerar_dados.py.
+import argparse
+import gc
+import gzip
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import Any, Callable, List, Optional, Tuple
+
+os.environ.setdefault("DYVA_LOG_NIVEL", "WARNING")
+
+import banco
+import gerar_dados
+import json_rapido
+
+
+def medir(funcao: Callable[[], Any], repeticoes: int) -> Tuple[float, float, Any]:
+    """(mediana em ms, mínimo em ms, último resultado), depois de um aquecimento."""
+    resultado = funcao()
+    # O lixo dos casos anteriores (milhares de dicts) não entra na conta deste
+    gc.collect()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos), min(tempos), resultado
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mede a serialização do catálogo em JSON e o gzip.")
+    parser.add_argument("--produtos", type=int, default=10_000, help="produtos do banco gerado (padrão 10000)")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--tamanhos", action="store_true", help="inclui os tamanhos de cada produto (?incluir=tamanhos)")
+    parser.add_argument("--banco", help="banco existente (só leitura); sem ele, gera um temporário")
+    args = parser.parse_args(argv)
+
+    if args.banco:
+        banco.ARQUIVO_DB = args.banco
+    else:
+        destino = os.path.join(tempfile.mkdtemp(prefix="dyva-bench-json-"), "bench.db")
+        print(f"🎲 Gerando banco com {args.produtos} produtos em {destino}...")
+        gerar_dados.gerar(destino, semente=42, produtos=args.produtos, usuarios=1000, linhas_pedido=10_000,
+                          ate=date(2025, 12, 31), dias=90)
+
+    # O app só depois de apontar o banco (criar_app aplica as migrações)
+    import app as aplicacao
+
+    app = aplicacao.criar_app(inicializar=False)
+    padrao = json_rapido.ProvedorJSONPadrao(app)
+    rapido = json_rapido.ProvedorJSONRapido(app) if json_rapido.orjson is not None else None
+    filtros = {"incluir_tamanhos": args.tamanhos}
+    linhas: List[Tuple[str, float, float, Optional[int]]] = []
+
+    def registrar(nome: str, funcao: Callable[[], Any]) -> Any:
+        mediana, minimo, resultado = medir(funcao, args.repeticoes)
+        tamanho = len(resultado) if isinstance(resultado, (bytes, str)) else None
+        linhas.append((nome, mediana, minimo, tamanho))
+        return resultado
+
+    with app.app_context():
+        def antes() -> bytes:
+            return padrao.dumps(banco.consultar_catalogo(**filtros)).encode("utf-8")
+
+        def novo(provedor: Any) -> Callable[[], bytes]:
+            def serializar() -> bytes:
+                itens, cursor = banco.consultar_catalogo_json(**filtros)
+                objeto = {"itens": json_rapido.JSONPronto(itens), "proximo_cursor": cursor}
+                return provedor.codificar(objeto) if provedor is rapido else provedor.dumps(objeto).encode("utf-8")
+            return serializar
+
+        registrar("só a consulta (Row)", lambda: banco.consultar_catalogo(**filtros) and b"")
+        payload = registrar("antes: dicts + json padrão", antes)
+        if rapido is not None:
+            registrar("dicts + orjson", lambda: rapido.codificar(banco.consultar_catalogo(**filtros)))
+            payload = registrar("json_object + orjson (novo)", novo(rapido))
+        registrar("json_object + json padrão", novo(padrao))
+        registrar(f"gzip nível {aplicacao.GZIP_NIVEL} do payload", lambda: gzip.compress(payload, aplicacao.GZIP_NIVEL))
+
+    cliente = app.test_client()
+    caminho = f"/api/produtos?limit={aplicacao.PRODUTOS_POR_PAGINA_MAX}" + ("&incluir=tamanhos" if args.tamanhos else "")
+    registrar(f"rota {caminho} sem gzip", lambda: cliente.get(caminho).data)
+    registrar(f"rota {caminho} com gzip", lambda: cliente.get(caminho, headers={"Accept-Encoding": "gzip"}).data)
+    aplicacao.encerrar_app()
+
+    print(f"\n📦 {args.produtos} produtos | {args.repeticoes} repetições | provedor do app: {type(app.json).__name__}")
+    print(f"{'caso':<42} {'mediana':>9} {'mínimo':>9} {'bytes':>10}")
+    base = linhas[1][1]
+    for nome, mediana, minimo, tamanho in linhas:
+        ganho = f"  ({base / mediana:.1f}x)" if mediana and nome != linhas[1][0] and not nome.startswith(("só", "gzip", "rota")) else ""
+        print(f"{nome:<42} {mediana:>7.1f}ms {minimo:>7.1f}ms {tamanho if tamanho else '':>10}{ganho}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# Benchmark do hash de senhas: logins/s por núcleo em cada custo do scrypt
+#
+# Uso: python bench_senhas.py [--custos 12 13 14 15] [--segundos 3] [--processos N]
+#
+# Para cada custo (log2 de n) mede a conferência de senha numa thread só
+# (logins/s em um núcleo) e no PoolSenhas com N processos (vazão total e por
+# núcleo). Serve para escolher DYVA_SENHA_SCRYPT_N de acordo com a máquina.
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import senhas
+
+SENHA = "senha-de-benchmark"
+
+
+def medir_serial(senha_hash: str, segundos: float) -> float:
+    feitas = 0
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < segundos:
+        senhas.conferir_hash(SENHA, senha_hash)
+        feitas += 1
+    return feitas / (time.perf_counter() - inicio)
+
+
+def medir_pool(pool: senhas.PoolSenhas, senha_hash: str, segundos: float, clientes: int) -> float:
+    feitas = [0] * clientes
+    fim = time.perf_counter() + segundos
+
+    def cliente(i: int) -> None:
+        while time.perf_counter() < fim:
+            pool.verificar(SENHA, senha_hash)
+            feitas[i] += 1
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(feitas) / (time.perf_counter() - inicio)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mede logins/s por núcleo para cada custo do scrypt.")
+    parser.add_argument("--custos", type=int, nargs="+", default=[12, 13, 14, 15], help="log2 de n (padrão 12 13 14 15)")
+    parser.add_argument("--r", type=int, default=senhas.SCRYPT_R)
+    parser.add_argument("--p", type=int, default=senhas.SCRYPT_P)
+    parser.add_argument("--segundos", type=float, default=3.0, help="duração de cada medição")
+    parser.add_argument("--processos", type=int, default=os.cpu_count() or 1, help="processos do pool")
+    args = parser.parse_args(argv)
+
+    print(f"🔐 scrypt r={args.r} p={args.p} | pool com {args.processos} processos | {args.segundos}s por medição")
+    print(f"{'n':>8} {'memória':>9} {'ms/login':>9} {'login/s (1 núcleo)':>19} {'login/s (pool)':>15} {'por núcleo':>11}")
+    for expoente in args.custos:
+        n = 2 ** expoente
+        custo = (n, args.r, args.p)
+        senha_hash = senhas.calcular_hash(SENHA, *custo)
+        serial = medir_serial(senha_hash, args.segundos)
+        pool = senhas.PoolSenhas(processos=args.processos, custo=custo)
+        try:
+            pool.verificar(SENHA, senha_hash)  # sobe os processos antes de medir
+            total = medir_pool(pool, senha_hash, args.segundos, clientes=args.processos * 2)
+        finally:
+            pool.fechar()
+        memoria = 128 * n * args.r / (1024 * 1024)
+        print(
+            f"{n:>8} {memoria:>7.0f}MB {1000 / serial:>9.1f} {serial:>19.1f} "
+            f"{total:>15.1f} {total / max(1, args.processos):>11.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class CacheLRU:
+    """Cache em memória, thread-safe, limitado por capacidade (LRU) e com TTL.
+
+    ``None`` é um valor válido e fica guardado com ``ttl_negativo`` (cache
+    negativo), para que consultas repetidas por chaves inexistentes também
+    evitem o banco. O cache é por processo: outros processos só enxergam uma
+    alteração quando a entrada expira.
+    """
+
+    def __init__(self, capacidade: int = 10000, ttl: float = 60.0, ttl_negativo: Optional[float] = None) -> None:
+        self.capacidade = max(1, int(capacidade))
+        self.ttl = float(ttl)
+        self.ttl_negativo = float(ttl if ttl_negativo is None else ttl_negativo)
+        self._itens: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.expirados = 0
+        self.removidos = 0
+
+    def obter(self, chave: Hashable) -> Tuple[bool, Any]:
+        """Retorna ``(encontrado, valor)``; entradas vencidas contam como falha."""
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                expira_em, valor = item
+                if expira_em > agora:
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    return True, valor
+                del self._itens[chave]
+                self.expirados += 1
+            self.falhas += 1
+            return False, None
+
+    def guardar(self, chave: Hashable, valor: Any) -> None:
+        ttl = self.ttl_negativo if valor is None else self.ttl
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+                self.removidos += 1
+
+    def invalidar(self, chave: Hashable) -> None:
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "tamanho": len(self._itens),
+                "capacidade": self.capacidade,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "expirados": self.expirados,
+                "removidos": self.removidos,
+                "taxa_acerto": (self.acertos / total) if total else 0.0,
+            }
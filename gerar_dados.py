@@ -0,0 +1,414 @@
+# Gerador de dados sintéticos em escala real (catálogo, clientes e vendas)
+#
+# Uso: python gerar_dados.py destino.db [--escala completa|media|pequena] [--semente 42]
+#                            [--produtos N] [--usuarios N] [--linhas-pedido N] [--ate AAAA-MM-DD]
+#
+# A escala completa gera 100 mil produtos com tamanhos, 1 milhão de clientes
+# (com carrinhos e favoritos) e 10 milhões de linhas de pedido em dois anos.
+# A popularidade é concentrada (poucos produtos vendem muito), as vendas têm
+# sazonalidade (Dia das Mães, Black Friday, Natal), crescem ao longo do
+# período e se concentram à noite.
+#
+# Carga em massa: PRAGMAs relaxados (sem journal, sem fsync), executemany em
+# lotes grandes, índices e triggers recriados só depois da carga, e no fim
+# reconstrução da busca FTS5, dos resumos de vendas e das estatísticas do
+# planejador (ANALYZE). Com a mesma semente e os mesmos parâmetros (inclusive
+# --ate) o banco gerado é sempre o mesmo.
+#
+# Todos os clientes gerados usam a senha "senha123". O admin padrão
+# (admin@dyva.com / 123456) também é criado.
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import banco
+from senhas import calcular_hash
+
+SENHA_CLIENTES = "senha123"
+TAMANHO_LOTE = 50_000
+
+ESCALAS: Dict[str, Dict[str, int]] = {
+    "completa": {"produtos": 100_000, "usuarios": 1_000_000, "linhas_pedido": 10_000_000},
+    "media": {"produtos": 10_000, "usuarios": 100_000, "linhas_pedido": 1_000_000},
+    "pequena": {"produtos": 1_000, "usuarios": 10_000, "linhas_pedido": 100_000},
+}
+
+# PRAGMAs só para a carga: sem journal nem fsync (um erro no meio exige gerar de novo)
+PRAGMAS_CARGA = (
+    ("journal_mode", "OFF"),
+    ("synchronous", "OFF"),
+    ("locking_mode", "EXCLUSIVE"),
+    ("cache_size", -512 * 1024),
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "OFF"),
+)
+
+# Categoria: (peso no catálogo, preço base, tamanhos, nome da peça)
+CATEGORIAS: Dict[str, Tuple[int, float, Tuple[str, ...], str]] = {
+    "Vestidos": (16, 189.9, ("PP", "P", "M", "G", "GG"), "Vestido"),
+    "Blusas": (14, 79.9, ("PP", "P", "M", "G", "GG"), "Blusa"),
+    "Croppeds": (10, 69.9, ("PP", "P", "M", "G"), "Cropped"),
+    "Saias": (9, 109.9, ("PP", "P", "M", "G", "GG"), "Saia"),
+    "Calças": (10, 159.9, ("PP", "P", "M", "G", "GG"), "Calça"),
+    "Shorts": (8, 89.9, ("PP", "P", "M", "G", "GG"), "Short"),
+    "Macaquinhos": (6, 139.9, ("P", "M", "G"), "Macaquinho"),
+    "Conjuntos": (6, 219.9, ("P", "M", "G"), "Conjunto"),
+    "Jaquetas": (5, 259.9, ("P", "M", "G", "GG"), "Jaqueta"),
+    "Bodies": (5, 74.9, ("PP", "P", "M", "G"), "Body"),
+    "Moda Praia": (6, 119.9, ("PP", "P", "M", "G"), "Biquíni"),
+    "Acessórios": (5, 49.9, ("U",), "Bolsa"),
+}
+ESTILOS = ("Floral", "Básica", "Midi", "Canelada", "Linho", "Alfaiataria", "Estampada", "Tricô", "Cetim",
+           "Jeans", "Oversized", "Plissada", "Listrada", "Poá", "Tie-dye", "Crochê", "Veludo", "Malha")
+CORES = ("Preta", "Branca", "Rosa", "Nude", "Verde", "Azul", "Vermelha", "Caramelo", "Lilás", "Off-white",
+         "Amarela", "Terracota", "Vinho", "Cinza", "Marinho")
+NOMES = ("Ana", "Maria", "Júlia", "Beatriz", "Larissa", "Camila", "Fernanda", "Gabriela", "Letícia", "Mariana",
+         "Amanda", "Bruna", "Carolina", "Isabela", "Luana", "Patrícia", "Rafaela", "Sofia", "Vitória", "Yasmin")
+SOBRENOMES = ("Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Rodrigues", "Almeida",
+              "Nascimento", "Carvalho", "Araújo", "Ribeiro", "Gomes", "Martins", "Rocha", "Barbosa", "Melo")
+METODOS_PAGAMENTO = (("pix", 55), ("cartao", 38), ("boleto", 7))
+
+# Sazonalidade por mês (jan..dez) e concentração das compras por hora do dia
+PESO_MES = (0.85, 0.75, 0.9, 0.9, 1.35, 1.0, 0.9, 1.0, 0.95, 1.0, 1.8, 1.6)
+PESO_HORA = (2, 1, 1, 1, 1, 1, 2, 3, 4, 5, 6, 6, 7, 7, 6, 6, 6, 7, 8, 10, 11, 11, 9, 5)
+
+
+def acumulados(pesos: Iterable[float]) -> List[float]:
+    return list(itertools.accumulate(pesos))
+
+
+def pesos_zipf(n: int, expoente: float) -> List[float]:
+    """Pesos acumulados de uma lei de potência: o item de posto k pesa 1/k^s."""
+    return acumulados(1.0 / (k ** expoente) for k in range(1, n + 1))
+
+
+def em_lotes(linhas: Iterable[Sequence[Any]], tamanho: int = TAMANHO_LOTE) -> Iterator[List[Sequence[Any]]]:
+    iterador = iter(linhas)
+    while True:
+        lote = list(itertools.islice(iterador, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+class Gerador:
+    """Gera e grava as tabelas numa conexão em modo de carga."""
+
+    def __init__(self, conn: sqlite3.Connection, semente: int, produtos: int, usuarios: int,
+                 linhas_pedido: int, ate: date, dias: int) -> None:
+        self.conn = conn
+        self.rng = random.Random(semente)
+        self.n_produtos = produtos
+        self.n_usuarios = usuarios
+        self.n_linhas = linhas_pedido
+        self.ate = ate
+        self.dias = dias
+        # Preenchidos por gerar_produtos: ids por posto de popularidade
+        self.produtos: List[Tuple[str, float, Tuple[str, ...]]] = []
+        self.popularidade: List[int] = []
+        self.acumulado_popularidade: List[float] = []
+
+    def _gravar(self, sql: str, linhas: Iterable[Sequence[Any]]) -> int:
+        total = 0
+        for lote in em_lotes(linhas):
+            self.conn.executemany(sql, lote)
+            total += len(lote)
+        return total
+
+    def sortear_produto(self) -> int:
+        """Produto (índice 0..n-1) segundo a popularidade."""
+        return self.popularidade[bisect.bisect_left(self.acumulado_popularidade,
+                                                    self.rng.random() * self.acumulado_popularidade[-1])]
+
+    # ---- catálogo ----
+
+    def gerar_produtos(self) -> int:
+        rng = self.rng
+        categorias = list(CATEGORIAS)
+        acumulado_categorias = acumulados(CATEGORIAS[c][0] for c in categorias)
+
+        def produtos() -> Iterator[Tuple[Any, ...]]:
+            for i in range(self.n_produtos):
+                categoria = rng.choices(categorias, cum_weights=acumulado_categorias)[0]
+                _, base, tamanhos, peca = CATEGORIAS[categoria]
+                nome = f"{peca} {rng.choice(ESTILOS)} {rng.choice(CORES)}"
+                # Preços "quebrados" como na vitrine: 129.9, 89.9...
+                preco = max(19.9, round(round(base * rng.lognormvariate(0, 0.35)) - 0.1, 2))
+                self.produtos.append((nome, preco, tamanhos))
+                yield (
+                    i + 1, f"DY{i + 1:07d}", nome, categoria, preco, f"https://img.dyva.local/p/{i + 1}.jpg",
+                    0 if rng.random() < 0.03 else 1,
+                    f"{nome} da coleção DYVA, modelagem {rng.choice(('ajustada', 'soltinha', 'reta', 'evasê'))}.",
+                )
+
+        total = self._gravar(
+            "INSERT INTO produtos (id, sku, nome, categoria, preco, imagem, ativo, descricao) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            produtos(),
+        )
+        # Popularidade: lei de potência sobre uma ordem aleatória dos produtos
+        self.popularidade = list(range(self.n_produtos))
+        rng.shuffle(self.popularidade)
+        self.acumulado_popularidade = pesos_zipf(self.n_produtos, 0.95)
+        return total
+
+    def gerar_tamanhos(self) -> int:
+        rng = self.rng
+
+        def tamanhos() -> Iterator[Tuple[Any, ...]]:
+            for i, (_, _, grade) in enumerate(self.produtos):
+                for tamanho in grade:
+                    estoque = 0 if rng.random() < 0.08 else int(rng.expovariate(1 / 25)) + 1
+                    yield i + 1, tamanho, estoque
+
+        return self._gravar("INSERT INTO produtos_tamanhos (produto_id, tamanho, estoque) VALUES (?, ?, ?)", tamanhos())
+
+    # ---- clientes ----
+
+    def gerar_usuarios(self) -> int:
+        rng = self.rng
+        # Um hash só para todos: scrypt de verdade por cliente levaria horas
+        senha_hash = calcular_hash(SENHA_CLIENTES)
+
+        def usuarios() -> Iterator[Tuple[Any, ...]]:
+            for i in range(self.n_usuarios):
+                # e-mails em ordem crescente: o índice UNIQUE cresce só pelo fim
+                yield (f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}", f"cliente{i + 1:08d}@exemplo.dyva",
+                       senha_hash)
+
+        return self._gravar("INSERT INTO usuarios (nome, email, senha_hash, role) VALUES (?, ?, ?, 'user')", usuarios())
+
+    def _itens_distintos(self, quantidade: int) -> List[Tuple[int, str]]:
+        vistos: Dict[Tuple[int, str], None] = {}
+        for _ in range(quantidade * 3):
+            if len(vistos) >= quantidade:
+                break
+            indice = self.sortear_produto()
+            vistos.setdefault((indice, self.rng.choice(self.produtos[indice][2])), None)
+        return list(vistos)
+
+    def gerar_carrinhos(self, fracao: float = 0.05) -> int:
+        rng = self.rng
+
+        def carrinhos() -> Iterator[Tuple[Any, ...]]:
+            for usuario_id in range(1, self.n_usuarios + 1):
+                if rng.random() >= fracao:
+                    continue
+                for indice, tamanho in self._itens_distintos(rng.randint(1, 4)):
+                    yield usuario_id, indice + 1, tamanho, 1 if rng.random() < 0.85 else 2
+
+        return self._gravar(
+            "INSERT INTO carrinhos (usuario_id, produto_id, tamanho, quantidade) VALUES (?, ?, ?, ?)", carrinhos()
+        )
+
+    def gerar_favoritos(self, fracao: float = 0.2) -> int:
+        rng = self.rng
+
+        def favoritos() -> Iterator[Tuple[int, int]]:
+            for usuario_id in range(1, self.n_usuarios + 1):
+                if rng.random() >= fracao:
+                    continue
+                escolhidos = {self.sortear_produto() for _ in range(int(rng.expovariate(1 / 4)) + 1)}
+                for indice in sorted(escolhidos):
+                    yield usuario_id, indice + 1
+
+        return self._gravar("INSERT INTO favoritos (usuario_id, produto_id) VALUES (?, ?)", favoritos())
+
+    # ---- vendas ----
+
+    def _linhas_por_dia(self) -> List[Tuple[date, int]]:
+        """Divide as linhas de pedido entre os dias: sazonalidade, fim de semana e crescimento."""
+        inicio = self.ate - timedelta(days=self.dias - 1)
+        dias = [inicio + timedelta(days=d) for d in range(self.dias)]
+        pesos = [
+            PESO_MES[dia.month - 1] * (1.15 if dia.weekday() >= 5 else 1.0) * (0.7 + 0.6 * d / max(1, self.dias - 1))
+            for d, dia in enumerate(dias)
+        ]
+        soma = sum(pesos)
+        distribuidas = 0
+        resultado = []
+        for d, (dia, peso) in enumerate(zip(dias, pesos)):
+            quantidade = self.n_linhas - distribuidas if d == len(dias) - 1 else round(self.n_linhas * peso / soma)
+            quantidade = max(0, min(quantidade, self.n_linhas - distribuidas))
+            distribuidas += quantidade
+            resultado.append((dia, quantidade))
+        return resultado
+
+    def gerar_pedidos(self) -> Tuple[int, int]:
+        rng = self.rng
+        acumulado_hora = acumulados(PESO_HORA)
+        horas = list(range(24))
+        metodos = [m for m, _ in METODOS_PAGAMENTO]
+        acumulado_metodos = acumulados(p for _, p in METODOS_PAGAMENTO)
+        # Clientes também seguem uma lei de potência: uns poucos compram muito
+        clientes = list(range(1, self.n_usuarios + 1))
+        rng.shuffle(clientes)
+        acumulado_clientes = pesos_zipf(self.n_usuarios, 0.75)
+        total_clientes = acumulado_clientes[-1]
+        pedidos: List[Tuple[Any, ...]] = []
+        itens: List[Tuple[Any, ...]] = []
+        pedido_id = 0
+        n_pedidos = n_itens = 0
+
+        def descarregar() -> None:
+            self.conn.executemany(
+                "INSERT INTO pedidos (id, usuario_id, total, metodo_pagamento, status, criado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                pedidos,
+            )
+            self.conn.executemany(
+                "INSERT INTO pedido_itens (pedido_id, produto_id, nome, preco, tamanho, quantidade) VALUES (?, ?, ?, ?, ?, ?)",
+                itens,
+            )
+            pedidos.clear()
+            itens.clear()
+
+        for dia, linhas in self._linhas_por_dia():
+            # Horários do dia em ordem: ids de pedido crescem junto com criado_em
+            momentos = []
+            restantes = linhas
+            while restantes > 0:
+                tamanho_pedido = min(restantes, 1 + int(rng.expovariate(1 / 1.4)))
+                restantes -= tamanho_pedido
+                segundo = rng.choices(horas, cum_weights=acumulado_hora)[0] * 3600 + rng.randrange(3600)
+                momentos.append((segundo, rng.randrange(1_000_000), tamanho_pedido))
+            momentos.sort()
+            texto_dia = dia.isoformat()
+            for segundo, micro, tamanho_pedido in momentos:
+                pedido_id += 1
+                usuario_id = clientes[bisect.bisect_left(acumulado_clientes, rng.random() * total_clientes)]
+                total = 0.0
+                for indice, tamanho in self._itens_distintos(tamanho_pedido):
+                    nome, preco, _ = self.produtos[indice]
+                    quantidade = 1 if rng.random() < 0.88 else rng.randint(2, 3)
+                    if rng.random() < 0.15:
+                        preco = round(preco * 0.8, 2)  # promoção
+                    total += preco * quantidade
+                    itens.append((pedido_id, indice + 1, nome, preco, tamanho, quantidade))
+                criado_em = f"{texto_dia}T{segundo // 3600:02d}:{segundo // 60 % 60:02d}:{segundo % 60:02d}.{micro:06d}Z"
+                pedidos.append((pedido_id, usuario_id, round(total, 2),
+                                rng.choices(metodos, cum_weights=acumulado_metodos)[0], "Pago", criado_em))
+                if len(itens) >= TAMANHO_LOTE:
+                    n_pedidos += len(pedidos)
+                    n_itens += len(itens)
+                    descarregar()
+        n_pedidos += len(pedidos)
+        n_itens += len(itens)
+        descarregar()
+        return n_pedidos, n_itens
+
+
+def _retirar_indices_e_triggers(conn: sqlite3.Connection) -> List[str]:
+    """Apaga índices secundários e triggers, devolvendo o SQL para recriá-los."""
+    objetos = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ).fetchall()
+    for tipo, nome, _ in objetos:
+        conn.execute(f'DROP {tipo.upper()} "{nome}"')
+    # Índices antes dos triggers, na ordem em que existiam
+    return [sql for tipo, _, sql in objetos if tipo == "index"] + [sql for tipo, _, sql in objetos if tipo == "trigger"]
+
+
+def gerar(destino: str, semente: int, produtos: int, usuarios: int, linhas_pedido: int,
+          ate: date, dias: int) -> None:
+    inicio_total = time.perf_counter()
+    banco.ARQUIVO_DB = destino
+    banco.fechar_pool()
+    banco.inicializar_banco()
+    banco.fechar_pool()
+
+    with closing(sqlite3.connect(destino, isolation_level=None)) as conn:
+        for nome, valor in PRAGMAS_CARGA:
+            conn.execute(f"PRAGMA {nome} = {valor}")
+        recriar = _retirar_indices_e_triggers(conn)
+        gerador = Gerador(conn, semente, produtos, usuarios, linhas_pedido, ate, dias)
+
+        etapas = [
+            ("📦 Produtos", gerador.gerar_produtos),
+            ("📏 Tamanhos", gerador.gerar_tamanhos),
+            ("👤 Clientes", gerador.gerar_usuarios),
+            ("🛒 Carrinhos", gerador.gerar_carrinhos),
+            ("❤️  Favoritos", gerador.gerar_favoritos),
+            ("🧾 Pedidos e linhas", gerador.gerar_pedidos),
+        ]
+        for rotulo, etapa in etapas:
+            inicio = time.perf_counter()
+            conn.execute("BEGIN")
+            quantidade = etapa()
+            conn.execute("COMMIT")
+            if isinstance(quantidade, tuple):
+                quantidade = " e ".join(map(str, quantidade))
+            print(f"{rotulo}: {quantidade} em {time.perf_counter() - inicio:.1f}s")
+
+        inicio = time.perf_counter()
+        conn.execute("BEGIN")
+        for sql in recriar:
+            conn.execute(sql)
+        conn.execute("COMMIT")
+        print(f"🗂️  Índices e triggers recriados em {time.perf_counter() - inicio:.1f}s")
+
+        inicio = time.perf_counter()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'produtos_busca'").fetchone():
+            conn.execute("INSERT INTO produtos_busca (produtos_busca) VALUES ('rebuild')")
+        # Invalida qualquer ETag de catálogo anterior à carga
+        conn.execute(
+            "INSERT INTO versoes (chave, versao) VALUES ('catalogo', 1) "
+            "ON CONFLICT(chave) DO UPDATE SET versao = versao + 1"
+        )
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        print(f"🔎 Busca textual e estatísticas do planejador em {time.perf_counter() - inicio:.1f}s")
+
+    inicio = time.perf_counter()
+    banco.reconstruir_relatorios()
+    banco.criar_admin_e_produtos()
+    banco.fechar_pool()
+    print(f"📊 Resumos de vendas em {time.perf_counter() - inicio:.1f}s")
+    print(f"✅ Banco {destino} gerado em {time.perf_counter() - inicio_total:.1f}s")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Gera um banco sintético em escala real para testes de carga.")
+    parser.add_argument("destino", help="arquivo do banco a criar (nunca o dyva.db em uso)")
+    parser.add_argument("--escala", choices=sorted(ESCALAS), default="completa")
+    parser.add_argument("--produtos", type=int)
+    parser.add_argument("--usuarios", type=int)
+    parser.add_argument("--linhas-pedido", type=int, dest="linhas_pedido")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--ate", type=date.fromisoformat, default=date.today(),
+                        help="último dia com pedidos (AAAA-MM-DD; padrão: hoje)")
+    parser.add_argument("--dias", type=int, default=730, help="dias de histórico de pedidos")
+    parser.add_argument("--forcar", action="store_true", help="sobrescreve o destino se existir")
+    args = parser.parse_args(argv)
+
+    if os.path.abspath(args.destino) == os.path.abspath(banco.ARQUIVO_DB):
+        print("❌ O destino não pode ser o banco da aplicação")
+        return 2
+    if os.path.exists(args.destino):
+        if not args.forcar:
+            print(f"❌ {args.destino} já existe (use --forcar para sobrescrever)")
+            return 2
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(args.destino + sufixo):
+                os.remove(args.destino + sufixo)
+
+    escala = dict(ESCALAS[args.escala])
+    for chave in escala:
+        if getattr(args, chave) is not None:
+            escala[chave] = getattr(args, chave)
+    print(f"🎲 semente={args.semente} produtos={escala['produtos']} usuarios={escala['usuarios']} "
+          f"linhas de pedido={escala['linhas_pedido']} até {args.ate} ({args.dias} dias)")
+    gerar(args.destino, args.semente, escala["produtos"], escala["usuarios"], escala["linhas_pedido"],
+          args.ate, args.dias)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
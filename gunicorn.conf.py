@@ -0,0 +1,78 @@
+# Perfil de produção do Dyva: gunicorn -c gunicorn.conf.py wsgi:app (ou python app.py)
+#
+# Workers pré-forkados com threads (gthread). O app não é pré-carregado no
+# master: cada worker importa wsgi.py depois do fork, então nenhuma conexão
+# SQLite é compartilhada entre processos. O master só dispara as migrações.
+#
+# Sinais: HUP recarrega o código trocando os workers aos poucos (as migrações
+# novas rodam antes, em on_reload); TERM encerra esperando as requisições em
+# andamento por até graceful_timeout; TTIN/TTOU somam/tiram um worker.
+import multiprocessing
+import os
+import subprocess
+import sys
+
+_cpus = multiprocessing.cpu_count()
+_pasta = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.environ.get("DYVA_BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+# SQLite tem um único escritor: mais workers que núcleos só aumenta a disputa pelo lock
+workers = int(os.environ.get("DYVA_WORKERS", str(_cpus)))
+# uvicorn.workers.UvicornWorker com asgi:app para o modo assíncrono
+worker_class = os.environ.get("DYVA_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("DYVA_THREADS", "4"))
+preload_app = False
+
+timeout = int(os.environ.get("DYVA_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("DYVA_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("DYVA_KEEPALIVE", "5"))
+# Reciclagem periódica dos workers, com jitter para não reiniciarem juntos
+max_requests = int(os.environ.get("DYVA_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+# O app já registra cada requisição em JSON (logger dyva.acesso)
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("DYVA_GUNICORN_LOG", "info")
+proc_name = "dyva"
+
+# Estado por worker dimensionado pela configuração acima (variáveis explícitas
+# têm precedência). Pool SQLite: uma conexão por thread mais folga para o
+# coletor de reservas. scrypt: os núcleos são divididos entre os workers em vez
+# de cada um abrir um processo por núcleo.
+os.environ.setdefault("DYVA_DB_POOL_TAMANHO", str(threads + 2))
+os.environ.setdefault("DYVA_SENHA_PROCESSOS", str(max(1, _cpus // max(1, workers))))
+# O cache de sessões é por worker: logout e troca de papel num worker só chegam
+# aos outros quando a entrada expira, então o TTL fica curto com vários workers
+if workers > 1:
+    os.environ.setdefault("DYVA_CACHE_SESSOES_TTL", "5")
+
+
+def _migrar(server) -> None:
+    # Em subprocesso: o master não importa o código do app (no HUP as migrações
+    # novas são lidas do disco) e não fica com nenhum arquivo SQLite aberto
+    script = "import banco; banco.inicializar_banco(); banco.criar_admin_e_produtos(); print(banco.ARQUIVO_DB)"
+    resultado = subprocess.run([sys.executable, "-c", script], cwd=_pasta, capture_output=True, text=True)
+    if resultado.returncode != 0:
+        server.log.error("Falha ao preparar o banco:\n%s", resultado.stderr)
+        raise RuntimeError("Falha ao preparar o banco")
+    server.log.info("Banco pronto (%s)", resultado.stdout.strip().splitlines()[-1])
+
+
+def on_starting(server) -> None:
+    """Master, antes do primeiro fork: migrações e dados iniciais uma única vez."""
+    _migrar(server)
+    # Herdado pelos workers: asgi.py não repete as migrações
+    os.environ["DYVA_BANCO_PRONTO"] = "1"
+
+
+def on_reload(server) -> None:
+    """Master, no HUP: aplica migrações do código novo antes de trocar os workers."""
+    _migrar(server)
+
+
+def worker_exit(server, worker) -> None:
+    """Worker saindo (reciclagem, HUP ou TERM): para o coletor e esvazia filas e pools."""
+    import app
+
+    app.encerrar_app()
@@ -0,0 +1,246 @@
+import hashlib
+import io
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # sem Pillow: as imagens já geradas continuam servidas, mas não há upload
+    Image = None
+    ImageOps = None
+
+log = logging.getLogger("dyva.imagens")
+
+# Armazenamento por conteúdo: <pasta>/<2 primeiros>/<sha256>/original.<ext>,
+# com as variantes ao lado (card.jpg, card.webp, ...). O mesmo arquivo enviado
+# duas vezes cai na mesma pasta
+PASTA_IMAGENS = os.environ.get("DYVA_IMAGENS_PASTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "imagens"))
+MAX_BYTES = int(os.environ.get("DYVA_IMAGENS_MAX_BYTES", str(10 * 1024 * 1024)))
+MAX_PIXELS = int(os.environ.get("DYVA_IMAGENS_MAX_PIXELS", "40000000"))
+
+# Lado maior de cada variante, em pixels (imagens menores não são ampliadas)
+VARIANTES = {"miniatura": 160, "card": 480, "zoom": 1400}
+VARIANTE_PADRAO = "card"
+# Formato de cada variante: nome no Pillow, Content-Type e opções de gravação.
+# jpg é o formato compatível com tudo; webp o moderno, escolhido pelo Accept
+FORMATOS_VARIANTE = {
+    "jpg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 6}),
+}
+# Formatos aceitos no upload -> extensão do original
+FORMATOS_ORIGINAL = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+TIPOS_ORIGINAL = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+_RE_HASH = re.compile(r"^[0-9a-f]{64}$")
+_RE_URL = re.compile(r"^/imagens/([0-9a-f]{64})(?:/|$)")
+
+
+class ImagemInvalida(ValueError):
+    """Arquivo que não é uma imagem aceita (a requisição deve responder 400)."""
+
+
+def disponivel() -> bool:
+    """Verdadeiro se o Pillow está instalado (upload e geração de variantes)."""
+    return Image is not None
+
+
+def hash_valido(hash_imagem: str) -> bool:
+    return bool(_RE_HASH.match(hash_imagem))
+
+
+def pasta_da_imagem(hash_imagem: str) -> str:
+    return os.path.join(PASTA_IMAGENS, hash_imagem[:2], hash_imagem)
+
+
+def url_imagem(hash_imagem: str, variante: str = VARIANTE_PADRAO) -> str:
+    """URL gravada em ``produtos.imagem``; o formato sai do Accept do navegador."""
+    return f"/imagens/{hash_imagem}/{variante}"
+
+
+def hash_da_url(url: Optional[str]) -> Optional[str]:
+    """Hash de uma URL local (``/imagens/<hash>/...``); ``None`` para URLs externas."""
+    encontrado = _RE_URL.match(url or "")
+    return encontrado.group(1) if encontrado else None
+
+
+def _gravar_atomico(caminho: str, dados: bytes) -> None:
+    # Arquivo temporário na mesma pasta + rename: quem lê nunca vê um arquivo pela metade
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+    except BaseException:
+        try:
+            os.unlink(temporario)
+        except OSError:
+            pass
+        raise
+
+
+def caminho_original(hash_imagem: str) -> Optional[str]:
+    pasta = pasta_da_imagem(hash_imagem)
+    for extensao in TIPOS_ORIGINAL:
+        caminho = os.path.join(pasta, f"original.{extensao}")
+        if os.path.exists(caminho):
+            return caminho
+    return None
+
+
+def caminho_variante(hash_imagem: str, variante: str, formato: str) -> str:
+    return os.path.join(pasta_da_imagem(hash_imagem), f"{variante}.{formato}")
+
+
+def _abrir(dados: bytes) -> "Image.Image":
+    try:
+        # verify() confere a estrutura sem decodificar; depois é preciso reabrir
+        with Image.open(io.BytesIO(dados)) as imagem:
+            imagem.verify()
+        imagem = Image.open(io.BytesIO(dados))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ImagemInvalida(f"Imagem inválida: {e}") from None
+    if imagem.format not in FORMATOS_ORIGINAL:
+        raise ImagemInvalida(f"Formato não aceito: {imagem.format} (use JPEG, PNG, WebP ou GIF)")
+    largura, altura = imagem.size
+    if largura * altura > MAX_PIXELS:
+        raise ImagemInvalida(f"Imagem grande demais: {largura}x{altura}")
+    return imagem
+
+
+def salvar_original(dados: bytes) -> Tuple[str, bool]:
+    """Valida e grava o original; ``(hash, nova)``. Se o conteúdo já existe,
+    nada é gravado e ``nova`` é falso."""
+    if Image is None:
+        raise RuntimeError("Pillow não instalado (pip install -r requirements.txt)")
+    if len(dados) > MAX_BYTES:
+        raise ImagemInvalida(f"Arquivo maior que {MAX_BYTES // (1024 * 1024)} MiB")
+    hash_imagem = hashlib.sha256(dados).hexdigest()
+    if caminho_original(hash_imagem) is not None:
+        return hash_imagem, False
+    with _abrir(dados) as imagem:
+        extensao = FORMATOS_ORIGINAL[imagem.format]
+    os.makedirs(pasta_da_imagem(hash_imagem), exist_ok=True)
+    _gravar_atomico(os.path.join(pasta_da_imagem(hash_imagem), f"original.{extensao}"), dados)
+    return hash_imagem, True
+
+
+def variantes_pendentes(hash_imagem: str) -> List[Tuple[str, str]]:
+    return [
+        (variante, formato)
+        for variante in VARIANTES
+        for formato in FORMATOS_VARIANTE
+        if not os.path.exists(caminho_variante(hash_imagem, variante, formato))
+    ]
+
+
+def gerar_variantes(hash_imagem: str) -> int:
+    """Gera as variantes que ainda não existem; devolve quantas foram gravadas."""
+    pendentes = variantes_pendentes(hash_imagem)
+    original = caminho_original(hash_imagem)
+    if not pendentes or original is None or Image is None:
+        return 0
+    with Image.open(original) as aberta:
+        # Fotos de celular vêm deitadas com a rotação só no EXIF
+        imagem = ImageOps.exif_transpose(aberta)
+        imagem.load()
+    if imagem.mode not in ("RGB", "RGBA"):
+        imagem = imagem.convert("RGBA" if "transparency" in imagem.info or imagem.mode in ("LA", "PA") else "RGB")
+    gravadas = 0
+    for variante, formato in pendentes:
+        lado = VARIANTES[variante]
+        reduzida = imagem.copy()
+        reduzida.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+        nome_pillow, _, opcoes = FORMATOS_VARIANTE[formato]
+        if nome_pillow == "JPEG" and reduzida.mode == "RGBA":
+            # JPEG não tem transparência: fundo branco como no site
+            fundo = Image.new("RGB", reduzida.size, (255, 255, 255))
+            fundo.paste(reduzida, mask=reduzida.getchannel("A"))
+            reduzida = fundo
+        saida = io.BytesIO()
+        reduzida.save(saida, nome_pillow, **opcoes)
+        _gravar_atomico(caminho_variante(hash_imagem, variante, formato), saida.getvalue())
+        gravadas += 1
+    return gravadas
+
+
+class GeradorVariantes(threading.Thread):
+    """Thread de fundo que gera as variantes fora do caminho da requisição.
+
+    Cada hash entra na fila uma vez por vez; enquanto não fica pronto, quem
+    pede uma variante recebe o original. Variantes que faltam (ex.: processo
+    reiniciado no meio) são reenfileiradas quando alguém as pede.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="dyva-gerador-imagens", daemon=True)
+        self._fila: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._na_fila: set = set()
+        self._lock = threading.Lock()
+        self.geradas = 0
+        self.falhas = 0
+
+    def enfileirar(self, hash_imagem: str) -> None:
+        with self._lock:
+            if hash_imagem in self._na_fila:
+                return
+            self._na_fila.add(hash_imagem)
+        self._fila.put(hash_imagem)
+
+    def run(self) -> None:
+        while True:
+            hash_imagem = self._fila.get()
+            if hash_imagem is None:
+                return
+            try:
+                self.geradas += gerar_variantes(hash_imagem)
+            except Exception:
+                self.falhas += 1
+                log.exception("erro ao gerar variantes de %s", hash_imagem)
+            finally:
+                with self._lock:
+                    self._na_fila.discard(hash_imagem)
+
+    def parar(self, espera: float = 5.0) -> None:
+        self._fila.put(None)
+        self.join(espera)
+
+    def estatisticas(self) -> Dict[str, int]:
+        return {"fila": self._fila.qsize(), "geradas": self.geradas, "falhas": self.falhas}
+
+
+_gerador: Optional[GeradorVariantes] = None
+_gerador_lock = threading.Lock()
+
+
+def iniciar_gerador() -> Optional[GeradorVariantes]:
+    """Inicia (uma vez por processo) o gerador de variantes; ``None`` sem Pillow."""
+    global _gerador
+    if Image is None:
+        return None
+    with _gerador_lock:
+        if _gerador is None or not _gerador.is_alive():
+            _gerador = GeradorVariantes()
+            _gerador.start()
+        return _gerador
+
+
+def parar_gerador() -> None:
+    global _gerador
+    with _gerador_lock:
+        if _gerador is not None:
+            _gerador.parar()
+            _gerador = None
+
+
+def enfileirar(hash_imagem: str) -> bool:
+    """Pede as variantes ao gerador do processo; falso se não há gerador."""
+    gerador = _gerador
+    if gerador is None:
+        return False
+    gerador.enfileirar(hash_imagem)
+    return True
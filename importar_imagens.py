@@ -0,0 +1,151 @@
+# Importa as imagens dos produtos para o armazenamento local (imagens.py)
+#
+# Uso: python importar_imagens.py [--pasta fotos/] [--baixar] [--simular]
+#
+# A imagem de cada produto vem, nesta ordem: de um arquivo na --pasta com o
+# sku ou o id no nome (DY0000123.jpg, 123.png); de produtos.imagem, se for um
+# caminho de arquivo local; ou, com --baixar, da URL externa em produtos.imagem.
+# As variantes são geradas na hora e produtos.imagem passa a apontar para
+# /imagens/<hash>/card. Produtos que já apontam para uma imagem local só têm
+# as variantes que faltam completadas; rodar de novo é seguro.
+import argparse
+import html
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import banco
+import imagens
+
+EXTENSOES = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+ESPERA_DOWNLOAD = 15.0
+MAX_ERROS_RELATORIO = 1000
+
+
+def indexar_pasta(pasta: Optional[str]) -> Dict[str, str]:
+    """Arquivos de imagem da pasta pelo nome sem extensão, em minúsculas."""
+    if not pasta:
+        return {}
+    indice = {}
+    for nome in sorted(os.listdir(pasta)):
+        base, extensao = os.path.splitext(nome)
+        if extensao.lower() in EXTENSOES:
+            indice.setdefault(base.lower(), os.path.join(pasta, nome))
+    return indice
+
+
+def baixar(url: str) -> bytes:
+    requisicao = urllib.request.Request(url, headers={"User-Agent": "dyva-importar-imagens/1.0"})
+    with urllib.request.urlopen(requisicao, timeout=ESPERA_DOWNLOAD) as resposta:
+        dados = resposta.read(imagens.MAX_BYTES + 1)
+    return dados
+
+
+def origem_da_imagem(produto: Dict[str, Any], indice: Dict[str, str], permitir_download: bool) -> Optional[Tuple[str, str]]:
+    """``(tipo, caminho_ou_url)`` de onde ler a imagem do produto, ou ``None``."""
+    for chave in (produto["sku"], str(produto["id"])):
+        if chave and chave.lower() in indice:
+            return "arquivo", indice[chave.lower()]
+    # criar_produto grava a imagem com html.escape (& vira &amp;)
+    imagem = html.unescape(produto["imagem"] or "").strip()
+    if not imagem:
+        return None
+    if imagem.startswith(("http://", "https://")):
+        return ("url", imagem) if permitir_download else None
+    if os.path.isfile(imagem):
+        return "arquivo", imagem
+    return None
+
+
+def importar_produto(produto: Dict[str, Any], indice: Dict[str, str], permitir_download: bool, simular: bool) -> Tuple[str, str]:
+    """Importa a imagem de um produto; ``(resultado, detalhe)``."""
+    origem = origem_da_imagem(produto, indice, permitir_download)
+    local = imagens.hash_da_url(produto["imagem"])
+    if origem is None and local and imagens.caminho_original(local):
+        geradas = 0 if simular else imagens.gerar_variantes(local)
+        return "local", f"{geradas} variantes completadas"
+    if origem is None:
+        return "sem_origem", produto["imagem"] or ""
+    tipo, endereco = origem
+    if simular:
+        return "importada", f"{tipo}: {endereco}"
+    if tipo == "url":
+        dados = baixar(endereco)
+    else:
+        with open(endereco, "rb") as f:
+            dados = f.read()
+    hash_imagem, nova = imagens.salvar_original(dados)
+    imagens.gerar_variantes(hash_imagem)
+    url = imagens.url_imagem(hash_imagem)
+    if produto["imagem"] != url:
+        banco.atualizar_produto(produto["id"], imagem=url)
+    return ("importada" if nova else "repetida"), f"{tipo}: {endereco}"
+
+
+def importar(pasta: Optional[str] = None, permitir_download: bool = False, simular: bool = False,
+             paralelo: int = 4) -> Dict[str, Any]:
+    """Importa as imagens de todos os produtos e devolve um relatório."""
+    inicio = time.perf_counter()
+    indice = indexar_pasta(pasta)
+    with banco.conexao() as conn:
+        produtos = [dict(r) for r in conn.execute("SELECT id, sku, imagem FROM produtos ORDER BY id")]
+
+    def tarefa(produto: Dict[str, Any]) -> Tuple[Dict[str, Any], str, str]:
+        try:
+            return (produto, *importar_produto(produto, indice, permitir_download, simular))
+        except (OSError, imagens.ImagemInvalida) as e:
+            return produto, "erro", str(e)
+
+    contagem = {"importada": 0, "repetida": 0, "local": 0, "sem_origem": 0, "erro": 0}
+    erros: List[Dict[str, Any]] = []
+    # Download e redimensionamento em paralelo (o Pillow solta o GIL ao redimensionar)
+    with ThreadPoolExecutor(max(1, paralelo)) as executor:
+        for produto, resultado, detalhe in executor.map(tarefa, produtos):
+            contagem[resultado] += 1
+            if resultado == "erro" and len(erros) < MAX_ERROS_RELATORIO:
+                erros.append({"produto_id": produto["id"], "sku": produto["sku"], "erro": detalhe})
+    return {
+        "produtos": len(produtos),
+        "importadas": contagem["importada"],
+        "repetidas": contagem["repetida"],
+        "ja_locais": contagem["local"],
+        "sem_origem": contagem["sem_origem"],
+        "com_erro": contagem["erro"],
+        "erros": erros,
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Importa as imagens dos produtos para o armazenamento local.")
+    parser.add_argument("--pasta", help="pasta com arquivos nomeados pelo sku ou id do produto")
+    parser.add_argument("--baixar", action="store_true", help="baixa as URLs externas de produtos.imagem")
+    parser.add_argument("--simular", action="store_true", help="só mostra de onde viria cada imagem")
+    parser.add_argument("--paralelo", type=int, default=4, help="produtos processados ao mesmo tempo (padrão 4)")
+    args = parser.parse_args(argv)
+
+    if not imagens.disponivel():
+        print("❌ Pillow não instalado: pip install -r requirements.txt")
+        return 1
+    if args.pasta and not os.path.isdir(args.pasta):
+        parser.error(f"pasta não encontrada: {args.pasta}")
+
+    banco.inicializar_banco()
+    relatorio = importar(args.pasta, args.baixar, args.simular, args.paralelo)
+    acao = "seriam importadas" if args.simular else "importadas"
+    print(f"✅ {relatorio['importadas']} imagens {acao} ({relatorio['repetidas']} repetidas, "
+          f"{relatorio['ja_locais']} já locais) de {relatorio['produtos']} produtos em {relatorio['segundos']}s")
+    if relatorio["sem_origem"]:
+        print(f"⚠️  {relatorio['sem_origem']} produtos sem origem de imagem (use --pasta ou --baixar)")
+    if relatorio["com_erro"]:
+        print(f"❌ {relatorio['com_erro']} produtos com erro:")
+        for e in relatorio["erros"]:
+            print(f"   produto {e['produto_id']} ({e['sku']}): {e['erro']}")
+    return 1 if relatorio["com_erro"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# Importação em massa de produtos (CSV ou JSONL) em lotes
+#
+# Uso: python importar_produtos.py colecao.csv [--formato csv|jsonl] [--lote 1000]
+#
+# Colunas/campos: sku (obrigatório, chave natural), nome, categoria, preco,
+# imagem, descricao, ativo e tamanhos. Em CSV os tamanhos vão numa coluna só,
+# no formato "PP:10;P:5;M:0"; em JSONL também podem ser uma lista de
+# {"tamanho": "P", "estoque": 5} ou um objeto {"P": 5}.
+import argparse
+import csv
+import html
+import io
+import json
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import banco
+
+TAMANHO_LOTE = 1000
+MAX_ERROS_RELATORIO = 1000
+FORMATOS = ("csv", "jsonl")
+
+
+def detectar_formato(nome_arquivo: str = "", content_type: str = "") -> Optional[str]:
+    nome = (nome_arquivo or "").lower()
+    tipo = (content_type or "").lower()
+    if nome.endswith(".csv") or "csv" in tipo:
+        return "csv"
+    if nome.endswith((".jsonl", ".ndjson")) or "ndjson" in tipo or "jsonl" in tipo:
+        return "jsonl"
+    return None
+
+
+def ler_registros(arquivo: TextIO, formato: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """Lê o arquivo sob demanda: ``(número da linha, registro, erro de leitura)``."""
+    if formato == "csv":
+        leitor = csv.DictReader(arquivo)
+        for registro in leitor:
+            yield leitor.line_num, registro, None
+    elif formato == "jsonl":
+        for numero, texto in enumerate(arquivo, start=1):
+            if not texto.strip():
+                continue
+            try:
+                registro = json.loads(texto)
+            except ValueError:
+                yield numero, None, "JSON inválido"
+                continue
+            if not isinstance(registro, dict):
+                yield numero, None, "Cada linha deve ser um objeto JSON"
+                continue
+            yield numero, registro, None
+    else:
+        raise ValueError(f"Formato não suportado: {formato}")
+
+
+def _texto(valor: Any) -> str:
+    return "" if valor is None else str(valor).strip()
+
+
+def _ler_tamanhos(valor: Any) -> List[Dict[str, Any]]:
+    if valor in (None, ""):
+        return []
+    if isinstance(valor, dict):
+        pares = list(valor.items())
+    elif isinstance(valor, list):
+        pares = [(t.get("tamanho"), t.get("estoque", 0)) for t in valor]
+    else:
+        pares = []
+        for parte in str(valor).split(";"):
+            if not parte.strip():
+                continue
+            tamanho, _, estoque = parte.partition(":")
+            pares.append((tamanho, estoque or 0))
+    tamanhos = []
+    for tamanho, estoque in pares:
+        tamanho = _texto(tamanho)
+        estoque = int(estoque)
+        if not tamanho or len(tamanho) > 10 or estoque < 0:
+            raise ValueError
+        tamanhos.append({"tamanho": tamanho, "estoque": estoque})
+    return tamanhos
+
+
+def validar_registro(registro: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """Aplica as mesmas regras do POST /api/produtos; devolve (produto, erros)."""
+    erros: List[str] = []
+    sku = _texto(registro.get("sku"))
+    nome = _texto(registro.get("nome"))
+    categoria = _texto(registro.get("categoria"))
+    imagem = _texto(registro.get("imagem"))
+    descricao = _texto(registro.get("descricao")) or None
+
+    if not sku:
+        erros.append("sku é obrigatório")
+    elif len(sku) > 64:
+        erros.append("sku deve ter no máximo 64 caracteres")
+    if not nome:
+        erros.append("Nome é obrigatório")
+    elif len(nome) > 100:
+        erros.append("Nome deve ter no máximo 100 caracteres")
+    if len(categoria) > 50:
+        erros.append("Categoria deve ter no máximo 50 caracteres")
+    if descricao and len(descricao) > 1000:
+        erros.append("Descrição deve ter no máximo 1000 caracteres")
+
+    preco = None
+    try:
+        preco = float(str(registro.get("preco")).replace(",", "."))
+        if not 0 < preco <= 999999:
+            erros.append("Preço deve estar entre 0.01 e 999.999")
+    except (ValueError, TypeError):
+        erros.append("Preço inválido")
+
+    ativo_raw = registro.get("ativo", 1)
+    if isinstance(ativo_raw, str):
+        ativo = 0 if ativo_raw.strip().lower() in ("0", "false", "nao", "não", "n") else 1
+    else:
+        ativo = 1 if ativo_raw in (None, "") or bool(ativo_raw) else 0
+
+    tamanhos: List[Dict[str, Any]] = []
+    try:
+        tamanhos = _ler_tamanhos(registro.get("tamanhos"))
+    except (ValueError, TypeError, AttributeError):
+        erros.append("Tamanhos inválidos (use PP:10;P:5)")
+
+    if erros:
+        return None, erros
+    return {
+        "sku": sku,
+        "nome": html.escape(nome),
+        "categoria": html.escape(categoria),
+        "preco": preco,
+        "imagem": html.escape(imagem) if imagem else "",
+        "descricao": html.escape(descricao) if descricao else None,
+        "ativo": ativo,
+        "tamanhos": tamanhos,
+    }, []
+
+
+def importar(arquivo: TextIO, formato: str, tamanho_lote: int = TAMANHO_LOTE) -> Dict[str, Any]:
+    """Lê, valida e grava o arquivo em lotes; devolve o relatório por linha."""
+    inicio = time.perf_counter()
+    relatorio: Dict[str, Any] = {"lidas": 0, "importadas": 0, "com_erro": 0, "erros": [], "erros_omitidos": 0}
+
+    def registrar_erro(linha: int, mensagens: List[str]) -> None:
+        relatorio["com_erro"] += 1
+        if len(relatorio["erros"]) < MAX_ERROS_RELATORIO:
+            relatorio["erros"].append({"linha": linha, "erros": mensagens})
+        else:
+            relatorio["erros_omitidos"] += 1
+
+    lote: List[Dict[str, Any]] = []
+    linhas_lote: List[int] = []
+
+    def gravar_lote() -> None:
+        try:
+            relatorio["importadas"] += banco.importar_lote_produtos(lote)
+        except sqlite3.Error as e:
+            for linha in linhas_lote:
+                registrar_erro(linha, [f"Erro ao gravar lote: {e}"])
+        lote.clear()
+        linhas_lote.clear()
+
+    for linha, registro, erro in ler_registros(arquivo, formato):
+        relatorio["lidas"] += 1
+        if erro:
+            registrar_erro(linha, [erro])
+            continue
+        produto, erros = validar_registro(registro)
+        if erros:
+            registrar_erro(linha, erros)
+            continue
+        lote.append(produto)
+        linhas_lote.append(linha)
+        if len(lote) >= tamanho_lote:
+            gravar_lote()
+    if lote:
+        gravar_lote()
+
+    relatorio["segundos"] = round(time.perf_counter() - inicio, 3)
+    return relatorio
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Importa produtos e tamanhos de um arquivo CSV ou JSONL.")
+    parser.add_argument("arquivo", help="caminho do arquivo (use - para ler da entrada padrão)")
+    parser.add_argument("--formato", choices=FORMATOS, help="padrão: deduzido pela extensão")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE, help=f"linhas por transação (padrão {TAMANHO_LOTE})")
+    args = parser.parse_args(argv)
+
+    formato = args.formato or detectar_formato(args.arquivo)
+    if not formato:
+        parser.error("não foi possível deduzir o formato; informe --formato")
+
+    banco.inicializar_banco()
+    if args.arquivo == "-":
+        entrada = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+        relatorio = importar(entrada, formato, args.lote)
+    else:
+        with open(args.arquivo, encoding="utf-8-sig", newline="") as entrada:
+            relatorio = importar(entrada, formato, args.lote)
+
+    print(f"✅ {relatorio['importadas']} produtos importados de {relatorio['lidas']} linhas em {relatorio['segundos']}s")
+    if relatorio["com_erro"]:
+        print(f"❌ {relatorio['com_erro']} linhas com erro:")
+        for e in relatorio["erros"]:
+            print(f"   linha {e['linha']}: {'; '.join(e['erros'])}")
+        if relatorio["erros_omitidos"]:
+            print(f"   ... e mais {relatorio['erros_omitidos']} linhas")
+    return 1 if relatorio["com_erro"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
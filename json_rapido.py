@@ -0,0 +1,111 @@
+import json
+import os
+import secrets
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele, o provedor padrão do Flask
+    orjson = None
+
+
+class JSONPronto:
+    """Texto JSON já codificado (ex.: montado pelo SQLite com ``json_object``).
+
+    Entra na resposta como está, em qualquer posição do objeto devolvido pela
+    rota: as linhas não passam por dicts nem pelo codificador.
+    """
+
+    __slots__ = ("texto",)
+
+    def __init__(self, texto: str) -> None:
+        self.texto = texto
+
+
+# O codificador escapa \x00 como \u0000, e o sufixo aleatório impede que um
+# texto vindo do usuário imite a marca
+_MARCA = "\x00pronto-" + secrets.token_hex(8) + "-"
+_MARCA_CODIFICADA = "\\u0000" + _MARCA[1:]
+
+
+class _Prontos:
+    """``default`` do codificador: troca cada ``JSONPronto`` por uma marca e,
+    depois da codificação, a marca (com aspas) pelo texto."""
+
+    def __init__(self, padrao: Callable[[Any], Any]) -> None:
+        self.padrao = padrao
+        self.textos: List[str] = []
+
+    def __call__(self, objeto: Any) -> Any:
+        if isinstance(objeto, JSONPronto):
+            self.textos.append(objeto.texto)
+            return f"{_MARCA}{len(self.textos) - 1}"
+        return self.padrao(objeto)
+
+    def substituir(self, saida: Union[str, bytes]) -> Union[str, bytes]:
+        for i, texto in enumerate(self.textos):
+            marca = f'"{_MARCA_CODIFICADA}{i}"'
+            if isinstance(saida, bytes):
+                saida = saida.replace(marca.encode("ascii"), texto.encode("utf-8"), 1)
+            else:
+                saida = saida.replace(marca, texto, 1)
+        return saida
+
+
+class ProvedorJSONPadrao(DefaultJSONProvider):
+    """O provedor do Flask (json da biblioteca padrão) aceitando ``JSONPronto``."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        prontos = _Prontos(kwargs.pop("default", self.default))
+        texto = super().dumps(obj, default=prontos, **kwargs)
+        return prontos.substituir(texto) if prontos.textos else texto
+
+
+class ProvedorJSONRapido(JSONProvider):
+    """Provedor com orjson: codifica direto para bytes, sem ordenar as chaves.
+
+    Datas, Decimal, UUID e afins seguem as regras do provedor padrão do Flask.
+    ``dumps`` com argumentos extras (ex.: ``indent``) cai no json padrão.
+    """
+
+    mimetype = "application/json"
+    opcoes = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+
+    def codificar(self, obj: Any) -> bytes:
+        prontos = _Prontos(DefaultJSONProvider.default)
+        saida = orjson.dumps(obj, default=prontos, option=self.opcoes)
+        return prontos.substituir(saida) if prontos.textos else saida
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            prontos = _Prontos(kwargs.pop("default", DefaultJSONProvider.default))
+            texto = json.dumps(obj, default=prontos, **kwargs)
+            return prontos.substituir(texto) if prontos.textos else texto
+        return self.codificar(obj).decode("utf-8")
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.codificar(obj) + b"\n", mimetype=self.mimetype)
+
+
+PROVEDORES: Dict[str, Type[JSONProvider]] = {"padrao": ProvedorJSONPadrao}
+if orjson is not None:
+    PROVEDORES["orjson"] = ProvedorJSONRapido
+
+# DYVA_JSON escolhe o provedor; sem ela, orjson se estiver instalado
+PROVEDOR_PADRAO = os.environ.get("DYVA_JSON") or ("orjson" if orjson is not None else "padrao")
+
+
+def criar_provedor(app: Any, nome: Optional[str] = None) -> JSONProvider:
+    """Provedor JSON para ``app.json``; ``nome`` é uma chave de ``PROVEDORES``."""
+    nome = nome or PROVEDOR_PADRAO
+    if nome not in PROVEDORES:
+        raise ValueError(f"Provedor JSON indisponível: {nome} (opções: {', '.join(sorted(PROVEDORES))})")
+    return PROVEDORES[nome](app)
@@ -0,0 +1,178 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, TextIO
+
+# Nível padrão e níveis por módulo ("dyva.app=INFO,dyva.banco=WARNING")
+NIVEL_PADRAO = os.environ.get("DYVA_LOG_NIVEL", "INFO")
+NIVEIS_MODULOS = os.environ.get("DYVA_LOG_NIVEIS", "")
+# Fração das linhas DEBUG que são escritas (1.0 = todas)
+AMOSTRA_DEBUG = float(os.environ.get("DYVA_LOG_AMOSTRA_DEBUG", "1.0"))
+# Registros aguardando o escritor; com a fila cheia o registro é descartado
+TAMANHO_FILA = int(os.environ.get("DYVA_LOG_FILA", "10000"))
+
+# Campos nunca escritos nos logs (comparação sem diferenciar maiúsculas)
+CAMPOS_SENSIVEIS = frozenset({
+    "senha", "senha_hash", "password", "token", "authorization", "cookie",
+    "cartao", "numero_cartao", "cvv",
+})
+REDIGIDO = "***"
+
+_request_id: ContextVar[Optional[str]] = ContextVar("dyva_log_request_id", default=None)
+_usuario_id: ContextVar[Optional[int]] = ContextVar("dyva_log_usuario_id", default=None)
+
+
+def definir_contexto(request_id: Optional[str] = None, usuario_id: Optional[int] = None) -> None:
+    """Identificadores anexados a todo registro feito no contexto atual."""
+    _request_id.set(request_id)
+    _usuario_id.set(usuario_id)
+
+
+def definir_usuario(usuario_id: Optional[int]) -> None:
+    _usuario_id.set(usuario_id)
+
+
+def limpar_contexto() -> None:
+    _request_id.set(None)
+    _usuario_id.set(None)
+
+
+def redigir(valor: Any) -> Any:
+    """Cópia de ``valor`` com os campos sensíveis trocados por ``***``."""
+    if isinstance(valor, dict):
+        return {
+            k: REDIGIDO if str(k).lower() in CAMPOS_SENSIVEIS else redigir(v)
+            for k, v in valor.items()
+        }
+    if isinstance(valor, (list, tuple)):
+        return [redigir(v) for v in valor]
+    return valor
+
+
+class FiltroContexto(logging.Filter):
+    """Copia request id e usuário do contexto para o registro.
+
+    Roda na thread que registra (antes da fila), onde os ContextVars valem.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.usuario_id = _usuario_id.get()
+        return True
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar só uma fração ``taxa`` dos registros DEBUG."""
+
+    def __init__(self, taxa: float) -> None:
+        super().__init__()
+        self.taxa = taxa
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.taxa >= 1.0 or random.random() < self.taxa
+
+
+class HandlerFila(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloqueia: com a fila cheia descarta e conta."""
+
+    def __init__(self, fila: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # A mensagem é montada aqui; o traceback vira texto para atravessar a fila
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro: ts, nivel, logger, msg, request_id,
+    usuario_id e os ``campos`` passados em ``extra`` (já redigidos)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            dados["request_id"] = request_id
+        usuario_id = getattr(record, "usuario_id", None)
+        if usuario_id is not None:
+            dados["usuario_id"] = usuario_id
+        campos = getattr(record, "campos", None)
+        if campos:
+            dados.update(redigir(campos))
+        if record.exc_text:
+            dados["erro"] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+_ouvinte: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[HandlerFila] = None
+
+
+def configurar_logs(nivel: Optional[str] = None, niveis: Optional[str] = None, saida: TextIO = sys.stderr,
+                    amostra_debug: Optional[float] = None) -> HandlerFila:
+    """Liga o logger ``dyva``: fila sem bloqueio e uma thread que escreve o JSON.
+
+    Pode ser chamada de novo (ex.: em testes); o escritor anterior é parado.
+    """
+    global _ouvinte, _handler
+    parar_logs()
+    raiz = logging.getLogger("dyva")
+    raiz.setLevel((nivel or NIVEL_PADRAO).upper())
+    raiz.propagate = False
+    for item in (niveis if niveis is not None else NIVEIS_MODULOS).split(","):
+        nome, _, nivel_modulo = item.partition("=")
+        if nome.strip() and nivel_modulo.strip():
+            logging.getLogger(nome.strip()).setLevel(nivel_modulo.strip().upper())
+
+    escritor = logging.StreamHandler(saida)
+    escritor.setFormatter(FormatadorJSON())
+    _handler = HandlerFila(queue.Queue(TAMANHO_FILA))
+    _handler.addFilter(FiltroAmostragem(AMOSTRA_DEBUG if amostra_debug is None else amostra_debug))
+    _handler.addFilter(FiltroContexto())
+    for h in list(raiz.handlers):
+        raiz.removeHandler(h)
+    raiz.addHandler(_handler)
+    _ouvinte = logging.handlers.QueueListener(_handler.queue, escritor, respect_handler_level=False)
+    _ouvinte.start()
+    return _handler
+
+
+def parar_logs() -> None:
+    """Esvazia a fila e para o escritor (chamada também na saída do processo)."""
+    global _ouvinte
+    if _ouvinte is not None:
+        _ouvinte.stop()
+        _ouvinte = None
+
+
+def estatisticas() -> Dict[str, Any]:
+    if _handler is None:
+        return {"fila": 0, "descartados": 0}
+    return {"fila": _handler.queue.qsize(), "descartados": _handler.descartados}
+
+
+atexit.register(parar_logs)
@@ -0,0 +1,166 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Limites (segundos) dos baldes dos histogramas de latência
+BALDES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Limites para contagens pequenas (ex.: comandos SQL por requisição)
+BALDES_CONTAGEM = (1, 2, 5, 10, 20, 50, 100)
+
+Rotulos = Tuple[Tuple[str, str], ...]
+# Coletor chamado na exportação: (nome, rótulos, valor) para métricas calculadas na hora
+Coletor = Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]
+
+
+class _Fragmento:
+    """Valores de uma thread: só ela escreve, então dispensa lock."""
+
+    __slots__ = ("valores", "histogramas")
+
+    def __init__(self) -> None:
+        self.valores: Dict[Tuple[str, Rotulos], float] = {}
+        # [contagem por balde..., contagem acima do último, soma]
+        self.histogramas: Dict[Tuple[str, Rotulos], List[float]] = {}
+
+    def juntar(self, outro: "_Fragmento") -> None:
+        # Cópias antes de iterar: ``outro`` pode ser o fragmento de uma thread
+        # viva, que cria chaves novas enquanto a exportação lê (list() de um
+        # dict roda inteiro sem soltar o GIL)
+        valores = list(outro.valores.items())
+        histogramas = [(chave, list(contagens)) for chave, contagens in list(outro.histogramas.items())]
+        for chave, valor in valores:
+            self.valores[chave] = self.valores.get(chave, 0.0) + valor
+        for chave, contagens in histogramas:
+            atual = self.histogramas.get(chave)
+            if atual is None:
+                self.histogramas[chave] = contagens
+            else:
+                for i, c in enumerate(contagens):
+                    atual[i] += c
+
+
+def _rotulos(rotulos: Dict[str, object]) -> Rotulos:
+    return tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formatar_rotulos(rotulos: Rotulos, extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class RegistroMetricas:
+    """Contadores, gauges e histogramas agregados por thread, exportados no
+    formato texto do Prometheus.
+
+    Cada thread escreve no próprio fragmento, sem lock no caminho da
+    requisição. A exportação soma os fragmentos; os de threads que já
+    terminaram são consolidados e descartados, para que servidores que criam
+    uma thread por requisição não acumulem fragmentos.
+    """
+
+    def __init__(self, baldes: Tuple[float, ...] = BALDES_LATENCIA) -> None:
+        self.baldes = tuple(baldes)
+        self._local = threading.local()
+        self._fragmentos: List[Tuple[threading.Thread, _Fragmento]] = []
+        self._consolidado = _Fragmento()
+        self._lock = threading.Lock()
+        self._declaradas: Dict[str, Tuple[str, str]] = {}
+        self._baldes_por_nome: Dict[str, Tuple[float, ...]] = {}
+        self._coletores: List[Coletor] = []
+
+    def declarar(self, nome: str, tipo: str, ajuda: str, baldes: Optional[Tuple[float, ...]] = None) -> None:
+        """Registra ``# TYPE`` e ``# HELP`` (counter, gauge ou histogram).
+
+        Histogramas usam ``baldes`` se informados, senão os do registro.
+        """
+        self._declaradas[nome] = (tipo, ajuda)
+        if baldes is not None:
+            self._baldes_por_nome[nome] = tuple(baldes)
+
+    def adicionar_coletor(self, coletor: Coletor) -> None:
+        self._coletores.append(coletor)
+
+    def _fragmento(self) -> _Fragmento:
+        fragmento = getattr(self._local, "fragmento", None)
+        if fragmento is None:
+            fragmento = self._local.fragmento = _Fragmento()
+            with self._lock:
+                self._fragmentos.append((threading.current_thread(), fragmento))
+        return fragmento
+
+    def somar(self, nome: str, valor: float = 1.0, **rotulos: object) -> None:
+        """Incrementa um counter (ou soma/subtrai num gauge)."""
+        valores = self._fragmento().valores
+        chave = (nome, _rotulos(rotulos))
+        valores[chave] = valores.get(chave, 0.0) + valor
+
+    def observar(self, nome: str, valor: float, **rotulos: object) -> None:
+        """Registra uma observação no histograma ``nome``."""
+        histogramas = self._fragmento().histogramas
+        baldes = self._baldes_por_nome.get(nome, self.baldes)
+        chave = (nome, _rotulos(rotulos))
+        contagens = histogramas.get(chave)
+        if contagens is None:
+            contagens = histogramas[chave] = [0.0] * (len(baldes) + 2)
+        contagens[bisect_left(baldes, valor)] += 1
+        contagens[-1] += valor
+
+    def _somar_fragmentos(self) -> _Fragmento:
+        with self._lock:
+            vivos = []
+            for thread, fragmento in self._fragmentos:
+                if thread.is_alive():
+                    vivos.append((thread, fragmento))
+                else:
+                    self._consolidado.juntar(fragmento)
+            self._fragmentos = vivos
+            total = _Fragmento()
+            total.juntar(self._consolidado)
+        # Leitura dos fragmentos vivos sem parar quem escreve (juntar copia
+        # antes de iterar); incrementos feitos durante a cópia entram na
+        # próxima exportação
+        for _, fragmento in vivos:
+            total.juntar(fragmento)
+        return total
+
+    def exportar(self) -> str:
+        total = self._somar_fragmentos()
+        por_nome: Dict[str, List[str]] = {}
+
+        for (nome, rotulos), valor in sorted(total.valores.items()):
+            por_nome.setdefault(nome, []).append(f"{nome}{_formatar_rotulos(rotulos)} {_numero(valor)}")
+        for coletor in self._coletores:
+            for nome, rotulos, valor in coletor():
+                por_nome.setdefault(nome, []).append(
+                    f"{nome}{_formatar_rotulos(_rotulos(rotulos))} {_numero(valor)}"
+                )
+        for (nome, rotulos), contagens in sorted(total.histogramas.items()):
+            linhas = por_nome.setdefault(nome, [])
+            baldes = self._baldes_por_nome.get(nome, self.baldes)
+            acumulado = 0.0
+            for limite, contagem in zip(baldes, contagens):
+                acumulado += contagem
+                linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, ('le', _numero(limite)))} {_numero(acumulado)}")
+            acumulado += contagens[len(baldes)]
+            linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, ('le', '+Inf'))} {_numero(acumulado)}")
+            linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {repr(contagens[-1])}")
+            linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {_numero(acumulado)}")
+
+        saida: List[str] = []
+        for nome in sorted(por_nome):
+            if nome in self._declaradas:
+                tipo, ajuda = self._declaradas[nome]
+                saida.append(f"# HELP {nome} {ajuda}")
+                saida.append(f"# TYPE {nome} {tipo}")
+            saida.extend(por_nome[nome])
+        return "\n".join(saida) + "\n"
@@ -0,0 +1,315 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+log = logging.getLogger("dyva.sql")
+
+# Rastreio opcional dos comandos SQL: DYVA_SQL_RASTREIO=1 liga a agregação por
+# impressão digital e o log de consultas lentas (acima de DYVA_SQL_LENTA_MS)
+RASTREIO_ATIVO = os.environ.get("DYVA_SQL_RASTREIO", "0") == "1"
+LIMIAR_LENTA_MS = float(os.environ.get("DYVA_SQL_LENTA_MS", "100"))
+# Modo de teste: EXPLAIN QUERY PLAN em cada comando, falhando em SCAN de
+# tabelas com pelo menos DYVA_SQL_PLANO_MIN_LINHAS linhas
+VERIFICAR_PLANOS = os.environ.get("DYVA_SQL_VERIFICAR_PLANOS", "0") == "1"
+PLANO_MIN_LINHAS = int(os.environ.get("DYVA_SQL_PLANO_MIN_LINHAS", "1000"))
+
+_RE_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_RE_ESPACOS = re.compile(r"\s+")
+_RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_GRUPOS = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+_RE_ALIAS = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|SET|LEFT|INNER|CROSS|USING|"
+    r"ORDER|GROUP|LIMIT|VALUES|SELECT|DEFAULT|NATURAL|WINDOW|UNION|HAVING|RETURNING)\b)(\w+))?",
+    re.I,
+)
+_RE_NULL = re.compile(r"\bNULL\b", re.I)
+_RE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+_RE_LIMIT = re.compile(r"\bLIMIT\b", re.I)
+_PREFIXOS_PLANO = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT", "REPLACE")
+
+
+def impressao_digital(sql: str) -> str:
+    """Forma normalizada do comando: literais viram ``?`` e listas de
+    parâmetros (``IN (?, ?, ?)``, ``VALUES (...), (...)``) são colapsadas,
+    para que variações do mesmo comando caiam na mesma linha do agregado."""
+    texto = _RE_COMENTARIOS.sub(" ", sql)
+    texto = _RE_TEXTO.sub("?", texto)
+    texto = _RE_NUMERO.sub("?", texto)
+    texto = _RE_ESPACOS.sub(" ", texto).strip()
+    texto = _RE_LISTA.sub("(?, ...)", texto)
+    return _RE_GRUPOS.sub("(?, ...), ...", texto)
+
+
+def _chave_trace(sql: str) -> str:
+    # O trace traz o SQL com os valores embutidos (None vira NULL)
+    return _RE_NULL.sub("?", impressao_digital(sql))
+
+
+def _nome_tipo(valor: Any) -> str:
+    return "None" if valor is None else type(valor).__name__
+
+
+def _compactar(tipos: List[str]) -> str:
+    partes: List[str] = []
+    for tipo in tipos:
+        if partes and partes[-1][0] == tipo:
+            partes[-1][1] += 1
+        else:
+            partes.append([tipo, 1])
+    return ", ".join(t if n == 1 else f"{t}×{n}" for t, n in partes)
+
+
+def forma_parametros(parametros: Any) -> str:
+    """Tipos dos parâmetros, sem os valores: ``(int, str×3, None)``."""
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{k}: {_nome_tipo(v)}" for k, v in parametros.items()) + "}"
+    if isinstance(parametros, (list, tuple)):
+        return "(" + _compactar([_nome_tipo(v) for v in parametros]) + ")"
+    return _nome_tipo(parametros)
+
+
+def _forma_lote(sequencia: Any) -> str:
+    if isinstance(sequencia, (list, tuple)):
+        return f"{len(sequencia)} × " + (forma_parametros(sequencia[0]) if sequencia else "()")
+    return "iterável"
+
+
+class PlanoComVarredura(AssertionError):
+    """Um comando varre (SCAN) uma tabela grande no modo de verificação de planos."""
+
+
+class EstatisticaSQL:
+    """Totais de uma impressão digital."""
+
+    __slots__ = ("execucoes", "segundos", "maximo", "lentas", "gatilhos")
+
+    def __init__(self) -> None:
+        self.execucoes = 0
+        self.segundos = 0.0
+        self.maximo = 0.0
+        self.lentas = 0
+        self.gatilhos = 0
+
+    def como_dict(self) -> Dict[str, Any]:
+        return {
+            "execucoes": self.execucoes,
+            "total_ms": round(self.segundos * 1000, 3),
+            "media_ms": round(self.segundos * 1000 / self.execucoes, 3) if self.execucoes else 0.0,
+            "max_ms": round(self.maximo * 1000, 3),
+            "lentas": self.lentas,
+            "gatilhos": self.gatilhos,
+        }
+
+
+class RastreadorSQL:
+    """Agrega por impressão digital os comandos medidos pelo ``CursorMedido``
+    de ``banco.py`` e registra as consultas lentas com a forma dos parâmetros.
+
+    O ``set_trace_callback`` de cada conexão complementa a medição: conta os
+    comandos que o módulo sqlite3 emite sozinho (BEGIN implícito, COMMIT) e,
+    em ``gatilhos``, os subcomandos (triggers, FTS5) rodados dentro de cada
+    comando. Esses aparecem só com contagem, sem tempo.
+
+    Com ``verificar_planos`` cada comando novo passa antes por
+    ``EXPLAIN QUERY PLAN``; um ``SCAN`` de tabela com ``minimo_linhas`` ou
+    mais levanta ``PlanoComVarredura`` (uso em testes e scripts de conferência).
+    """
+
+    def __init__(self, limiar_lenta_ms: float = LIMIAR_LENTA_MS, verificar_planos: bool = False,
+                 minimo_linhas: int = PLANO_MIN_LINHAS, ignorar_tabelas: Iterable[str] = ()) -> None:
+        self.limiar_lenta = limiar_lenta_ms / 1000.0
+        self.verificar_planos = verificar_planos
+        self.minimo_linhas = minimo_linhas
+        self.ignorar_tabelas = frozenset(t.lower() for t in ignorar_tabelas)
+        self._lock = threading.Lock()
+        self._estatisticas: Dict[str, EstatisticaSQL] = {}
+        self._local = threading.local()
+        self._planos_vistos: set = set()
+        self._linhas_tabela: Dict[str, int] = {}
+
+    # ---- trace callback ----
+
+    def instalar(self, conn: sqlite3.Connection) -> None:
+        """Liga o trace na conexão (uma vez por conexão e rastreador)."""
+        if getattr(conn, "_dyva_rastreador", None) is self:
+            return
+        conn._dyva_rastreador = self
+        conn.set_trace_callback(self._ao_rastrear)
+
+    def _ao_rastrear(self, texto: str) -> None:
+        local = self._local
+        if getattr(local, "interno", False) or _rastreador is not self:
+            return
+        atual = getattr(local, "atual", None)
+        if texto.startswith("-- "):
+            # Comandos internos (ex.: tabelas de apoio do FTS5) chegam comentados
+            if atual is not None:
+                local.internos += 1
+            else:
+                self._contar(texto, "-- " + impressao_digital(texto[3:]))
+        elif atual is not None and _chave_trace(texto) == atual:
+            # O comando medido aparece uma vez por execução (uma por linha no
+            # executemany) e de novo para cada trigger disparado
+            local.eventos += 1
+        else:
+            self._contar(texto)
+
+    def _contar(self, texto: str, chave: Optional[str] = None) -> None:
+        chave = chave or impressao_digital(texto)
+        with self._lock:
+            estatistica = self._estatisticas.get(chave)
+            if estatistica is None:
+                estatistica = self._estatisticas[chave] = EstatisticaSQL()
+            estatistica.execucoes += 1
+
+    # ---- chamados pelo CursorMedido ----
+
+    def antes(self, conn: sqlite3.Connection, sql: str, parametros: Any, varios: bool) -> None:
+        self.instalar(conn)
+        if self.verificar_planos:
+            self._verificar_plano(conn, sql, parametros, varios)
+        local = self._local
+        local.atual = _chave_trace(sql)
+        local.eventos = 0
+        local.internos = 0
+
+    def depois(self, sql: str, parametros: Any, segundos: float, varios: bool) -> None:
+        local = self._local
+        execucoes = len(parametros) if varios and isinstance(parametros, (list, tuple)) else 1
+        gatilhos = max(0, getattr(local, "eventos", 0) - execucoes) + getattr(local, "internos", 0)
+        local.atual = None
+        chave = impressao_digital(sql)
+        lenta = segundos >= self.limiar_lenta
+        with self._lock:
+            estatistica = self._estatisticas.get(chave)
+            if estatistica is None:
+                estatistica = self._estatisticas[chave] = EstatisticaSQL()
+            estatistica.execucoes += 1
+            estatistica.segundos += segundos
+            estatistica.gatilhos += gatilhos
+            if segundos > estatistica.maximo:
+                estatistica.maximo = segundos
+            if lenta:
+                estatistica.lentas += 1
+        if lenta:
+            log.warning("Consulta lenta", extra={"campos": {
+                "sql": chave,
+                "parametros": _forma_lote(parametros) if varios else forma_parametros(parametros),
+                "ms": round(segundos * 1000, 3),
+            }})
+
+    # ---- verificação de planos ----
+
+    def _contar_linhas(self, conn: sqlite3.Connection, tabela: str) -> Optional[int]:
+        if tabela in self._linhas_tabela:
+            return self._linhas_tabela[tabela]
+        cur = sqlite3.Cursor(conn)
+        existe = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+        ).fetchone()
+        linhas = cur.execute(f'SELECT COUNT(*) FROM "{tabela}"').fetchone()[0] if existe else None
+        self._linhas_tabela[tabela] = linhas
+        return linhas
+
+    def _verificar_plano(self, conn: sqlite3.Connection, sql: str, parametros: Any, varios: bool) -> None:
+        if not sql.lstrip().upper().startswith(_PREFIXOS_PLANO):
+            return
+        with self._lock:
+            if sql in self._planos_vistos:
+                return
+            self._planos_vistos.add(sql)
+        if varios:
+            if not isinstance(parametros, (list, tuple)) or not parametros:
+                return
+            parametros = parametros[0]
+        apelidos = {}
+        for tabela, apelido in _RE_ALIAS.findall(sql):
+            apelidos[(apelido or tabela).lower()] = tabela
+        self._local.interno = True
+        try:
+            plano = [r[3] for r in sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, parametros)]
+            varreduras = []
+            com_limite = bool(_RE_LIMIT.search(sql))
+            for detalhe in plano:
+                achado = _RE_SCAN.match(detalhe)
+                if not achado or "VIRTUAL TABLE" in achado.group(3):
+                    continue
+                if com_limite and "INDEX" in achado.group(3):
+                    # Percorre o índice já na ordem pedida e para no LIMIT
+                    continue
+                nome = achado.group(1)
+                tabela = nome if achado.group(2) else apelidos.get(nome.lower(), nome)
+                if tabela.lower() in self.ignorar_tabelas:
+                    continue
+                linhas = self._contar_linhas(conn, tabela)
+                if linhas is not None and linhas >= self.minimo_linhas:
+                    varreduras.append(f"{detalhe} [{tabela}: {linhas} linhas]")
+        finally:
+            self._local.interno = False
+        if varreduras:
+            raise PlanoComVarredura(
+                f"Varredura de tabela em: {impressao_digital(sql)}\n  " + "\n  ".join(varreduras)
+            )
+
+    # ---- consulta ----
+
+    def estatisticas(self, limite: int = 20, ordem: str = "total_ms") -> List[Dict[str, Any]]:
+        """As ``limite`` impressões digitais de maior ``ordem`` (total_ms,
+        execucoes, max_ms ou lentas)."""
+        with self._lock:
+            linhas = [dict(sql=chave, **e.como_dict()) for chave, e in self._estatisticas.items()]
+        linhas.sort(key=lambda l: l.get(ordem, 0), reverse=True)
+        return linhas[:limite]
+
+    def zerar(self) -> None:
+        with self._lock:
+            self._estatisticas.clear()
+
+
+_rastreador: Optional[RastreadorSQL] = None
+
+
+def rastreador_ativo() -> Optional[RastreadorSQL]:
+    return _rastreador
+
+
+def ativar(**opcoes: Any) -> RastreadorSQL:
+    """Liga o rastreio no processo (substitui o rastreador anterior)."""
+    global _rastreador
+    _rastreador = RastreadorSQL(**opcoes)
+    return _rastreador
+
+
+def desativar() -> None:
+    global _rastreador
+    _rastreador = None
+
+
+@contextmanager
+def verificando_planos(minimo_linhas: int = 0, ignorar_tabelas: Iterable[str] = ()) -> Iterator[RastreadorSQL]:
+    """Modo de teste: dentro do bloco, todo comando com SCAN de tabela com
+    ``minimo_linhas`` ou mais levanta ``PlanoComVarredura``.
+
+        with rastreio_sql.verificando_planos(ignorar_tabelas=["versoes"]):
+            cliente.get("/api/carrinho")
+    """
+    global _rastreador
+    anterior = _rastreador
+    rastreador = _rastreador = RastreadorSQL(
+        limiar_lenta_ms=anterior.limiar_lenta * 1000 if anterior else LIMIAR_LENTA_MS,
+        verificar_planos=True, minimo_linhas=minimo_linhas, ignorar_tabelas=ignorar_tabelas,
+    )
+    try:
+        yield rastreador
+    finally:
+        _rastreador = anterior
+
+
+if RASTREIO_ATIVO or VERIFICAR_PLANOS:
+    ativar(verificar_planos=VERIFICAR_PLANOS)
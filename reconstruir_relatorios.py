@@ -0,0 +1,15 @@
+# Script para recalcular as tabelas de resumo de vendas (relatórios do admin)
+import time
+import banco
+
+
+def reconstruir():
+    """Recalcula os resumos de vendas a partir de pedidos e pedido_itens."""
+    banco.inicializar_banco()
+    inicio = time.perf_counter()
+    banco.reconstruir_relatorios()
+    print(f"✅ Relatórios recalculados em {time.perf_counter() - inicio:.2f}s")
+
+
+if __name__ == "__main__":
+    reconstruir()
@@ -5,10 +5,14 @@ import banco
 def reset_para_apresentacao():
     """Reseta banco com dados limpos para apresentação"""
     
-    # Remove banco atual se existir
+    # Fecha conexões em uso e remove banco atual (e arquivos do WAL) se existir
+    banco.fechar_pool()
     if os.path.exists('dyva.db'):
         os.remove('dyva.db')
         print("✅ Banco anterior removido")
+    for sufixo in ('-wal', '-shm'):
+        if os.path.exists('dyva.db' + sufixo):
+            os.remove('dyva.db' + sufixo)
     
     # Recria estrutura
     banco.inicializar_banco()
@@ -0,0 +1,212 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as TempoEsgotado
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Custo do scrypt: n (CPU e memória, potência de 2), r (tamanho do bloco) e
+# p (paralelismo). Cada hash usa cerca de 128 * n * r bytes: 16 MiB no padrão
+SCRYPT_N = int(os.environ.get("DYVA_SENHA_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("DYVA_SENHA_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("DYVA_SENHA_SCRYPT_P", "1"))
+TAMANHO_SAL = 16
+TAMANHO_HASH = 32
+PREFIXO = "scrypt"
+
+# Pool de processos: quantos processos, quantas operações podem aguardar por
+# processo antes de recusar (503) e quanto uma requisição espera pelo resultado
+POOL_PROCESSOS = int(os.environ.get("DYVA_SENHA_PROCESSOS", str(os.cpu_count() or 1)))
+POOL_FILA_POR_PROCESSO = int(os.environ.get("DYVA_SENHA_FILA", "4"))
+POOL_ESPERA = float(os.environ.get("DYVA_SENHA_ESPERA", "5"))
+
+
+def _b64(dados: bytes) -> str:
+    return base64.b64encode(dados).decode("ascii").rstrip("=")
+
+
+def _de_b64(texto: str) -> bytes:
+    return base64.b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _scrypt(senha: str, sal: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        senha.encode("utf-8"), salt=sal, n=n, r=r, p=p,
+        maxmem=128 * n * r * p + 1024 * 1024 * 2, dklen=TAMANHO_HASH,
+    )
+
+
+def calcular_hash(senha: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    """Hash no formato ``scrypt$n$r$p$sal$hash`` (sal aleatório, base64 sem padding).
+
+    Os parâmetros ficam gravados em cada hash: aumentar o custo não invalida
+    senhas antigas, que são refeitas no próximo login (``precisa_rehash``).
+    """
+    sal = os.urandom(TAMANHO_SAL)
+    return f"{PREFIXO}${n}${r}${p}${_b64(sal)}${_b64(_scrypt(senha, sal, n, r, p))}"
+
+
+def _ler_hash(senha_hash: str) -> Optional[Tuple[int, int, int, bytes, bytes]]:
+    partes = senha_hash.split("$")
+    if len(partes) != 6 or partes[0] != PREFIXO:
+        return None
+    try:
+        return int(partes[1]), int(partes[2]), int(partes[3]), _de_b64(partes[4]), _de_b64(partes[5])
+    except ValueError:
+        return None
+
+
+def conferir_hash(senha: str, senha_hash: str) -> bool:
+    """Confere a senha; aceita também o SHA-256 sem sal dos cadastros antigos."""
+    lido = _ler_hash(senha_hash)
+    if lido is None:
+        legado = hashlib.sha256(senha.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legado, senha_hash)
+    n, r, p, sal, esperado = lido
+    return hmac.compare_digest(_scrypt(senha, sal, n, r, p), esperado)
+
+
+def precisa_rehash(senha_hash: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> bool:
+    """Verdadeiro para hashes legados ou feitos com outro custo."""
+    lido = _ler_hash(senha_hash)
+    return lido is None or lido[:3] != (n, r, p)
+
+
+def _conferir_e_refazer(senha: str, senha_hash: str, n: int, r: int, p: int) -> Tuple[bool, Optional[str]]:
+    # Roda no processo do pool: confere e, se preciso, já devolve o hash novo
+    if not conferir_hash(senha, senha_hash):
+        return False, None
+    return True, calcular_hash(senha, n, r, p) if precisa_rehash(senha_hash, n, r, p) else None
+
+
+class PoolOcupado(RuntimeError):
+    """Sem vaga no pool de hash de senhas (a requisição deve responder 503)."""
+
+
+class PoolSenhas:
+    """Pool limitado de processos para o scrypt, com recusa imediata quando cheio.
+
+    No máximo ``processos * fila_por_processo`` operações ficam em andamento ou
+    na fila; acima disso ``PoolOcupado`` é levantada na hora, sem prender a
+    thread da requisição. Com ``processos=0`` o hash roda na própria thread
+    (scripts e testes), ainda respeitando o limite de vagas. ``custo`` é o
+    ``(n, r, p)`` dos hashes novos; o padrão vem de ``DYVA_SENHA_SCRYPT_*``.
+    """
+
+    def __init__(self, processos: int = POOL_PROCESSOS, fila_por_processo: int = POOL_FILA_POR_PROCESSO,
+                 espera: float = POOL_ESPERA, custo: Tuple[int, int, int] = (SCRYPT_N, SCRYPT_R, SCRYPT_P)) -> None:
+        self.processos = max(0, int(processos))
+        self.custo = tuple(int(c) for c in custo)
+        self.espera = espera
+        self.vagas = max(1, self.processos) * max(1, int(fila_por_processo))
+        self._vagas = threading.BoundedSemaphore(self.vagas)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if self.processos:
+            # forkserver: os processos nascem de um servidor limpo, sem as threads
+            # e conexões SQLite do processo web
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(self.processos, mp_context=multiprocessing.get_context(metodo))
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self.concluidas = 0
+        self.recusadas = 0
+        self.falhas = 0
+
+    def _executar(self, funcao: Callable[..., Any], *args: Any) -> Any:
+        if not self._vagas.acquire(blocking=False):
+            with self._lock:
+                self.recusadas += 1
+            raise PoolOcupado("Pool de senhas ocupado")
+        if self._executor is None:
+            try:
+                return funcao(*args)
+            finally:
+                self._vagas.release()
+                with self._lock:
+                    self.concluidas += 1
+        try:
+            futuro: Future = self._executor.submit(funcao, *args)
+        except BaseException:
+            # Pool quebrado (BrokenProcessPool) ou encerrado: sem futuro, ninguém
+            # mais devolveria a vaga
+            self._vagas.release()
+            with self._lock:
+                self.falhas += 1
+            raise
+
+        def ao_terminar(_: Future) -> None:
+            # A vaga só volta quando o processo termina, mesmo se a requisição desistiu
+            self._vagas.release()
+            with self._lock:
+                self.concluidas += 1
+
+        futuro.add_done_callback(ao_terminar)
+        try:
+            return futuro.result(timeout=self.espera)
+        except TempoEsgotado:
+            with self._lock:
+                self.recusadas += 1
+            raise PoolOcupado("Tempo esgotado aguardando o pool de senhas")
+
+    def gerar(self, senha: str) -> str:
+        return self._executar(calcular_hash, senha, *self.custo)
+
+    def verificar(self, senha: str, senha_hash: str) -> Tuple[bool, Optional[str]]:
+        """``(confere, hash_novo)``: ``hash_novo`` vem preenchido quando o hash
+        gravado é legado ou de outro custo e deve ser substituído."""
+        return self._executar(_conferir_e_refazer, senha, senha_hash, *self.custo)
+
+    def fechar(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "processos": self.processos,
+                "vagas": self.vagas,
+                "concluidas": self.concluidas,
+                "recusadas": self.recusadas,
+                "falhas": self.falhas,
+                "custo": dict(zip(("n", "r", "p"), self.custo)),
+            }
+
+
+_pool: Optional[PoolSenhas] = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool() -> PoolSenhas:
+    """Pool do processo atual (criado no primeiro uso, recriado após um fork)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = PoolSenhas()
+        return _pool
+
+
+def fechar_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.fechar()
+        _pool = None
+
+
+def estatisticas_pool() -> Optional[Dict[str, Any]]:
+    """Estatísticas do pool deste processo, sem criá-lo (``None`` se não existe)."""
+    pool = _pool
+    return pool.estatisticas() if pool is not None and pool.pid == os.getpid() else None
+
+
+def hash_senha(senha: str) -> str:
+    """Gera o hash no pool; levanta ``PoolOcupado`` se não houver vaga."""
+    return obter_pool().gerar(senha)
+
+
+def verificar_senha(senha: str, senha_hash: str) -> Tuple[bool, Optional[str]]:
+    """Confere no pool; levanta ``PoolOcupado`` se não houver vaga."""
+    return obter_pool().verificar(senha, senha_hash)
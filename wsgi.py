@@ -0,0 +1,10 @@
+"""Ponto de entrada WSGI do perfil de produção: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+Cada worker importa este módulo depois do fork e monta a própria aplicação,
+com pool SQLite, logs, coletor de reservas e pool de senhas próprios. As
+migrações e os dados iniciais já rodaram no master (``on_starting`` em
+gunicorn.conf.py).
+"""
+from app import criar_app
+
+app = criar_app(inicializar=False)